@@ -8,31 +8,45 @@
 #sudo pip3 install adafruit-circuitpython-ssd1306
 #pip3 install adafruit-blinka
 #sudo apt-get install python3-pil
-#sudo pip3 install psutil
-#sudo pip3 install requests
 #sudo pip3 install gpiozero
 
 # Import libraries
 
 # import for modules that are standard to python3
-import argparse, os, sys, json, traceback, time, datetime, asyncio, threading
+import argparse, os, sys, json, traceback, time, datetime, asyncio, signal
+import base64, hashlib, struct, random, re, gzip, bisect, functools
+from array import array
 from queue import Queue
-from collections import deque
+from collections import deque, OrderedDict
+from urllib.parse import quote, urlencode
 
-# import websocket-client
-try:
-    import websocket
-except:
-    print("Failed to load websocket python3 module. Install using 'pip3 install websocket-client'")
-    sys.exit(1)
+# startup milestones are measured from here
+startup_clock = time.perf_counter()
 
-# import requests
+# optional fast json backend for the eventbus, falls back to the standard library
 try:
-    import requests
+    import orjson
+    json_loads = orjson.loads
 except:
-    print("Failed to load requests python3 module. Install using 'pip3 install requests'")
-    sys.exit(1)
+    try:
+        import ujson
+        json_loads = ujson.loads
+    except:
+        json_loads = json.loads
+
+# optional numpy for scaling the packet rate graph, imported on first use as it
+# takes longer to import than the rest of the program
+numpy = None
+numpy_missing = False
 
+def load_numpy():
+    global numpy, numpy_missing
+    if numpy == None and not numpy_missing:
+        try:
+            import numpy
+        except:
+            numpy_missing = True
+    return numpy
 
 # import pyYaml
 # yaml files allow comments for config documentations.
@@ -54,17 +68,46 @@ class configuration(object):
             self.parser.add_argument('-p',"--password", action="store", dest="password", help="Kismet password for websocket eventbus")
             self.parser.add_argument("--uri-prefix", action="store", dest="uri_prefix", help="Kismet httpd uri prefix")
             self.parser.add_argument("--disable-reconnect", action="store_true", dest="no_reconnect", help="disable websocket reconnect")
-            self.parser.add_argument("--reconnect-delay", action="store", type=int, dest="reconnect_delay", help="websocket reconnect delay (seconds)")
+            self.parser.add_argument("--reconnect-delay", action="store", type=int, dest="reconnect_delay", help="websocket reconnect delay (seconds) in paced reconnect mode")
+            self.parser.add_argument("--paced-reconnect", action="store_true", dest="paced_reconnect", help="subscribe one topic per second and use a fixed reconnect delay")
             self.parser.add_argument("--disable-lpm", action="store_true", dest="no_lpm", help="disable all local process management")
             self.parser.add_argument("--disable-gpio", action="store_true", dest="no_gpio", help="disable all gpio usage")
             self.parser.add_argument("--disable-gpio-buttons", action="store_true", dest="no_buttons", help="disable gpio button usage")
             self.parser.add_argument("--disable-gpio-leds", action="store_true", dest="no_leds", help="disable gpio led usage")
             self.parser.add_argument("--disable-i2c-display", action="store_true", dest="no_i2c", help="disable i2c display")
+            self.parser.add_argument("--alert-window", action="store", type=float, dest="alert_window", help="seconds to merge discovery alerts into one summary, 0 disables")
             self.parser.add_argument("--disable-stdout-msg", action="store_true", dest="no_stdout", help="disable writing messages to stdout")
+            self.parser.add_argument("--benchmark", action="store", dest="benchmark", choices=sorted(benchmarks.keys()), help="run a micro-benchmark and exit")
+            self.parser.add_argument("--supervisor-test", action="store_true", dest="supervisor_test", help="run the kismet supervisor against dummy child processes and exit")
+            self.parser.add_argument("--bench-frames", action="store", dest="bench_frames", help="--record capture or file of eventbus frames, one per line, for --benchmark parse and classify")
+            self.parser.add_argument("--virtual-hardware", action="store_true", dest="virtual_hardware", help="use in-memory display, leds, neopixels and buttons instead of real hardware")
+            self.parser.add_argument("--dump-frames", action="store", dest="dump_frames", help="directory the virtual display writes frames to as PNG")
+            self.parser.add_argument("--metrics-port", action="store", type=int, dest="metrics_port", help="enable metrics and serve them in prometheus text format on this port")
+            self.parser.add_argument("--status-port", action="store", type=int, dest="status_port", help="enable the status page and serve it with its event stream on this port")
+            self.parser.add_argument("--trace", action="store", dest="trace", help="trace eventloop callbacks and write a chrome trace to this file on SIGUSR1 and exit")
+            self.parser.add_argument("--trace-slow-ms", action="store", type=float, dest="trace_slow_ms", help="log traced callbacks that run longer than this")
+            self.parser.add_argument("--record", action="store", dest="record", help="record raw eventbus frames to a gzip jsonl capture file")
+            self.parser.add_argument("--fake-kismet", action="store", nargs="+", dest="fake_kismet", help="replay capture files through local fake kismet servers, one source each, and report throughput")
+            self.parser.add_argument("--replay-speed", action="store", type=float, dest="replay_speed", default=1.0, help="capture replay speed multiplier, 0 replays as fast as possible")
+            self.parser.add_argument("--replay-stall", action="store", dest="replay_stall", metavar="AT:SECONDS[:drop]", help="stall the --fake-kismet replay AT capture seconds in for SECONDS, with drop it also stops answering pings")
+            self.parser.add_argument("--fake-kismet-serve", action="store_true", dest="fake_kismet_serve", help="only serve --fake-kismet on the configured kismet address and port")
             self.parser.add_argument("--debug", action="store_true", dest="debug", help="enable debug messages")
             self.parser.add_argument("--debug-ws", action="store_true", dest="debug_ws", help="enable websocket debug messages")
             cmd_args = self.parser.parse_args()
 
+            self.benchmark = cmd_args.benchmark
+            self.supervisor_test = cmd_args.supervisor_test
+            self.bench_frames = cmd_args.bench_frames
+            self.record = cmd_args.record
+            self.fake_kismet = cmd_args.fake_kismet
+            self.replay_speed = cmd_args.replay_speed
+            self.fake_kismet_serve = cmd_args.fake_kismet_serve
+            if cmd_args.replay_stall != None:
+                stall = cmd_args.replay_stall.split(":")
+                self.replay_stall = (float(stall[0]), float(stall[1]), stall[2] if len(stall) > 2 else "freeze")
+            else:
+                self.replay_stall = None
+
             # read configuration file
             self.config_file = cmd_args.config_file
             if not os.path.isfile(os.path.expanduser(self.config_file)):
@@ -151,8 +194,31 @@ class configuration(object):
                     print("Setting to ''")
                     self.uri_prefix = ''
 
+            # the kismet_httpd server is the first source, kismet_sources adds more servers that
+            # default to its port, username and password
+            primary = { 'name': "kismet", 'label': "WS", 'address': self.address, 'port': self.port,
+                        'username': self.username, 'password': self.password }
+            if 'kismet_httpd' in conf_data.keys():
+                for key in ('name', 'label'):
+                    if key in conf_data['kismet_httpd'].keys():
+                        primary[key] = conf_data['kismet_httpd'][key]
+            self.sources = [primary]
+            if 'kismet_sources' in conf_data.keys() and conf_data['kismet_sources']:
+                for src in conf_data['kismet_sources']:
+                    if not 'name' in src.keys() or not 'address' in src.keys():
+                        print("ERROR: 'kismet_sources' entries need a 'name' and an 'address'. Skipping:")
+                        print(src)
+                        continue
+                    if src['name'] in [source['name'] for source in self.sources]:
+                        print("ERROR: 'kismet_sources' name '{}' is used twice. Skipping.".format(src['name']))
+                        continue
+                    source = dict(primary)
+                    source['label'] = str(src['name'])[:2].upper()
+                    source.update(src)
+                    self.sources.append(source)
+
             if cmd_args.no_reconnect:
-                self.enable_reconnect = False
+                self.reconnect = False
             else:
                 try: self.reconnect = conf_data['kismet_httpd']['reconnect']
                 except Exception as err:
@@ -173,6 +239,23 @@ class configuration(object):
                     print("Setting to 3")
                     self.reconnect_delay = 3
 
+            # keys added since the first config.yaml are optional and default quietly, older
+            # config files do not have them
+            httpd = conf_data.get('kismet_httpd') or {}
+            self.rest_timeout = httpd.get('rest_timeout', 5)
+            self.status_ttl = httpd.get('status_ttl', 60)
+            self.watchdog = httpd.get('watchdog', 3)
+            self.ping_interval = httpd.get('ping_interval', 1)
+            self.device_sync = httpd.get('device_sync', True)
+            self.device_poll = httpd.get('device_poll', [2, 30])
+            self.device_limit = httpd.get('device_limit', 50000)
+            self.device_window = httpd.get('device_window', 300)
+            if cmd_args.paced_reconnect:
+                self.fast_reconnect = False
+            else:
+                self.fast_reconnect = httpd.get('fast_reconnect', True)
+            self.reconnect_backoff = httpd.get('reconnect_backoff', [0.25, 30])
+
             if cmd_args.no_lpm:
                 self.local_process_management = { "enabled": False }
             else:
@@ -212,6 +295,12 @@ class configuration(object):
                     print("Disabling.")
                     self.i2c_display = { "enabled": False }
 
+            if cmd_args.virtual_hardware:
+                self.local_gpio['virtual'] = True
+                self.i2c_display['driver'] = "virtual"
+            if cmd_args.dump_frames != None:
+                self.i2c_display['png_dir'] = cmd_args.dump_frames
+
             if cmd_args.no_stdout:
                 self.data_to_stdout = False
             else:
@@ -223,6 +312,30 @@ class configuration(object):
                     print("Enabling.")
                     self.data_to_stdout = True
 
+            if cmd_args.alert_window != None:
+                self.alert_window = cmd_args.alert_window
+            else:
+                self.alert_window = conf_data.get('alert_window', 2)
+
+            self.metrics = conf_data.get('metrics') or { "enabled": False }
+            if cmd_args.metrics_port != None:
+                self.metrics['enabled'] = True
+                self.metrics['port'] = cmd_args.metrics_port
+
+            self.status_server = conf_data.get('status_server') or { "enabled": False }
+            if cmd_args.status_port != None:
+                self.status_server['enabled'] = True
+                self.status_server['port'] = cmd_args.status_port
+
+            self.health = conf_data.get('health') or { "enabled": False }
+
+            self.trace = conf_data.get('trace') or { "buffer_size": 100000, "slow_ms": 20 }
+            self.trace['file'] = cmd_args.trace
+            if cmd_args.trace_slow_ms != None:
+                self.trace['slow_ms'] = cmd_args.trace_slow_ms
+
+            self.message_rules = conf_data.get('message_rules', default_message_rules)
+
             if cmd_args.debug_ws:
                 self.debug_ws = True
             else:
@@ -232,7 +345,239 @@ class configuration(object):
                     print(err)
                     print("Unable to find configuration for debug_ws!")
                     print("Disabling.")
-                    self.data_to_stdout = False
+                    self.debug_ws = False
+
+# metrics registry, created in main when metrics are enabled
+metrics = None
+
+# cumulative histogram with fixed upper bounds in seconds
+class histogram(object):
+    default_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets if buckets != None else self.default_buckets
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# counters, histograms and pulled gauges, exposed in prometheus text format. each family
+# has at most one label. gauges call a function at exposition time so existing counters
+# on the controllers are reported without copying them on every change.
+class metrics_registry(object):
+    prefix = "mobilemonitor_"
+
+    def __init__(self, lag_interval=0.5, rate_window=10):
+        self.families = OrderedDict()
+        self.lag_interval = lag_interval
+        self.lag_handle = None
+        self.lag_due = 0
+        self.rates = {}
+        self.rate_window = max(2, int(rate_window / lag_interval))
+
+        self.counter("events_total", "Events emitted by type", "type")
+        self.histogram("callback_seconds", "Event callback run time by callback", "callback")
+        self.histogram("loop_lag_seconds", "Delay of a timer callback past its due time")
+        self.histogram("display_draw_seconds", "Time drawing dirty display bands per frame")
+        self.histogram("display_push_seconds", "Time pushing a frame to the display")
+        self.histogram("animation_tick_seconds", "Time for one led and pixel animation tick")
+        self.histogram("pixel_show_seconds", "Time for one neopixel strip show()")
+        self.histogram("ws_stall_detect_seconds", "Eventbus silence before the watchdog dropped the connection",
+                       buckets=(1, 2, 3, 4, 5, 7.5, 10, 15, 30, 60))
+
+    def counter(self, name, help_text, label=None):
+        self.families[name] = ["counter", help_text, label, {}]
+
+    def histogram(self, name, help_text, label=None, buckets=None):
+        self.families[name] = ["histogram", help_text, label, {}, buckets]
+
+    # fn returns a number, or a dict of label value to number when label is set
+    def gauge(self, name, help_text, fn, label=None, kind="gauge"):
+        self.families[name] = [kind, help_text, label, fn]
+
+    # per-second rate of a growing value, sampled on every loop lag tick
+    def rate(self, name, help_text, fn):
+        self.rates[name] = (fn, deque(maxlen=self.rate_window))
+        self.gauge(name, help_text, lambda: self.rate_value(name))
+
+    def rate_value(self, name):
+        samples = self.rates[name][1]
+        if len(samples) < 2 or samples[-1][0] == samples[0][0]:
+            return 0
+        return (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0])
+
+    def inc(self, name, label_value=None, value=1):
+        values = self.families[name][3]
+        values[label_value] = values.get(label_value, 0) + value
+
+    def observe(self, name, value, label_value=None):
+        family = self.families[name]
+        hist = family[3].get(label_value)
+        if hist == None:
+            hist = family[3][label_value] = histogram(family[4])
+        hist.observe(value)
+
+    # run an event callback and record how long it took
+    def timed(self, cb, *args):
+        start = time.perf_counter()
+        try:
+            cb(*args)
+        finally:
+            self.observe("callback_seconds", time.perf_counter() - start, getattr(cb, "__qualname__", repr(cb)))
+
+    # a timer that should fire every lag_interval, how late it runs is the loop lag
+    def start(self):
+        self.lag_due = eventloop.time() + self.lag_interval
+        self.lag_handle = eventloop.call_at(self.lag_due, self.lag_tick)
+
+    def stop(self):
+        if self.lag_handle != None:
+            self.lag_handle.cancel()
+            self.lag_handle = None
+
+    def lag_tick(self):
+        now = eventloop.time()
+        self.observe("loop_lag_seconds", max(0, now - self.lag_due))
+        for (fn, samples) in self.rates.values():
+            samples.append((now, fn()))
+        self.lag_due = now + self.lag_interval
+        self.lag_handle = eventloop.call_at(self.lag_due, self.lag_tick)
+
+    @staticmethod
+    def labels(label, value, extra=None):
+        pairs = []
+        if label != None and value != None:
+            pairs.append('{}="{}"'.format(label, str(value).replace("\\", "\\\\").replace('"', '\\"')))
+        if extra != None:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def exposition(self):
+        lines = []
+        for (name, family) in self.families.items():
+            (kind, help_text, label) = family[:3]
+            full = self.prefix + name
+            lines.append("# HELP {} {}".format(full, help_text))
+            lines.append("# TYPE {} {}".format(full, kind))
+            if kind == "histogram":
+                for (value, hist) in family[3].items():
+                    cumulative = 0
+                    for (bound, cnt) in zip(hist.buckets + ("+Inf",), hist.counts):
+                        cumulative += cnt
+                        lines.append("{}_bucket{} {}".format(full, self.labels(label, value, 'le="{}"'.format(bound)), cumulative))
+                    lines.append("{}_sum{} {}".format(full, self.labels(label, value), hist.sum))
+                    lines.append("{}_count{} {}".format(full, self.labels(label, value), hist.count))
+                continue
+            values = family[3]() if callable(family[3]) else family[3]
+            if not isinstance(values, dict):
+                values = {None: values}
+            for (value, number) in values.items():
+                if number != None:
+                    lines.append("{}{} {}".format(full, self.labels(label, value), number))
+        return "\n".join(lines) + "\n"
+
+    # write the exposition to path every interval, in the node_exporter textfile format
+    def write_stats_file(self, path, interval):
+        path = os.path.expanduser(path)
+        try:
+            with open(path + ".tmp", "w") as stats_file:
+                stats_file.write(self.exposition())
+            os.replace(path + ".tmp", path)
+        except OSError as err:
+            print("metrics: failed to write stats file {}: {}".format(path, err))
+        eventloop.call_later(interval, self.write_stats_file, path, interval)
+
+    # plain http server answering GET /metrics
+    async def serve(self, host, port):
+        return await asyncio.start_server(self.handle, host, int(port))
+
+    async def handle(self, reader, writer):
+        try:
+            head = (await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)).decode("latin-1")
+            target = head.split(" ")[1] if " " in head else ""
+            if target.split("?")[0] == "/metrics":
+                (status, body) = ("200 OK", self.exposition().encode())
+            else:
+                (status, body) = ("404 Not Found", b"")
+            writer.write(("HTTP/1.1 {}\r\n"
+                          "Content-Type: text/plain; version=0.0.4\r\n"
+                          "Content-Length: {}\r\n"
+                          "Connection: close\r\n\r\n").format(status, len(body)).encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+# callback tracer, created in main with --trace
+tracer = None
+
+# records every callback run through eventloop.call_soon and call_at (call_later goes
+# through call_at) plus explicit spans, keeping the newest in a ring buffer. callbacks
+# running longer than slow seconds are logged as they happen. dumps chrome trace-event
+# json, viewable in chrome://tracing or ui.perfetto.dev.
+class callback_tracer(object):
+    def __init__(self, path, size=100000, slow=0.02):
+        self.path = os.path.expanduser(path)
+        self.spans = deque(maxlen=size)
+        self.slow = slow
+        self.origin = time.perf_counter()
+        self.slow_count = 0
+        self.dumps = 0
+
+    def install(self, loop):
+        call_soon = loop.call_soon
+        call_at = loop.call_at
+        def traced_call_soon(callback, *args, **kwargs):
+            return call_soon(self.wrap(callback, "call_soon"), *args, **kwargs)
+        def traced_call_at(when, callback, *args, **kwargs):
+            return call_at(when, self.wrap(callback, "timer"), *args, **kwargs)
+        loop.call_soon = traced_call_soon
+        loop.call_at = traced_call_at
+
+    # readable name for a callback, task steps are named after their coroutine and event
+    # handlers timed by the metrics registry after the handler in args
+    @staticmethod
+    def name(callback, args=()):
+        owner = getattr(callback, "__self__", None)
+        if isinstance(owner, asyncio.Task):
+            return "Task " + getattr(owner.get_coro(), "__qualname__", "?")
+        if isinstance(owner, metrics_registry) and getattr(callback, "__func__", None) is metrics_registry.timed and len(args) > 0:
+            callback = args[0]
+        if hasattr(callback, "func"):
+            callback = callback.func
+        return getattr(callback, "__qualname__", None) or type(callback).__name__
+
+    def wrap(self, callback, cat):
+        def traced(*args):
+            start = time.perf_counter()
+            try:
+                return callback(*args)
+            finally:
+                self.record(self.name(callback, args), cat, start, time.perf_counter())
+        return traced
+
+    def record(self, name, cat, start, end):
+        self.spans.append((name, cat, start, end))
+        if end - start > self.slow:
+            self.slow_count += 1
+            print("tracer: slow {} {} took {:.1f} ms".format(cat, name, (end - start) * 1000))
+
+    def dump(self):
+        pid = os.getpid()
+        trace = []
+        for (name, cat, start, end) in list(self.spans):
+            trace.append({ "name": name, "cat": cat, "ph": "X", "pid": pid, "tid": 1,
+                           "ts": round((start - self.origin) * 1e6, 1),
+                           "dur": round((end - start) * 1e6, 1) })
+        with open(self.path, "w") as trace_file:
+            json.dump({ "traceEvents": trace, "displayTimeUnit": "ms" }, trace_file)
+        self.dumps += 1
+        print("tracer: wrote {} spans to {} ({} slow)".format(len(trace), self.path, self.slow_count))
 
 # class for event defs and control
 class event_control(object):
@@ -243,9 +588,32 @@ class event_control(object):
                           'new_ssid': [],
                           'new_ap': [],
                           'new_device': [],
+                          'new_bt_device': [],
+                          'kismet_alert': [],
                           'new_disp_msg': [],
+                          'device_counts': [],
+                          'kismet_state': [],
+                          'thermal': [],
+                          'voltage': [],
                           'error_state': [] }
 
+        # events since the last displayed frame, for event to frame latency
+        self.emitted = 0
+        self.pending_since = None
+        self.frame_latency = deque(maxlen=10000)
+
+        # seconds from start to connected, first kismet event and first frame
+        self.startup = {}
+
+        # events emitted between hold and release, dispatched in order on release
+        self.held = None
+
+    # record a startup milestone the first time it is reached
+    def milestone(self, name):
+        if not name in self.startup:
+            self.startup[name] = time.perf_counter() - startup_clock
+            print("Startup: {} after {:.2f}s".format(name, self.startup[name]))
+
     def btn_status(self):
         print("Show status!")
 
@@ -258,19 +626,385 @@ class event_control(object):
             print("Error state cleared!")
 
     def wsc_new(self, event):
+        self.emitted += 1
+        if self.pending_since == None:
+            self.pending_since = time.monotonic()
+        if len(self.startup) < 3:
+            if event['type'] == "ws_connected":
+                if event['state'] == 2:
+                    self.milestone("connected")
+            elif "connected" in self.startup and event['type'] != "error_state":
+                self.milestone("first event")
         if config.debug and event['type'] != "new_ts": # timestamp excessive in debugging
             print("Websocket event: " + str(event))
+        if self.held != None:
+            self.held.append(event)
+            return
+        self.dispatch(event)
+
+    def dispatch(self, event):
+        if metrics != None:
+            metrics.inc("events_total", event['type'])
+            for cb in self.ws_event[event['type']]:
+                eventloop.call_soon(metrics.timed, cb, event, False)
+            return
         for cb in self.ws_event[event['type']]:
             eventloop.call_soon(cb, event, False)
 
+    # keep events back while consumers are still being registered at startup
+    def hold(self):
+        if self.held == None:
+            self.held = []
+
+    def release(self):
+        (held, self.held) = (self.held, None)
+        for event in held or []:
+            self.dispatch(event)
+
+    # a frame reached the display, everything emitted before it has been shown
+    def frame_shown(self):
+        if len(self.startup) < 3:
+            self.milestone("first frame")
+        if self.pending_since != None:
+            self.frame_latency.append(time.monotonic() - self.pending_since)
+            self.pending_since = None
+
+# decoder used to pull single values out of raw eventbus frames
+json_decoder = json.JSONDecoder()
+
+# decode only the value of "key" in a raw json string, searching from start
+# returns (value, index of key) and raises KeyError if the key is not found before end
+def json_field(raw, key, start=0, end=-1):
+    idx = raw.find('"' + key + '"', start)
+    if idx == -1 or (end != -1 and idx > end):
+        raise KeyError(key)
+    val = raw.index(":", idx + len(key) + 2) + 1
+    while raw[val] in " \t\r\n":
+        val += 1
+    return (json_decoder.raw_decode(raw, val)[0], idx)
+
+# error for a websocket upgrade that did not return 101
+class ws_handshake_error(Exception):
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+        super().__init__("Websocket handshake failed: {} {}".format(status, reason))
+
+# minimal RFC 6455 websocket framing on top of asyncio streams
+class ws_stream(object):
+    OP_CONT = 0x0
+    OP_TEXT = 0x1
+    OP_BINARY = 0x2
+    OP_CLOSE = 0x8
+    OP_PING = 0x9
+    OP_PONG = 0xA
+
+    # clients must mask every frame they send, servers must not
+    def __init__(self, reader, writer, mask=True):
+        self.reader = reader
+        self.writer = writer
+        self.mask = mask
+        self.closed = False
+        # pings carry the send time, pongs give the round trip
+        self.last_pong = None
+        self.rtt = None
+
+    # XOR payload with the 4 byte masking key
+    @staticmethod
+    def apply_mask(key, payload):
+        ln = len(payload)
+        if ln == 0:
+            return payload
+        key_stream = (key * (ln // 4 + 1))[:ln]
+        return (int.from_bytes(payload, "big") ^ int.from_bytes(key_stream, "big")).to_bytes(ln, "big")
+
+    def send_frame(self, opcode, payload):
+        if self.closed:
+            return
+        ln = len(payload)
+        mask_bit = 0x80 if self.mask else 0
+        if ln < 126:
+            hdr = struct.pack("!BB", 0x80 | opcode, mask_bit | ln)
+        elif ln < 65536:
+            hdr = struct.pack("!BBH", 0x80 | opcode, mask_bit | 126, ln)
+        else:
+            hdr = struct.pack("!BBQ", 0x80 | opcode, mask_bit | 127, ln)
+        if self.mask:
+            key = os.urandom(4)
+            self.writer.write(hdr + key + self.apply_mask(key, payload))
+        else:
+            self.writer.write(hdr + payload)
+
+    # queue a text frame, writes are buffered by the transport
+    def send(self, text):
+        self.send_frame(self.OP_TEXT, text.encode())
+
+    def ping(self, payload=None):
+        if payload == None:
+            payload = struct.pack("!d", time.monotonic())
+        self.send_frame(self.OP_PING, payload)
+
+    # returns the next data message (str for text, bytes for binary) or None once closed
+    async def recv(self):
+        fragments = []
+        msg_op = self.OP_TEXT
+        while True:
+            hdr = await self.reader.readexactly(2)
+            fin = hdr[0] & 0x80
+            opcode = hdr[0] & 0x0f
+            ln = hdr[1] & 0x7f
+            if ln == 126:
+                ln = struct.unpack("!H", await self.reader.readexactly(2))[0]
+            elif ln == 127:
+                ln = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+            key = await self.reader.readexactly(4) if hdr[1] & 0x80 else None
+            payload = await self.reader.readexactly(ln)
+            if key is not None:
+                payload = self.apply_mask(key, payload)
+
+            # control frames can arrive between fragments
+            if opcode == self.OP_PING:
+                self.send_frame(self.OP_PONG, payload)
+                continue
+            if opcode == self.OP_PONG:
+                self.last_pong = time.monotonic()
+                if ln == 8:
+                    self.rtt = self.last_pong - struct.unpack("!d", payload)[0]
+                continue
+            if opcode == self.OP_CLOSE:
+                if not self.closed:
+                    self.send_frame(self.OP_CLOSE, payload[:2])
+                    self.closed = True
+                return None
+
+            if opcode != self.OP_CONT:
+                msg_op = opcode
+            fragments.append(payload)
+            if fin:
+                data = b"".join(fragments)
+                if msg_op == self.OP_TEXT:
+                    return data.decode("utf-8")
+                return data
+
+    def close(self, code=1000):
+        if not self.closed:
+            self.send_frame(self.OP_CLOSE, struct.pack("!H", code))
+            self.closed = True
+        self.writer.close()
+
+    # drop the connection without a closing handshake, a pending recv fails at once
+    def abort(self):
+        self.closed = True
+        self.writer.transport.abort()
+
+# open a websocket client connection, returns a ws_stream
+async def ws_open(host, port, path, timeout=10):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port)), timeout)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(("GET {} HTTP/1.1\r\n"
+                  "Host: {}:{}\r\n"
+                  "Upgrade: websocket\r\n"
+                  "Connection: Upgrade\r\n"
+                  "Sec-WebSocket-Key: {}\r\n"
+                  "Sec-WebSocket-Version: 13\r\n\r\n").format(path, host, port, key).encode())
+    try:
+        resp = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    except Exception:
+        writer.close()
+        raise
+    lines = resp.decode("latin-1").split("\r\n")
+    status_line = lines[0].split(" ", 2)
+    status = int(status_line[1]) if len(status_line) > 1 and status_line[1].isdigit() else 0
+    if status != 101:
+        writer.close()
+        raise ws_handshake_error(status, status_line[2] if len(status_line) > 2 else "")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            (name, value) = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    accept = base64.b64encode(hashlib.sha1((key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest()).decode()
+    if headers.get("sec-websocket-accept") != accept:
+        writer.close()
+        raise ws_handshake_error(status, "bad Sec-WebSocket-Accept")
+    return ws_stream(reader, writer, mask=True)
+
+# merges discovery alerts into summaries. the first alert after a quiet window goes out
+# as is and opens a window, alerts inside it are counted and sent as one summary message
+# and one event per type (with 'count') when it closes. the window stays open while
+# alerts keep arriving, so a flood produces one summary and one led flash per window.
+class alert_aggregator(object):
+    labels = { 'new_ssid': ("SSID", "SSIDs"),
+               'new_ap': ("AP", "APs"),
+               'new_device': ("device", "devices"),
+               'new_bt_device': ("BT device", "BT devices"),
+               'kismet_alert': ("alert", "alerts") }
+
+    # emit sends the events, the connector's emit tags them with its source
+    def __init__(self, window, emit=None):
+        self.window = window
+        self.emit = emit if emit != None else events.wsc_new
+        self.pending = {}
+        self.pending_ts = -1
+        self.totals = {}
+        self.summaries = 0
+        self.window_handle = None
+
+    # payload holds extra event fields from the message rule, such as crypt
+    def add(self, ev_type, text, ts, payload=None):
+        self.totals[ev_type] = self.totals.get(ev_type, 0) + 1
+        if self.window_handle == None:
+            self.emit({'type': "new_disp_msg", 'text': text, 'ts': ts, 'class': 'discovery'})
+            event = {'type': ev_type, 'ts': ts, 'count': 1}
+            if payload:
+                event.update(payload)
+            self.emit(event)
+            if self.window > 0:
+                self.window_handle = eventloop.call_later(self.window, self.close_window)
+        else:
+            if ev_type in self.pending:
+                self.pending[ev_type][0] += 1
+            else:
+                self.pending[ev_type] = [1, {}]
+            if payload:
+                self.merge_payload(self.pending[ev_type][1], payload)
+            self.pending_ts = ts
+
+    # a summary carries the most alarming crypt class seen in its window
+    @staticmethod
+    def merge_payload(into, payload):
+        for (key, val) in payload.items():
+            if key == 'crypt' and key in into and crypt_classes.index(into[key]) <= crypt_classes.index(val):
+                continue
+            into[key] = val
+
+    def summary(self, counts):
+        parts = []
+        for (ev_type, cnt) in sorted(counts.items(), key=lambda item: -item[1]):
+            (one, many) = self.labels.get(ev_type, (ev_type, ev_type))
+            parts.append("+{} {}".format(cnt, one if cnt == 1 else many))
+        return ", ".join(parts)
+
+    def close_window(self):
+        self.window_handle = None
+        if not self.pending:
+            return
+        (pending, self.pending) = (self.pending, {})
+        self.summaries += 1
+        counts = { ev_type: item[0] for (ev_type, item) in pending.items() }
+        self.emit({'type': "new_disp_msg", 'text': self.summary(counts), 'ts': self.pending_ts, 'class': 'discovery'})
+        for (ev_type, (cnt, payload)) in pending.items():
+            event = {'type': ev_type, 'ts': self.pending_ts, 'count': cnt}
+            event.update(payload)
+            self.emit(event)
+        self.window_handle = eventloop.call_later(self.window, self.close_window)
+
+# kismet messagebus flag set on messages raised by alerts
+msgflag_alert = 8
+
+# message rules used when config.yaml has none, table order is priority
+default_message_rules = [
+    { 'pattern': r'^ALERT: ', 'event': 'kismet_alert', 'text': "{message}", 'aggregate': False, 'class': 'error' },
+    { 'pattern': r'SSID', 'event': 'new_ssid', 'text': "Found new SSID" },
+    { 'pattern': r'new 802\.11 Wi-Fi access point', 'event': 'new_ap', 'text': "Found new AP" },
+    { 'pattern': r'new (?:Bluetooth|BTLE) device', 'event': 'new_bt_device', 'text': "Found new BT device" },
+    { 'pattern': r'new 802\.11 Wi-Fi device', 'event': 'new_device', 'text': "Found new device" },
+    { 'pattern': r'WPA3|SAE|OWE', 'crypt': 'wpa3' },
+    { 'pattern': r'WPA', 'crypt': 'wpa' },
+    { 'pattern': r'WEP', 'crypt': 'wep' },
+    { 'pattern': r'\b(?:[Oo]pen|[Uu]nencrypted)\b', 'crypt': 'open' } ]
+
+# classifies messagebus strings with a rule table. every rule pattern is a named group r<n>
+# of one alternation and a message is scanned once with finditer, lastgroup naming the rule
+# of each hit. the event comes from the highest priority hit with one and payload fields
+# such as crypt from the highest priority hit that sets them. a hit inside a longer hit that
+# starts earlier is not seen. patterns are embedded in the alternation, so they can not use
+# capture groups or global inline flags, (?:...) and (?i:...) work instead
+class message_classifier(object):
+    payload_fields = ('crypt',)
+
+    def __init__(self, rules):
+        self.rules = []
+        self.hits = {}
+        branches = []
+        for rule in rules:
+            try:
+                name = "r{}".format(len(self.rules))
+                branch = "(?P<{}>{})".format(name, rule['pattern'])
+                if re.compile(rule['pattern']).groups > 0:
+                    raise ValueError("capture groups in message rules are not supported, use (?:...)")
+                re.compile(branch)
+                if 'event' in rule.keys() and not rule['event'] in events.ws_event.keys():
+                    raise ValueError("unknown event '{}'".format(rule['event']))
+                if 'crypt' in rule.keys() and not rule['crypt'] in crypt_classes:
+                    raise ValueError("unknown crypt class '{}'".format(rule['crypt']))
+            except Exception as err:
+                print(err)
+                print("Skipping message rule: {}".format(rule))
+                continue
+            # (priority, rule when it has an event, payload fields it sets)
+            self.hits[name] = (len(self.rules), rule if 'event' in rule.keys() else None,
+                               tuple((field, rule[field]) for field in self.payload_fields if field in rule.keys()))
+            self.rules.append(rule)
+            branches.append(branch)
+        self.matcher = re.compile("|".join(branches)) if len(branches) > 0 else None
+
+    # returns (rule, payload) for the message or None when no rule with an event matched
+    def classify(self, message):
+        if self.matcher == None:
+            return None
+        best = None
+        found = {}
+        for match in self.matcher.finditer(message):
+            (priority, rule, fields) = self.hits[match.lastgroup]
+            if rule != None and (best == None or priority < best[0]):
+                best = (priority, rule)
+            for (field, val) in fields:
+                if not field in found or priority < found[field][0]:
+                    found[field] = (priority, val)
+        if best == None:
+            return None
+        return (best[1], { field: val for (field, (priority, val)) in found.items() })
+
+# the fields each handler reads, taken from a full decode of the frame. with orjson or ujson
+# small frames decode faster whole than field by field with json_field, see --benchmark parse
+full_decode_topics = ("TIMESTAMP", "MESSAGE", "GPS_LOCATION") if json_loads != json.loads else ()
+
+def full_fields(topic, frame):
+    data = json_loads(frame)[topic]
+    if topic == "TIMESTAMP":
+        return data['kismet.system.timestamp.sec']
+    elif topic == "MESSAGE":
+        return (data['kismet.messagebus.message_string'], data.get('kismet.messagebus.message_flags', 0))
+    elif topic == "GPS_LOCATION":
+        return data['kismet.common.location.fix']
+    rrd = data['kismet.packetchain.packets_rrd']
+    return { key: rrd[key] for key in ws_connector.pc_rrd_fields }
+
 # class for handling the websocket connection
 class ws_connector(object):
+    # eventbus topics subscribed on every connection
+    topics = ("MESSAGE", "TIMESTAMP", "GPS_LOCATION", "PACKETCHAIN_STATS")
+    # packets rrd fields read by i2c_controller.ts_change
+    pc_rrd_fields = ("kismet.common.rrd.minute_vec", "kismet.common.rrd.last_time", "kismet.common.rrd.serial_time")
+
     # init the variables for the class
     def __init__(self, addr, port, un, pw, **kwargs):
         self.kismet_address = addr
         self.kismet_port = port
         self.kismet_user = un
         self.kismet_pass = pw
+        self.ws = None
+
+        # name of the kismet source, carried by every event, and its short display label
+        if 'source' in kwargs.keys():
+            self.source = kwargs['source']
+        else:
+            self.source = "kismet"
+        if 'label' in kwargs.keys():
+            self.label = kwargs['label']
+        else:
+            self.label = "WS"
 
         if 'reconnect' in kwargs.keys():
             self.reconnect = kwargs['reconnect']
@@ -280,81 +1014,210 @@ class ws_connector(object):
             self.reconnect_delay = kwargs['reconnect_delay']
         else:
             self.reconnect_delay = 3
+        # fast reconnect pipelines the subscribes and backs off exponentially with jitter
+        if 'fast_reconnect' in kwargs.keys():
+            self.fast_reconnect = kwargs['fast_reconnect']
+        else:
+            self.fast_reconnect = True
+        if 'reconnect_backoff' in kwargs.keys():
+            (self.backoff_min, self.backoff_max) = kwargs['reconnect_backoff']
+        else:
+            (self.backoff_min, self.backoff_max) = (0.25, 30)
         if 'debug' in kwargs.keys():
             self.debug = kwargs['debug']
         else:
             self.debug = False
+        # watchdog drops the connection after this many seconds without a TIMESTAMP, 0 disables,
+        # pings every ping_interval seconds tell a stalled kismet from a dead connection
+        if 'watchdog' in kwargs.keys():
+            self.watchdog = kwargs['watchdog']
+        else:
+            self.watchdog = 3
+        if 'ping_interval' in kwargs.keys():
+            self.ping_interval = kwargs['ping_interval']
+        else:
+            self.ping_interval = 1
+        self.watchdog_handle = None
+        self.last_ts_time = None
+        self.last_ping = 0
+        self.stall_reason = None
+        self.stalls = {}
+
+        # reconnect bookkeeping, first_event_latency is seconds from losing the
+        # eventbus to the first TIMESTAMP of the next connection
+        self.reconnect_attempt = 0
+        self.reconnect_count = 0
+        self.auth_failed = False
+        self.subscribed = False
+        self.lost_time = None
+        self.open_time = None
+        self.first_event_latency = None
+
+        # frames and bytes received, frames are optionally written to a capture file
+        self.frames = 0
+        self.bytes = 0
+        if 'recorder' in kwargs.keys():
+            self.recorder = kwargs['recorder']
+        else:
+            self.recorder = None
+
+        # messages are classified by the rule table, discovery alerts go through the aggregator
+        if 'message_rules' in kwargs.keys():
+            self.classifier = message_classifier(kwargs['message_rules'])
+        else:
+            self.classifier = message_classifier(default_message_rules)
+        if 'alert_window' in kwargs.keys():
+            self.alerts = alert_aggregator(kwargs['alert_window'], self.emit)
+        else:
+            self.alerts = alert_aggregator(2, self.emit)
+
+        # field readers per topic, json_field on the raw frame or a full decode
+        self.readers = { 'TIMESTAMP': self.ts_fields,
+                         'MESSAGE': self.msg_fields,
+                         'GPS_LOCATION': self.gps_fields,
+                         'PACKETCHAIN_STATS': self.pc_fields }
+        for topic in full_decode_topics:
+            self.readers[topic] = functools.partial(full_fields, topic)
+
+        # topic dispatch table for on_message
+        self.dispatch = { 'TIMESTAMP': self.parse_ts,
+                          'MESSAGE': self.parse_msg,
+                          'GPS_LOCATION': self.parse_gps,
+                          'PACKETCHAIN_STATS': self.parse_pc }
 
         # init variables
         self.reset_status(True)
 
-    # method to setup variables at init or new ws connection
+    # events from this connector carry the name of its kismet source
+    def emit(self, event):
+        event['source'] = self.source
+        events.wsc_new(event)
+
+    # method to setup variables at init or new ws connection, events are dispatched as they
+    # are emitted so at init nothing is sent, ws_run sends the initial status
     def reset_status(self, init=False):
         self.timestamp = -1
         self.gps_fix = 0
         self.pc_packets_rrd = None
-        eventloop.call_soon_threadsafe(events.wsc_new, {'type': "new_ts", 'ts': self.timestamp})
         if init is True:
             self.error_state = 1
-            eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'error_state', 'text': "Not connected.",'state': 1})
+        else:
+            self.emit({'type': "new_ts", 'ts': self.timestamp})
+
+    # fields read by each handler, pulled out of the raw frame without decoding all of it.
+    # --benchmark parse times these against a full decode
+    @staticmethod
+    def ts_fields(frame):
+        return json_field(frame, 'kismet.system.timestamp.sec')[0]
+
+    # message string and flags, frames without flags have none set
+    @staticmethod
+    def msg_fields(frame):
+        msg_str = json_field(frame, 'kismet.messagebus.message_string')[0]
+        try:
+            flags = json_field(frame, 'kismet.messagebus.message_flags')[0]
+        except KeyError:
+            flags = 0
+        return (msg_str, flags)
+
+    @staticmethod
+    def gps_fields(frame):
+        return json_field(frame, 'kismet.common.location.fix')[0]
+
+    # the packets rrd fields used for the graph
+    def pc_fields(self, frame):
+        rrd_start = frame.find('"kismet.packetchain.packets_rrd"')
+        # the next packetchain rrd bounds the search so its fields are never picked up
+        rrd_end = frame.find('"kismet.packetchain.', rrd_start + 1)
+        try:
+            if rrd_start == -1:
+                raise KeyError('kismet.packetchain.packets_rrd')
+            rrd = {}
+            for key in self.pc_rrd_fields:
+                rrd[key] = json_field(frame, key, rrd_start, rrd_end)[0]
+        except (KeyError, ValueError, IndexError):
+            # unexpected layout, decode the whole frame
+            rrd = json_loads(frame)["PACKETCHAIN_STATS"]["kismet.packetchain.packets_rrd"]
+        return rrd
 
     # parse eventbus timestamp
-    def parse_ts(self, msg_dict):
-        self.timestamp = msg_dict['TIMESTAMP']['kismet.system.timestamp.sec']
-        eventloop.call_soon_threadsafe(events.wsc_new, {'type': "new_ts", 'ts': self.timestamp})
+    def parse_ts(self, frame):
+        self.timestamp = self.readers['TIMESTAMP'](frame)
+        self.last_ts_time = time.monotonic()
+        if not self.subscribed:
+            self.confirm_subscribed()
+        self.emit({'type': "new_ts", 'ts': self.timestamp})
+
+    # first TIMESTAMP after the subscribes confirms the eventbus is live
+    def confirm_subscribed(self):
+        self.subscribed = True
+        self.reconnect_attempt = 0
+        now = time.monotonic()
+        if self.lost_time != None:
+            self.first_event_latency = now - self.lost_time
+            print("Eventbus live {:.3f}s after connection loss ({:.3f}s after open)".format(self.first_event_latency, now - self.open_time))
+        self.lost_time = None
+        self.emit({'type': 'ws_connected', 'state': 2})
 
     # parse eventbus message to create message for io display
-    def parse_msg(self, msg_dict):
-        msg_str = msg_dict['MESSAGE']['kismet.messagebus.message_string']
+    def parse_msg(self, frame):
+        (msg_str, flags) = self.readers['MESSAGE'](frame)
+        if flags & msgflag_alert:
+            msg_str = "ALERT: " + msg_str
 
-        io_msg = None
-        io_ev = None
-        if "SSID" in msg_str:
-            io_msg = "Found new SSID"
-            io_ev = "new_ssid"
-        if "new 802.11 Wi-Fi access point" in msg_str:
-            io_msg = "Found new AP"
-            io_ev = "new_ap"
-        if "new 802.11 Wi-Fi device" in msg_str:
-            io_msg = "Found new device"
-            io_ev = "new_device"
-        # see if we have a message for io, put on queue
-        if not io_msg is None:
-            eventloop.call_soon_threadsafe(events.wsc_new, {'type': "new_disp_msg", 'text': io_msg, 'ts': self.timestamp})
-            eventloop.call_soon_threadsafe(events.wsc_new, {'type': io_ev, 'ts': self.timestamp})
+        hit = self.classifier.classify(msg_str)
+        if hit == None:
+            return
+        (rule, payload) = hit
+        text = rule['text'].replace("{message}", msg_str) if 'text' in rule.keys() else msg_str
+        # discoveries come in bursts and are merged by the aggregator
+        if 'aggregate' not in rule.keys() or rule['aggregate']:
+            self.alerts.add(rule['event'], text, self.timestamp, payload)
+        else:
+            self.emit({'type': "new_disp_msg", 'text': text, 'ts': self.timestamp,
+                            'class': rule['class'] if 'class' in rule.keys() else 'discovery'})
+            event = {'type': rule['event'], 'ts': self.timestamp, 'count': 1}
+            event.update(payload)
+            self.emit(event)
 
     # parse eventbus gps for status change and trigger event reflecting change
-    def parse_gps(self, msg_dict):
-        gps_msg = msg_dict['GPS_LOCATION']['kismet.common.location.fix']
+    def parse_gps(self, frame):
+        gps_msg = self.readers['GPS_LOCATION'](frame)
         if gps_msg == 3:
             if self.gps_fix != 3:
                 self.gps_fix = 3
-                eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'gps_status', 'state': 2})
+                self.emit({'type': 'gps_status', 'state': 2})
         elif gps_msg == 2:
             if self.gps_fix != 2:
                 self.gps_fix = 2
-                eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'gps_status', 'state': 1})
+                self.emit({'type': 'gps_status', 'state': 1})
         else:
             if self.gps_fix != 0:
                 self.gps_fix = 0
-                eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'gps_status', 'state': 0})
+                self.emit({'type': 'gps_status', 'state': 0})
 
-    # parse eventbus packetchain chain
-    def parse_pc(self, msg_dict):
-        self.pc_packets_rrd = msg_dict["PACKETCHAIN_STATS"]["kismet.packetchain.packets_rrd"]
+    # parse eventbus packetchain chain, only the packets rrd fields used for the graph are decoded
+    def parse_pc(self, frame):
+        self.pc_packets_rrd = self.readers['PACKETCHAIN_STATS'](frame)
 
     # ws client callback for new messages
     def on_message(self, ws, message):
-        deser_msg = json.loads(message)
-        for key in deser_msg.keys():
-            if key == "TIMESTAMP":
-                self.parse_ts(deser_msg)
-            if key == "MESSAGE":
-                self.parse_msg(deser_msg)
-            if key == "GPS_LOCATION":
-                self.parse_gps(deser_msg)
-            if key == "PACKETCHAIN_STATS":
-                self.parse_pc(deser_msg)
+        if self.debug: print("ws_connector recv: {}".format(message))
+        # kismet sends one topic per frame as {"TOPIC": {...}}, read the topic without decoding
+        if message.startswith('{"'):
+            handler = self.dispatch.get(message[2:message.find('"', 2)])
+            if handler != None:
+                if tracer != None:
+                    start = time.perf_counter()
+                    handler(message)
+                    tracer.record(handler.__name__, "ws", start, time.perf_counter())
+                else:
+                    handler(message)
+                return
+        # anything else gets a full decode, handlers still read fields from the raw frame
+        for key in json_loads(message).keys():
+            if key in self.dispatch:
+                self.dispatch[key](message)
 
     # ws client callback for error
     def on_error(self, ws, error):
@@ -362,61 +1225,612 @@ class ws_connector(object):
         # signal error state and provide an error message
         print(error)
         self.error_state = 1
-        if type(error).__name__ == "ConnectionRefusedError":
-            eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'error_state', 'text': "Connection refused.",'state': 1})
-        elif type(error).__name__ == "WebSocketConnectionClosedException":
-            eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'error_state', 'text': "Connection closed.",'state': 1})
+        if self.stall_reason == "stalled":
+            self.emit({'type': 'error_state', 'text': "Kismet stalled.",'state': 1})
+        elif self.stall_reason != None:
+            self.emit({'type': 'error_state', 'text': "Kismet not responding.",'state': 1})
+        elif isinstance(error, ConnectionRefusedError):
+            self.emit({'type': 'error_state', 'text': "Connection refused.",'state': 1})
+        elif isinstance(error, (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError)):
+            self.emit({'type': 'error_state', 'text': "Connection closed.",'state': 1})
+        elif isinstance(error, ws_handshake_error) and error.status in (401, 403):
+            self.auth_failed = True
+            self.emit({'type': 'error_state', 'text': "Authentication failed.",'state': 1})
+        elif isinstance(error, asyncio.TimeoutError):
+            self.emit({'type': 'error_state', 'text': "Connection timed out.",'state': 1})
         else:
-            eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'error_state', 'text': type(error).__name__,'state': 1})
+            self.emit({'type': 'error_state', 'text': type(error).__name__,'state': 1})
 
     # ws client callback for closed connection
-    def on_close(self, ws, close_status_code, close_msg):
+    def on_close(self, ws):
         print("Websocket connection closed.")
         # reset status variables
         self.reset_status()
         # signal error state and provide a hopeful error message
         self.error_state = 1
-        eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'error_state', 'text': "Connection closed.",'state': 1})
+        self.emit({'type': 'error_state', 'text': "Connection closed.",'state': 1})
 
     # ws client callback for opened connection
-    def on_open(self, ws):
+    async def on_open(self, ws):
         print("Connected to websocket, subscribing")
         # clear error state and error message
         self.error_state = 0
-        eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'error_state', 'state': 0})
+        self.emit({'type': 'error_state', 'state': 0})
         # put connect message on queue
-        eventloop.call_soon_threadsafe(events.wsc_new, {'type': "new_disp_msg", 'text': "Connected to Kismet", 'ts': self.timestamp})
+        self.emit({'type': "new_disp_msg", 'text': "Connected to Kismet", 'ts': self.timestamp})
         # send eventbus subscribes
-        time.sleep(1)
-        ws.send(json.dumps({"SUBSCRIBE":"MESSAGE"}))
-        time.sleep(1)
-        ws.send(json.dumps({"SUBSCRIBE":"TIMESTAMP"}))
-        time.sleep(1)
-        ws.send(json.dumps({"SUBSCRIBE":"GPS_LOCATION"}))
-        time.sleep(1)
-        ws.send(json.dumps({"SUBSCRIBE":"PACKETCHAIN_STATS"}))
-        eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'ws_connected', 'state': 2})
-
-    # method to run ws client
-    def ws_run(self):
-        eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'ws_connected', 'state': 0})
+        self.open_time = time.monotonic()
+        self.subscribed = False
+        self.stall_reason = None
+        if self.fast_reconnect:
+            # back-to-back, ws_connected is raised by the first TIMESTAMP
+            for topic in self.topics:
+                ws.send(json.dumps({"SUBSCRIBE": topic}))
+        else:
+            for topic in self.topics:
+                await asyncio.sleep(1)
+                ws.send(json.dumps({"SUBSCRIBE": topic}))
+            # the connection may have gone while the subscribes were paced
+            if ws.closed or ws.writer.is_closing():
+                return
+            self.confirm_subscribed()
+        # frames are read from here on, the watchdog starts once the subscribes are out
+        self.start_watchdog()
+
+    # the first TIMESTAMP is expected within watchdog seconds of the last subscribe
+    def start_watchdog(self):
+        if self.watchdog > 0:
+            self.last_ts_time = time.monotonic()
+            self.last_ping = 0
+            self.watchdog_tick()
+
+    def stop_watchdog(self):
+        if self.watchdog_handle != None:
+            self.watchdog_handle.cancel()
+            self.watchdog_handle = None
+
+    # checks at the ping interval and again when the TIMESTAMP deadline passes
+    def watchdog_tick(self):
+        self.watchdog_handle = None
+        if self.ws == None or self.ws.closed:
+            return
+        now = time.monotonic()
+        silence = now - self.last_ts_time
+        if silence >= self.watchdog:
+            self.trip(silence, now)
+            return
+        if self.ping_interval > 0:
+            if now - self.last_ping >= self.ping_interval:
+                self.ws.ping()
+                self.last_ping = now
+            delay = min(self.last_ping + self.ping_interval, self.last_ts_time + self.watchdog) - now
+        else:
+            delay = self.last_ts_time + self.watchdog - now
+        self.watchdog_handle = eventloop.call_later(delay, self.watchdog_tick)
+
+    # the eventbus went silent, a kismet that still answers pings has stalled,
+    # otherwise the connection is half-open or kismet is gone
+    def trip(self, silence, now):
+        if self.ping_interval <= 0:
+            self.stall_reason = "silent"
+        elif self.ws.last_pong != None and now - self.ws.last_pong < silence:
+            self.stall_reason = "stalled"
+        else:
+            self.stall_reason = "no reply"
+        self.stalls[self.stall_reason] = self.stalls.get(self.stall_reason, 0) + 1
+        print("Eventbus silent for {:.1f}s ({}), reconnecting".format(silence, self.stall_reason))
+        if metrics != None:
+            metrics.observe("ws_stall_detect_seconds", silence)
+        # reconnect latency is counted from the last TIMESTAMP
+        if self.lost_time == None:
+            self.lost_time = self.last_ts_time
+        self.ws.abort()
+
+    # coroutine to run ws client on the main eventloop
+    async def ws_run(self):
+        # initial status, sent once the eventloop runs and every consumer is registered
+        self.emit({'type': 'ws_connected', 'state': 0})
+        self.emit({'type': "new_ts", 'ts': self.timestamp})
+        self.emit({'type': 'error_state', 'text': "Not connected.",'state': 1})
         print("Starting websocket connection")
-        self.ws = websocket.WebSocketApp("ws://{}:{}/eventbus/events.ws?user={}&password={}".format(self.kismet_address,self.kismet_port,self.kismet_user,self.kismet_pass),
-                                on_open= lambda ws: self.on_open(self.ws),
-                                on_message= lambda ws,msg: self.on_message(self.ws, msg),
-                                on_error= lambda ws,msg: self.on_error(self.ws, msg),
-                                on_close= lambda ws: self.on_close(self.ws, self.close_status_code, self.close_msg))
-        # use infinite loop to restart (avoids stack overflow from recursion in on_close cb)
+        path = "/eventbus/events.ws?user={}&password={}".format(quote(str(self.kismet_user)), quote(str(self.kismet_pass)))
+        # use loop to reconnect, each pass is one connection
         while True:
-            self.ws.run_forever()
-            eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'ws_connected', 'state': 0})
-            eventloop.call_soon_threadsafe(events.wsc_new, {'type': 'gps_status', 'state': 0})
+            try:
+                self.ws = await ws_open(self.kismet_address, self.kismet_port, path)
+                await self.on_open(self.ws)
+                while True:
+                    message = await self.ws.recv()
+                    if message is None:
+                        break
+                    self.frames += 1
+                    self.bytes += len(message)
+                    if self.recorder != None:
+                        self.recorder.write(message)
+                    try:
+                        self.on_message(self.ws, message)
+                    except (KeyError, ValueError, IndexError, TypeError) as err:
+                        print("ws_connector: failed to parse eventbus frame: {}".format(repr(err)))
+                self.on_close(self.ws)
+            except asyncio.CancelledError:
+                self.stop_watchdog()
+                if self.ws != None:
+                    self.ws.close()
+                raise
+            except Exception as err:
+                if config.debug:
+                    traceback.print_tb(err.__traceback__)
+                self.on_error(self.ws, err)
+            self.stop_watchdog()
+            if self.ws != None:
+                self.ws.close()
+                self.ws = None
+            if self.lost_time == None:
+                self.lost_time = time.monotonic()
+            self.subscribed = False
+            # state 1 flags an authentication failure
+            self.emit({'type': 'ws_connected', 'state': 1 if self.auth_failed else 0})
+            self.auth_failed = False
+            self.emit({'type': 'gps_status', 'state': 0})
             if self.reconnect:
-                time.sleep(self.reconnect_delay)
+                self.reconnect_count += 1
+                await asyncio.sleep(self.next_reconnect_delay())
                 if config.debug: print("Reconnect loop")
             else:
                 break
 
+    # exponential backoff with jitter in fast mode, fixed delay otherwise
+    def next_reconnect_delay(self):
+        if not self.fast_reconnect:
+            return self.reconnect_delay
+        delay = min(self.backoff_max, self.backoff_min * (2 ** self.reconnect_attempt))
+        self.reconnect_attempt += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+# error for a kismet httpd reply that is not 200
+class kismet_rest_error(Exception):
+    def __init__(self, status, path):
+        self.status = status
+        self.path = path
+        super().__init__("Kismet httpd returned {} for '{}'".format(status, path))
+
+# minimal asyncio http/1.1 client for the kismet httpd. keeps a small pool of keep-alive
+# connections, sends basic auth as a header, times out every request, caches replies per
+# request for a ttl and coalesces concurrent identical requests into one.
+class kismet_rest_client(object):
+    def __init__(self, addr, port, un, pw, timeout=5, pool_size=2):
+        self.kismet_address = addr
+        self.kismet_port = port
+        self.auth = "Basic " + base64.b64encode("{}:{}".format(un, pw).encode()).decode()
+        self.timeout = timeout
+        self.pool_size = pool_size
+
+        self.idle = []
+        self.cache = {}
+        self.inflight = {}
+
+        # counters
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    # forget cached replies, used when the kismet session changes
+    def invalidate(self):
+        self.cache.clear()
+
+    def close(self):
+        for (reader, writer) in self.idle:
+            writer.close()
+        self.idle = []
+
+    async def fetch_json(self, method, path, body=None, ttl=0):
+        key = (method, path, body)
+        cached = self.cache.get(key)
+        if cached != None and cached[0] > eventloop.time():
+            self.cache_hits += 1
+            return cached[1]
+        if key in self.inflight:
+            self.coalesced += 1
+            return await asyncio.shield(self.inflight[key])
+
+        fut = eventloop.create_future()
+        self.inflight[key] = fut
+        try:
+            (status, data) = await self.request(method, path, body)
+            if status != 200:
+                raise kismet_rest_error(status, path)
+            value = json_loads(data)
+            if ttl > 0:
+                self.cache[key] = (eventloop.time() + ttl, value)
+            fut.set_result(value)
+            return value
+        except BaseException as err:
+            self.errors += 1
+            fut.set_exception(err)
+            # retrieved here so a request nobody else waited on does not log a warning
+            fut.exception()
+            raise
+        finally:
+            del self.inflight[key]
+
+    async def get_json(self, path, ttl=0):
+        return await self.fetch_json("GET", path, None, ttl)
+
+    # kismet endpoints take their parameters as a form encoded 'json' field
+    async def post_json(self, path, params, ttl=0):
+        return await self.fetch_json("POST", path, urlencode({'json': json.dumps(params)}), ttl)
+
+    # returns (status, body bytes), a reused connection that turns out closed is retried once
+    async def request(self, method, path, body=None):
+        self.requests += 1
+        while True:
+            reused = len(self.idle) > 0
+            if reused:
+                conn = self.idle.pop()
+            else:
+                conn = await asyncio.wait_for(asyncio.open_connection(self.kismet_address, int(self.kismet_port)), self.timeout)
+            try:
+                (status, keep_alive, data) = await asyncio.wait_for(self.exchange(conn, method, path, body), self.timeout)
+            except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError):
+                conn[1].close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn[1].close()
+                raise
+            if keep_alive and len(self.idle) < self.pool_size:
+                self.idle.append(conn)
+            else:
+                conn[1].close()
+            return (status, data)
+
+    async def exchange(self, conn, method, path, body):
+        (reader, writer) = conn
+        req = ("{} {} HTTP/1.1\r\n"
+               "Host: {}:{}\r\n"
+               "Authorization: {}\r\n"
+               "Accept: application/json\r\n"
+               "Connection: keep-alive\r\n").format(method, path, self.kismet_address, self.kismet_port, self.auth)
+        if body != None:
+            body = body.encode()
+            req += "Content-Type: application/x-www-form-urlencoded\r\nContent-Length: {}\r\n".format(len(body))
+        writer.write(req.encode() + b"\r\n" + (body or b""))
+        await writer.drain()
+
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        status_line = head[0].split(" ", 2)
+        status = int(status_line[1])
+        headers = {}
+        for line in head[1:]:
+            if ":" in line:
+                (name, value) = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip().lower()
+        keep_alive = headers.get("connection") != "close" and status_line[0] == "HTTP/1.1"
+
+        if method == "HEAD" or status in (204, 304) or status < 200:
+            data = b""
+        elif "chunked" in headers.get("transfer-encoding", ""):
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    # skip trailers
+                    while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b"".join(chunks)
+        elif "content-length" in headers:
+            data = await reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return (status, keep_alive, data)
+
+# encryption classes shown by the ssid pixel, most to least alarming
+crypt_classes = ("open", "wep", "wpa", "wpa3", "other")
+
+# map kismet's device crypt string to an index in crypt_classes
+def crypt_class(crypt):
+    if not isinstance(crypt, str):
+        # pre-2019 kismet reports a bitfield, only "none" can be told apart reliably
+        return 0 if crypt == 0 else 4
+    crypt = crypt.upper()
+    if crypt == "" or crypt == "NONE" or crypt.startswith("OPEN"):
+        return 0
+    if "WPA3" in crypt or "SAE" in crypt or "OWE" in crypt:
+        return 3
+    if "WPA" in crypt:
+        return 2
+    if "WEP" in crypt:
+        return 1
+    return 4
+
+# mac string to the integer used as device key
+def mac_int(mac):
+    return int(mac.replace(":", ""), 16)
+
+# compact table of devices keyed by mac integer. each device is a slot across parallel
+# arrays, names and ssids are interned, and counts by phy, type and crypt class are kept
+# up to date on every change. when full, the least recently updated device is evicted.
+class device_index(object):
+    def __init__(self, limit=50000):
+        self.limit = limit
+
+        # mac -> slot, ordered least recently updated first
+        self.slots = OrderedDict()
+        self.free = []
+        self.mac = array('Q')
+        self.phy = array('H')
+        self.kind = array('H')
+        self.crypt = array('B')
+        self.ssid = array('l')
+        self.last_time = array('L')
+
+        # interned phy and type names, each as (name -> id, names by id, counts by id)
+        self.phy_names = ({}, [], array('L'))
+        self.kind_names = ({}, [], array('L'))
+
+        # interned ssids with refcounts, ids are reused once unreferenced
+        self.ssid_ids = {}
+        self.ssid_list = []
+        self.ssid_refs = array('L')
+        self.ssid_free = []
+
+        # counts by crypt class
+        self.by_crypt = array('L', [0] * len(crypt_classes))
+
+        # counters
+        self.inserts = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    @staticmethod
+    def intern(table, name):
+        idx = table[0].get(name)
+        if idx == None:
+            idx = len(table[1])
+            table[0][name] = idx
+            table[1].append(name)
+            table[2].append(0)
+        return idx
+
+    def ssid_ref(self, ssid):
+        if ssid == None:
+            return -1
+        idx = self.ssid_ids.get(ssid)
+        if idx == None:
+            if len(self.ssid_free) > 0:
+                idx = self.ssid_free.pop()
+                self.ssid_list[idx] = ssid
+            else:
+                idx = len(self.ssid_list)
+                self.ssid_list.append(ssid)
+                self.ssid_refs.append(0)
+            self.ssid_ids[ssid] = idx
+        self.ssid_refs[idx] += 1
+        return idx
+
+    def ssid_unref(self, idx):
+        if idx == -1:
+            return
+        self.ssid_refs[idx] -= 1
+        if self.ssid_refs[idx] == 0:
+            del self.ssid_ids[self.ssid_list[idx]]
+            self.ssid_list[idx] = None
+            self.ssid_free.append(idx)
+
+    # add or update a device, returns True if it is new or any field changed
+    def update(self, mac, phy, kind, crypt, ssid, last_time):
+        if isinstance(mac, str):
+            mac = mac_int(mac)
+        phy = self.intern(self.phy_names, phy)
+        kind = self.intern(self.kind_names, kind)
+        crypt = crypt_class(crypt)
+        by_phy = self.phy_names[2]
+        by_kind = self.kind_names[2]
+
+        slot = self.slots.get(mac)
+        if slot == None:
+            if len(self.slots) >= self.limit:
+                self.evict()
+            slot = self.alloc()
+            self.slots[mac] = slot
+            self.mac[slot] = mac
+            self.phy[slot] = phy
+            self.kind[slot] = kind
+            self.crypt[slot] = crypt
+            self.ssid[slot] = self.ssid_ref(ssid)
+            self.last_time[slot] = last_time
+            by_phy[phy] += 1
+            by_kind[kind] += 1
+            self.by_crypt[crypt] += 1
+            self.inserts += 1
+            return True
+
+        self.slots.move_to_end(mac)
+        changed = False
+        if self.phy[slot] != phy:
+            by_phy[self.phy[slot]] -= 1
+            by_phy[phy] += 1
+            self.phy[slot] = phy
+            changed = True
+        if self.kind[slot] != kind:
+            by_kind[self.kind[slot]] -= 1
+            by_kind[kind] += 1
+            self.kind[slot] = kind
+            changed = True
+        if self.crypt[slot] != crypt:
+            self.by_crypt[self.crypt[slot]] -= 1
+            self.by_crypt[crypt] += 1
+            self.crypt[slot] = crypt
+            changed = True
+        old_ssid = self.ssid[slot]
+        if (old_ssid == -1 and ssid != None) or (old_ssid != -1 and self.ssid_list[old_ssid] != ssid):
+            self.ssid[slot] = self.ssid_ref(ssid)
+            self.ssid_unref(old_ssid)
+            changed = True
+        if self.last_time[slot] != last_time:
+            self.last_time[slot] = last_time
+            changed = True
+        return changed
+
+    def alloc(self):
+        if len(self.free) > 0:
+            return self.free.pop()
+        self.mac.append(0)
+        self.phy.append(0)
+        self.kind.append(0)
+        self.crypt.append(0)
+        self.ssid.append(-1)
+        self.last_time.append(0)
+        return len(self.mac) - 1
+
+    def evict(self):
+        (mac, slot) = self.slots.popitem(last=False)
+        self.phy_names[2][self.phy[slot]] -= 1
+        self.kind_names[2][self.kind[slot]] -= 1
+        self.by_crypt[self.crypt[slot]] -= 1
+        self.ssid_unref(self.ssid[slot])
+        self.ssid[slot] = -1
+        self.free.append(slot)
+        self.evicted += 1
+
+    def clear(self):
+        self.__init__(self.limit)
+
+    # device record as a tuple of (mac, phy, type, crypt class, ssid, last_time)
+    def get(self, mac):
+        if isinstance(mac, str):
+            mac = mac_int(mac)
+        slot = self.slots.get(mac)
+        if slot == None:
+            return None
+        ssid = self.ssid[slot]
+        return (mac, self.phy_names[1][self.phy[slot]], self.kind_names[1][self.kind[slot]],
+                crypt_classes[self.crypt[slot]], None if ssid == -1 else self.ssid_list[ssid],
+                self.last_time[slot])
+
+    # number of distinct ssids among tracked devices
+    def ssid_count(self):
+        return len(self.ssid_ids)
+
+    def phy_counts(self):
+        return dict(zip(self.phy_names[1], self.phy_names[2]))
+
+    def type_counts(self):
+        return dict(zip(self.kind_names[1], self.kind_names[2]))
+
+    def crypt_counts(self):
+        return dict(zip(crypt_classes, self.by_crypt))
+
+# keeps a local copy of the kismet device list by polling only the devices modified since
+# the previous poll, with replies simplified to the fields the display needs. the first poll
+# of a session asks for the devices seen in the last window seconds with a negative
+# last-time, which kismet takes relative to its own clock. window 0 fetches the whole list
+class device_sync(object):
+    fields = [ "kismet.device.base.macaddr",
+               "kismet.device.base.phyname",
+               "kismet.device.base.type",
+               "kismet.device.base.crypt",
+               "kismet.device.base.last_time",
+               ["dot11.device/dot11.device.last_beaconed_ssid_record/dot11.advertisedssid.ssid", "dot11.ssid"] ]
+
+    # poll interval is scaled so each poll returns about target_changes devices
+    target_changes = 50
+
+    def __init__(self, rest, poll_min=2, poll_max=30, limit=50000, emit=None, recorder=None, window=300):
+        self.rest = rest
+        self.emit = emit if emit != None else events.wsc_new
+        # replies are written to the --record capture for fake_kismet to serve
+        self.recorder = recorder
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.window = window
+        self.index = device_index(limit)
+        self.reset()
+
+        # counters
+        self.polls = 0
+        self.changed_total = 0
+
+    # forget all devices, the next poll fetches the full list again
+    def reset(self):
+        self.index.clear()
+        self.since = -self.window if self.window > 0 else 0
+        self.start_sec = None
+        self.interval = self.poll_min
+
+    # kismet restarted since the last session, local devices no longer match its list
+    async def check_session(self):
+        status = await self.rest.get_json("/system/status.json")
+        start_sec = status["kismet.system.timestamp.start_sec"]
+        if self.start_sec != None and self.start_sec != start_sec:
+            if config.debug: print("device_sync: kismet restarted, resyncing devices")
+            self.reset()
+        self.start_sec = start_sec
+
+    # merge a reply into the device index, returns the number of new or changed devices
+    def merge(self, reply):
+        changed = 0
+        for dev in reply:
+            ssid = dev.get("dot11.ssid")
+            if not isinstance(ssid, str) or ssid == "":
+                ssid = None
+            last_time = dev["kismet.device.base.last_time"]
+            if last_time > self.since:
+                self.since = last_time
+            if self.index.update(dev["kismet.device.base.macaddr"], dev["kismet.device.base.phyname"],
+                                 dev["kismet.device.base.type"], dev["kismet.device.base.crypt"],
+                                 ssid, last_time):
+                changed += 1
+        return changed
+
+    async def poll(self):
+        reply = await self.rest.post_json("/devices/last-time/{}/devices.json".format(self.since), {"fields": self.fields})
+        if self.recorder != None:
+            self.recorder.write_devices(reply)
+        changed = self.merge(reply)
+        self.polls += 1
+        self.changed_total += changed
+        return changed
+
+    # poll faster while lots of devices change and back off while the area is quiet
+    def next_interval(self, changed):
+        scale = self.target_changes / max(changed, 1)
+        self.interval *= min(2, max(0.5, scale))
+        self.interval = min(self.poll_max, max(self.poll_min, self.interval))
+        return self.interval
+
+    # runs while the websocket is connected, cancelled on disconnect
+    async def run(self):
+        first = True
+        while True:
+            try:
+                if first:
+                    await self.check_session()
+                changed = await self.poll()
+                if changed > 0 or first:
+                    self.emit({ 'type': 'device_counts',
+                                'devices': len(self.index),
+                                'ssids': self.index.ssid_count(),
+                                'phy': self.index.phy_counts(),
+                                'device_type': self.index.type_counts(),
+                                'crypt': self.index.crypt_counts(),
+                                'changed': changed })
+                first = False
+                delay = self.next_interval(changed)
+            except (kismet_rest_error, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    KeyError, TypeError, ValueError) as err:
+                if config.debug: print("device_sync: poll failed: {}".format(repr(err)))
+                delay = self.poll_max
+            await asyncio.sleep(delay)
+
 # class for making requests from json endpoints
 class json_connector(object):
     def __init__(self, addr, port, un, pw, **kwargs):
@@ -425,64 +1839,711 @@ class json_connector(object):
         self.kismet_user = un
         self.kismet_pass = pw
 
-        self.base_uri = f"http://{un}:{pw}@{addr}:{port}"
+        # follows the websocket of the same source
+        if 'source' in kwargs.keys():
+            self.source = kwargs['source']
+        else:
+            self.source = "kismet"
+
+        if 'timeout' in kwargs.keys():
+            timeout = kwargs['timeout']
+        else:
+            timeout = 5
+        if 'status_ttl' in kwargs.keys():
+            self.status_ttl = kwargs['status_ttl']
+        else:
+            self.status_ttl = 60
+        self.rest = kismet_rest_client(addr, port, un, pw, timeout)
+
+        if 'device_sync' in kwargs.keys() and kwargs['device_sync']:
+            if 'device_poll' in kwargs.keys():
+                (poll_min, poll_max) = kwargs['device_poll']
+            else:
+                (poll_min, poll_max) = (2, 30)
+            if 'device_limit' in kwargs.keys():
+                limit = kwargs['device_limit']
+            else:
+                limit = 50000
+            if 'recorder' in kwargs.keys():
+                recorder = kwargs['recorder']
+            else:
+                recorder = None
+            if 'device_window' in kwargs.keys():
+                window = kwargs['device_window']
+            else:
+                window = 300
+            self.sync = device_sync(self.rest, poll_min, poll_max, limit, self.emit, recorder, window)
+        else:
+            self.sync = None
 
         # init data
         self.status = None
+        self.status_task = None
+        self.sync_task = None
 
         # add event cb
         events.ws_event["ws_connected"].append(self.ws_state_change)
 
-    # event cb ws connection
+    # events from this connector carry the name of its kismet source
+    def emit(self, event):
+        event['source'] = self.source
+        events.wsc_new(event)
+
+    # event cb ws connection, requests run as tasks so the eventloop never blocks on kismet
     def ws_state_change(self, event, timed):
+        if event['source'] != self.source:
+            return
         new_state = event["state"]
         if new_state == 2:
-            req = requests.get(f"{self.base_uri}/system/status.json")
-            if req.status_code == requests.codes.ok:
-                self.status = req.json()
-            else:
-                if config.debug: print("json_connector: Bad status code from '/system/status.json'")
-                self.status = None
+            if self.status_task == None or self.status_task.done():
+                self.status_task = eventloop.create_task(self.refresh_status())
+            if self.sync != None and (self.sync_task == None or self.sync_task.done()):
+                self.sync_task = eventloop.create_task(self.sync.run())
         else:
+            # a reconnect may be to a restarted kismet
             self.status = None
+            self.rest.invalidate()
+            self.stop_sync()
 
-# class for gpio io_controller
-class gpio_controller(object):
-    def __init__(self):
-        print("Configuring local gpio.")
-        self.button_lines = {'show_stats': None}
-        self.buttons = {}
-
-        self.led_lines = {}
-        self.leds = {}
-
-        self.np_pixels = {}
-        self.np_running = False
+    def stop_sync(self):
+        if self.sync_task != None:
+            self.sync_task.cancel()
+            self.sync_task = None
 
-    def configure_buttons(self, btns, events):
+    async def refresh_status(self):
         try:
-            for btn in btns['lines']:
-                try:
-                    if btn['function'] == 'show_stats':
-                        self.button_lines['show_stats'] = btn['gpio_pin']
-                        self.button_watcher(btn['gpio_pin'], events.btn_status)
-                except Exception as err:
-                    if config.debug:
-                        traceback.print_tb(err.__traceback__)
-                        print(err)
-                    print("Failed to configure 'lines' entry in 'input_buttons':")
-                    print(btn)
+            self.status = await self.rest.get_json("/system/status.json", self.status_ttl)
         except Exception as err:
-            if config.debug:
-                traceback.print_tb(err.__traceback__)
-                print(err)
-            print("Failed to configure 'lines' in 'input_buttons'")
+            if config.debug: print("json_connector: failed to get '/system/status.json': {}".format(repr(err)))
+            self.status = None
 
-    def configure_leds(self, leds, events):
-        ws_evt = events.ws_event
-        try:
-            if 'duration' in leds.keys():
-                self.led_duration = leds['duration']
+# in-memory neopixel frame, indicators write here and changes reach the strip with one
+# show() per animation tick, and none when the frame ends up unchanged
+class pixel_frame(object):
+    def __init__(self, strip, count, depth, wake):
+        self.strip = strip
+        self.wake = wake
+        self.frame = [(0,) * depth] * count
+        self.sent = list(self.frame)
+        self.flushes = 0
+        # the strip is left alone while held by the self test
+        self.hold = False
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __getitem__(self, place):
+        return self.frame[place]
+
+    def __setitem__(self, place, color):
+        color = tuple(color)
+        if self.frame[place] != color:
+            self.frame[place] = color
+            self.wake()
+
+    # copy changed pixels to the strip and show once
+    def flush(self):
+        if self.hold:
+            return
+        changed = False
+        for place in range(len(self.frame)):
+            if self.frame[place] != self.sent[place]:
+                self.strip[place] = self.frame[place]
+                self.sent[place] = self.frame[place]
+                changed = True
+        if changed:
+            start = time.perf_counter()
+            self.strip.show()
+            self.flushes += 1
+            if metrics != None:
+                metrics.observe("pixel_show_seconds", time.perf_counter() - start)
+
+# gpio led indicator, any level from .5 up is on
+class led_output(object):
+    def __init__(self, led):
+        self.led = led
+        self.lit = None
+
+    def write(self, color, level):
+        lit = level >= .5
+        if lit != self.lit:
+            if lit:
+                self.led.on()
+            else:
+                self.led.off()
+            self.lit = lit
+
+# neopixel indicator, color scaled by level into the frame
+class pixel_output(object):
+    def __init__(self, frame, place, depth):
+        self.frame = frame
+        self.place = place
+        self.black = [0] * depth
+
+    def write(self, color, level):
+        if color == None or level <= 0:
+            self.frame[self.place] = self.black
+        elif level >= 1:
+            self.frame[self.place] = color
+        else:
+            self.frame[self.place] = [round(c * level) for c in color]
+
+# default patterns for stated events, 0 for off, 1 for flashing, 2 for on.
+# events carrying only a 'ts' play a one-shot 'flash'.
+default_state_patterns = { 0: {'pattern': 'off'},
+                           1: {'pattern': 'blink'},
+                           2: {'pattern': 'solid'} }
+
+# single tick stepping every led and pixel through its pattern:
+#   off, solid - written once, not animated
+#   blink      - on/off each 'duration' seconds
+#   pulse      - ramps up and down over 2 * 'duration' seconds
+#   flash      - on for 'duration' seconds once, then off
+# only one timer handle exists no matter how many indicators are animated. the tick runs
+# at fps while something pulses, otherwise at the next blink/flash edge, and stops when
+# nothing is animated.
+class animation_engine(object):
+    def __init__(self, fps=50):
+        self.interval = 1 / fps
+        self.indicators = {}
+        self.animated = set()
+        self.flush_hooks = []
+        self.tick_handle = None
+        self.tick_at = 0
+        self.last_tick = 0
+        self.ticks = 0
+
+    # register an indicator output under key, states maps event 'state' to {'pattern', 'color'}
+    # and crypt_colors maps the 'crypt' class of discovery events to a color
+    def add(self, key, output, duration, color=None, states=None, crypt_colors=None):
+        table = dict(default_state_patterns)
+        if states != None:
+            table.update(states)
+        self.indicators[key] = { 'output': output,
+                                 'duration': duration,
+                                 'color': color,
+                                 'crypt_colors': crypt_colors if crypt_colors != None else {},
+                                 'states': table,
+                                 'pattern': 'off',
+                                 'pattern_color': color,
+                                 'start': 0,
+                                 'ts': None }
+
+    # map an event to a pattern for the indicator
+    def trigger(self, key, event):
+        ind = self.indicators[key]
+        if 'state' in event.keys():
+            if not event['state'] in ind['states'].keys():
+                if config.debug: print("animation_engine: Unexpected 'state' passed: {}".format(event['state']))
+                return
+            spec = ind['states'][event['state']]
+            color = spec['color'] if 'color' in spec.keys() else ind['color']
+            # a repeated state keeps its phase
+            if spec['pattern'] != ind['pattern'] or color != ind['pattern_color']:
+                self.play(key, spec['pattern'], color)
+        elif 'ts' in event.keys():
+            # several discoveries in the same second flash once
+            if ind['ts'] == None or event['ts'] > ind['ts']:
+                ind['ts'] = event['ts']
+                if 'crypt' in event.keys() and event['crypt'] in ind['crypt_colors'].keys():
+                    self.play(key, 'flash', ind['crypt_colors'][event['crypt']])
+                else:
+                    self.play(key, 'flash', ind['color'])
+        elif config.debug: print("animation_engine: Unexpected 'event' passed: {}".format(event))
+
+    def play(self, key, pattern, color):
+        ind = self.indicators[key]
+        ind['pattern'] = pattern
+        ind['pattern_color'] = color
+        ind['start'] = eventloop.time()
+        if pattern in ('off', 'solid'):
+            self.animated.discard(key)
+            ind['output'].write(color, 1 if pattern == 'solid' else 0)
+        else:
+            self.animated.add(key)
+            ind['output'].write(color, 1)
+        self.wake()
+
+    # level 0..1 for the pattern at elapsed seconds, None once a one-shot is done
+    @staticmethod
+    def level(pattern, elapsed, duration):
+        if pattern == 'blink':
+            return 1 if int(elapsed / duration) % 2 == 0 else 0
+        if pattern == 'pulse':
+            phase = (elapsed / duration) % 2
+            return 1 - phase if phase <= 1 else phase - 1
+        if pattern == 'flash':
+            return 1 if elapsed < duration else None
+        return 1 if pattern == 'solid' else 0
+
+    # seconds until the pattern level next changes
+    @staticmethod
+    def next_change(pattern, elapsed, duration):
+        if pattern == 'blink':
+            return duration - (elapsed % duration)
+        if pattern == 'flash':
+            return duration - elapsed
+        return 0
+
+    # make sure a tick is pending within delay seconds, ticks are at least interval apart
+    def wake(self, delay=0):
+        at = max(eventloop.time() + delay, self.last_tick + self.interval)
+        if self.tick_handle != None:
+            if self.tick_at <= at:
+                return
+            self.tick_handle.cancel()
+        self.tick_at = at
+        self.tick_handle = eventloop.call_at(at, self.tick)
+
+    def tick(self):
+        start = time.perf_counter()
+        self.tick_handle = None
+        now = eventloop.time()
+        self.last_tick = now
+        self.ticks += 1
+        next_tick = None
+        for key in list(self.animated):
+            ind = self.indicators[key]
+            elapsed = now - ind['start']
+            lvl = self.level(ind['pattern'], elapsed, ind['duration'])
+            if lvl == None:
+                ind['pattern'] = 'off'
+                self.animated.discard(key)
+                lvl = 0
+            else:
+                change = self.next_change(ind['pattern'], elapsed, ind['duration'])
+                if next_tick == None or change < next_tick:
+                    next_tick = change
+            ind['output'].write(ind['pattern_color'], lvl)
+        for hook in self.flush_hooks:
+            hook()
+        if next_tick != None:
+            self.wake(next_tick)
+        if metrics != None:
+            metrics.observe("animation_tick_seconds", time.perf_counter() - start)
+
+# virtual hardware, in-memory stand-ins for the display, leds, buttons and neopixels so the
+# whole pipeline runs and can be timed without a pi. bus and wire times are modeled from
+# the bytes each device would have been sent.
+
+# ssd1306 in horizontal addressing mode, takes luma style command() and data() calls and
+# keeps the controller ram so frames can be written out as PNG
+class virtual_oled(object):
+    def __init__(self, width, height, png_dir=None, png_every=1, bus_hz=400000):
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.ram = [bytearray(width) for p in range(self.pages)]
+        self.window = (0, width - 1, 0, self.pages - 1)
+        self.col = 0
+        self.page = 0
+        self.png_dir = png_dir
+        self.png_every = png_every
+        self.bus_hz = bus_hz
+        if png_dir != None:
+            os.makedirs(os.path.expanduser(png_dir), exist_ok=True)
+
+        # counters
+        self.frames = 0
+        self.bytes_pushed = 0
+        self.pngs = 0
+
+    def command(self, *cmds):
+        self.bytes_pushed += 1 + len(cmds)
+        i = 0
+        while i < len(cmds):
+            if cmds[i] == 0x21 and i + 2 < len(cmds):
+                self.window = (cmds[i+1], cmds[i+2]) + self.window[2:]
+                self.col = cmds[i+1]
+                i += 3
+            elif cmds[i] == 0x22 and i + 2 < len(cmds):
+                self.window = self.window[:2] + (cmds[i+1], cmds[i+2])
+                self.page = cmds[i+1]
+                i += 3
+            else:
+                i += 1
+
+    def data(self, values):
+        self.bytes_pushed += len(values) + (len(values) + 31) // 32
+        (c0, c1, p0, p1) = self.window
+        for value in values:
+            self.ram[self.page][self.col] = value
+            self.col += 1
+            if self.col > c1:
+                self.col = c0
+                self.page = p0 if self.page >= p1 else self.page + 1
+
+    # full frame write, what luma's display() sends
+    def display(self, image):
+        raw = image.convert("1").transpose(Image.TRANSPOSE).tobytes().translate(bit_reverse)
+        self.command(0x21, 0, self.width - 1, 0x22, 0, self.pages - 1)
+        for p in range(self.pages):
+            self.ram[p][:] = raw[p::self.pages]
+        self.bytes_pushed += self.width * self.pages + (self.width * self.pages + 31) // 32
+
+    # current ram contents as an image
+    def image(self):
+        raw = bytearray(self.width * self.pages)
+        for p in range(self.pages):
+            raw[p::self.pages] = self.ram[p]
+        return Image.frombytes("1", (self.height, self.width), bytes(raw.translate(bit_reverse))).transpose(Image.TRANSPOSE)
+
+    def end_frame(self):
+        self.frames += 1
+        if self.png_dir != None and self.png_every > 0 and self.frames % self.png_every == 0:
+            self.image().save(os.path.join(os.path.expanduser(self.png_dir), "frame_{:06d}.png".format(self.frames)))
+            self.pngs += 1
+
+    # seconds the pushed bytes would take on the bus, 9 clocks per byte
+    def bus_time(self):
+        return self.bytes_pushed * 9 / self.bus_hz
+
+    def stats(self):
+        return "virtual_oled: {} frames, {} bytes, {:.3f}s modeled bus time at {}kHz, {} PNGs".format(
+            self.frames, self.bytes_pushed, self.bus_time(), self.bus_hz // 1000, self.pngs)
+
+# neopixel strip with the NeoPixel interface used here, logs each show()
+class virtual_pixels(object):
+    def __init__(self, count, order="GRB", brightness=1.0):
+        self.order = order
+        self.brightness = brightness
+        self.pixels = [(0,) * len(order)] * count
+        self.shown = list(self.pixels)
+
+        # counters
+        self.shows = 0
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def __getitem__(self, place):
+        return self.pixels[place]
+
+    def __setitem__(self, place, color):
+        self.pixels[place] = tuple(color)
+
+    def fill(self, color):
+        self.pixels = [tuple(color)] * len(self.pixels)
+
+    def show(self):
+        self.shows += 1
+        if config.debug and self.pixels != self.shown:
+            print("virtual_pixels: show {}".format(self.pixels))
+        self.shown = list(self.pixels)
+
+    def deinit(self):
+        self.fill((0,) * len(self.order))
+        self.show()
+
+    # ws2812 data is 800kHz, 8 bits per color byte, plus the 50us latch
+    def wire_time(self):
+        return self.shows * (len(self.pixels) * len(self.order) * 8 / 800000 + 0.00005)
+
+    def stats(self):
+        return "virtual_pixels: {} shows, {:.3f}s modeled wire time".format(self.shows, self.wire_time())
+
+# gpiozero LED stand-in
+class virtual_led(object):
+    def __init__(self, pin):
+        self.pin = pin
+        self.is_lit = False
+        self.toggles = 0
+
+    def on(self):
+        if not self.is_lit:
+            self.toggles += 1
+            self.is_lit = True
+            if config.debug: print("virtual_led: pin {} on".format(self.pin))
+
+    def off(self):
+        if self.is_lit:
+            self.toggles += 1
+            self.is_lit = False
+            if config.debug: print("virtual_led: pin {} off".format(self.pin))
+
+    def stats(self):
+        return "virtual_led: pin {}, {} toggles".format(self.pin, self.toggles)
+
+# gpiozero Button stand-in, press() runs the handler like a real press would
+class virtual_button(object):
+    def __init__(self, pin):
+        self.pin = pin
+        self.when_pressed = None
+        self.presses = 0
+
+    def press(self):
+        self.presses += 1
+        if self.when_pressed != None:
+            eventloop.call_soon(self.when_pressed)
+
+    def stats(self):
+        return "virtual_button: pin {}, {} presses".format(self.pin, self.presses)
+
+# per-component counters and timings of a run on virtual hardware
+def print_virtual_stats(display, gpio):
+    if display != None and display.driver == "virtual":
+        frames = max(display.frames_sent, 1)
+        print("i2c_controller: {} frames, {:.2f}ms draw and {:.2f}ms push per frame, {:.0f} bytes per frame".format(
+            display.frames_sent, display.draw_time * 1000 / frames, display.show_time * 1000 / frames, display.bytes_total / frames))
+        print(display.disp.stats())
+    if gpio != None and gpio.virtual:
+        print("animation_engine: {} ticks".format(gpio.anim.ticks))
+        if gpio.np_running:
+            print(gpio.pixels.stats())
+        for led in gpio.leds.values():
+            print(led.stats())
+        for btn in gpio.buttons.values():
+            print(btn.stats())
+
+# system health read straight from /proc and /sys without psutil or vcgencmd, the files
+# are opened once and re-read with pread. readings are cpu, memory and disk use in percent,
+# 1 minute load, temperature in degrees c and the raspberry pi firmware throttle flags
+#   bit 0  under-voltage now       bit 16  under-voltage has occurred
+#   bit 1  arm frequency capped    bit 17  frequency capping has occurred
+#   bit 2  throttled               bit 18  throttling has occurred
+#   bit 3  soft temperature limit  bit 19  soft temperature limit has occurred
+# thermal and voltage events are emitted when their state changes, sampling is fast
+# while a threshold is near and slow otherwise
+class health_sampler(object):
+    def __init__(self, interval=(1, 10), disk_path="/", thermal_zone=0, temp_warn=60, temp_crit=70, margin=5, hysteresis=2):
+        (self.interval_min, self.interval_max) = interval
+        self.disk_path = disk_path
+        self.temp_warn = temp_warn
+        self.temp_crit = temp_crit
+        self.margin = margin
+        self.hysteresis = hysteresis
+
+        self.fds = {}
+        self.open_source('stat', "/proc/stat")
+        self.open_source('meminfo', "/proc/meminfo")
+        self.open_source('loadavg', "/proc/loadavg")
+        self.open_source('temp', "/sys/class/thermal/thermal_zone{}/temp".format(thermal_zone))
+        # firmware flags when the kernel exposes them, else the rpi_volt hwmon alarm for bit 0
+        if not self.open_source('throttled', "/sys/devices/platform/soc/soc:firmware/get_throttled"):
+            try:
+                for hwmon in sorted(os.listdir("/sys/class/hwmon")):
+                    path = "/sys/class/hwmon/" + hwmon
+                    with open(path + "/name") as name_file:
+                        if name_file.read().strip() == "rpi_volt":
+                            self.open_source('lcrit_alarm', path + "/in0_lcrit_alarm")
+                            break
+            except OSError:
+                pass
+
+        self.values = { 'cpu': None, 'mem': None, 'disk': None, 'load': None, 'temp': None, 'throttled': None }
+        self.cpu_last = None
+        self.thermal = None
+        self.voltage = None
+        self.samples = 0
+        self.handle = None
+
+    def open_source(self, name, path):
+        try:
+            self.fds[name] = os.open(path, os.O_RDONLY)
+            return True
+        except OSError:
+            if config.debug: print("health_sampler: {} not available".format(path))
+            return False
+
+    # read a whole small file from the start, a source that fails is closed and skipped
+    def read(self, name, size=256):
+        try:
+            return os.pread(self.fds[name], size, 0)
+        except OSError as err:
+            print("health_sampler: reading {} failed: {}".format(name, err))
+            os.close(self.fds.pop(name))
+            return None
+
+    @staticmethod
+    def meminfo_kb(data, key):
+        start = data.find(key) + len(key)
+        return int(data[start:data.find(b"kB", start)])
+
+    def sample(self):
+        values = self.values
+        if 'stat' in self.fds:
+            data = self.read('stat')
+            if data != None:
+                # aggregate cpu line: user nice system idle iowait irq softirq steal
+                ticks = [int(field) for field in data[:data.find(b"\n")].split()[1:9]]
+                total = sum(ticks)
+                idle = ticks[3] + ticks[4]
+                if self.cpu_last != None and total > self.cpu_last[0]:
+                    values['cpu'] = round(100 * (1 - (idle - self.cpu_last[1]) / (total - self.cpu_last[0])), 1)
+                self.cpu_last = (total, idle)
+        if 'meminfo' in self.fds:
+            data = self.read('meminfo')
+            if data != None:
+                total = self.meminfo_kb(data, b"MemTotal:")
+                values['mem'] = round(100 * (1 - self.meminfo_kb(data, b"MemAvailable:") / total), 1)
+        if 'loadavg' in self.fds:
+            data = self.read('loadavg')
+            if data != None:
+                values['load'] = float(data[:data.find(b" ")])
+        try:
+            fs = os.statvfs(self.disk_path)
+            used = fs.f_blocks - fs.f_bfree
+            if used + fs.f_bavail > 0:
+                values['disk'] = round(100 * used / (used + fs.f_bavail), 1)
+        except OSError:
+            pass
+        if 'temp' in self.fds:
+            data = self.read('temp')
+            if data != None:
+                values['temp'] = int(data) / 1000
+        if 'throttled' in self.fds:
+            data = self.read('throttled')
+            if data != None:
+                values['throttled'] = int(data, 16)
+        elif 'lcrit_alarm' in self.fds:
+            data = self.read('lcrit_alarm')
+            if data != None:
+                values['throttled'] = int(data) & 1
+        self.samples += 1
+
+    # 0 below temp_warn, 1 from temp_warn, 2 from temp_crit, a state is left hysteresis below its threshold
+    def thermal_state(self, temp):
+        state = 0
+        for (level, limit) in ((1, self.temp_warn), (2, self.temp_crit)):
+            if self.thermal != None and self.thermal >= level:
+                limit -= self.hysteresis
+            if temp >= limit:
+                state = level
+        return state
+
+    def start(self):
+        self.tick()
+
+    def stop(self):
+        if self.handle != None:
+            self.handle.cancel()
+            self.handle = None
+
+    def close(self):
+        self.stop()
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+    def tick(self):
+        self.sample()
+        temp = self.values['temp']
+        flags = self.values['throttled']
+        if temp != None:
+            state = self.thermal_state(temp)
+            if state != self.thermal:
+                self.thermal = state
+                events.wsc_new({'type': "thermal", 'state': state, 'temp': temp})
+        if flags != None:
+            state = flags & 1
+            if state != self.voltage:
+                self.voltage = state
+                events.wsc_new({'type': "voltage", 'state': state, 'flags': flags})
+        near = (self.thermal or self.voltage or (flags != None and flags & 0xF)
+                or (temp != None and temp >= self.temp_warn - self.margin))
+        delay = self.interval_min if near else self.interval_max
+        self.handle = eventloop.call_later(delay, self.tick)
+
+# add up counters labelled by type or reason over all sources
+def merge_counts(counts):
+    merged = {}
+    for count in counts:
+        for (key, val) in count.items():
+            merged[key] = merged.get(key, 0) + val
+    return merged
+
+# report the counters the controllers already keep through the metrics registry,
+# connector metrics are labelled by kismet source
+def register_metrics(wscs, jcs, display, gpio, health, status):
+    metrics.gauge("ws_frames_total", "Eventbus frames received", lambda: { wsc.source: wsc.frames for wsc in wscs }, "source", kind="counter")
+    metrics.gauge("ws_bytes_total", "Eventbus bytes received", lambda: { wsc.source: wsc.bytes for wsc in wscs }, "source", kind="counter")
+    metrics.rate("ws_frames_per_second", "Eventbus frames per second", lambda: sum([wsc.frames for wsc in wscs]))
+    metrics.rate("ws_bytes_per_second", "Eventbus bytes per second", lambda: sum([wsc.bytes for wsc in wscs]))
+    metrics.gauge("ws_reconnects_total", "Websocket reconnects", lambda: { wsc.source: wsc.reconnect_count for wsc in wscs }, "source", kind="counter")
+    metrics.gauge("ws_stalls_total", "Connections dropped by the eventbus watchdog by reason", lambda: merge_counts([wsc.stalls for wsc in wscs]), "reason", kind="counter")
+    metrics.gauge("ws_ping_rtt_seconds", "Websocket ping round trip", lambda: { wsc.source: wsc.ws.rtt if wsc.ws != None else None for wsc in wscs }, "source")
+    metrics.gauge("ws_first_event_latency_seconds", "Seconds from losing the eventbus to the first event after reconnecting", lambda: { wsc.source: wsc.first_event_latency for wsc in wscs }, "source")
+    metrics.gauge("alerts_total", "Discovery alerts by type", lambda: merge_counts([wsc.alerts.totals for wsc in wscs]), "type", kind="counter")
+    metrics.gauge("alert_summaries_total", "Aggregated alert summaries", lambda: { wsc.source: wsc.alerts.summaries for wsc in wscs }, "source", kind="counter")
+    metrics.gauge("rest_requests_total", "Kismet REST requests sent", lambda: { jc.source: jc.rest.requests for jc in jcs }, "source", kind="counter")
+    metrics.gauge("rest_cache_hits_total", "Kismet REST requests served from cache", lambda: { jc.source: jc.rest.cache_hits for jc in jcs }, "source", kind="counter")
+    metrics.gauge("rest_coalesced_total", "Kismet REST requests merged into one in flight", lambda: { jc.source: jc.rest.coalesced for jc in jcs }, "source", kind="counter")
+    metrics.gauge("rest_errors_total", "Kismet REST requests that failed", lambda: { jc.source: jc.rest.errors for jc in jcs }, "source", kind="counter")
+    synced = [jc for jc in jcs if jc.sync != None]
+    if len(synced) > 0:
+        metrics.gauge("devices", "Devices in the device index", lambda: { jc.source: len(jc.sync.index) for jc in synced }, "source")
+        metrics.gauge("device_evictions_total", "Devices evicted from the full device index", lambda: { jc.source: jc.sync.index.evicted for jc in synced }, "source", kind="counter")
+        metrics.gauge("device_ssids", "SSIDs in the device index", lambda: { jc.source: jc.sync.index.ssid_count() for jc in synced }, "source")
+        metrics.gauge("devices_by_phy", "Devices in the device index by phy", lambda: merge_counts([jc.sync.index.phy_counts() for jc in synced]), "phy")
+        metrics.gauge("devices_by_type", "Devices in the device index by device type", lambda: merge_counts([jc.sync.index.type_counts() for jc in synced]), "type")
+        metrics.gauge("devices_by_crypt", "Devices in the device index by encryption class", lambda: merge_counts([jc.sync.index.crypt_counts() for jc in synced]), "crypt")
+    metrics.gauge("startup_seconds", "Seconds from start to each startup milestone", lambda: events.startup, "milestone")
+    if display != None:
+        metrics.gauge("display_frames_total", "Frames pushed to the display", lambda: display.frames_sent, kind="counter")
+        metrics.gauge("display_bytes_total", "Bytes pushed to the display", lambda: display.bytes_total, kind="counter")
+        metrics.gauge("text_cache_hits_total", "Text cache hits", lambda: display.text.hits, kind="counter")
+        metrics.gauge("text_cache_misses_total", "Text cache misses", lambda: display.text.misses, kind="counter")
+        metrics.gauge("msg_dropped_total", "Display messages dropped from a full queue by class", lambda: display.msgs.dropped, "class", kind="counter")
+        metrics.gauge("msg_expired_total", "Display messages expired before display by class", lambda: display.msgs.expired, "class", kind="counter")
+    if health != None:
+        metrics.gauge("system_cpu_percent", "Cpu use since the previous health sample", lambda: health.values['cpu'])
+        metrics.gauge("system_memory_percent", "Memory in use, excluding reclaimable memory", lambda: health.values['mem'])
+        metrics.gauge("system_disk_percent", "Disk space in use", lambda: health.values['disk'])
+        metrics.gauge("system_load1", "1 minute load average", lambda: health.values['load'])
+        metrics.gauge("system_temperature_celsius", "Cpu temperature", lambda: health.values['temp'])
+        metrics.gauge("system_throttled_flags", "Raspberry pi firmware throttle flags", lambda: health.values['throttled'])
+    if status != None:
+        metrics.gauge("status_clients", "Status page event stream clients", lambda: len(status.clients))
+        metrics.gauge("status_updates_total", "Status deltas broadcast", lambda: status.updates, kind="counter")
+        metrics.gauge("status_bytes_total", "Status stream bytes sent", lambda: status.bytes, kind="counter")
+        metrics.gauge("status_dropped_total", "Status stream clients dropped for not reading", lambda: status.dropped, kind="counter")
+    if gpio != None:
+        metrics.gauge("animation_ticks_total", "Led and pixel animation ticks", lambda: gpio.anim.ticks, kind="counter")
+        if gpio.np_running:
+            metrics.gauge("pixel_flushes_total", "Neopixel strip updates", lambda: gpio.np_frame.flushes, kind="counter")
+
+# class for gpio io_controller
+class gpio_controller(object):
+    def __init__(self, fps=50, virtual=False):
+        print("Configuring local gpio.")
+        # virtual leds, buttons and pixels stand in for gpiozero and neopixel
+        self.virtual = virtual
+        self.button_lines = {'show_stats': None}
+        self.buttons = {}
+
+        self.led_lines = {}
+        self.leds = {}
+
+        self.np_pixels = {}
+        self.np_running = False
+
+        # leds and pixels are animated from one tick
+        self.anim = animation_engine(fps)
+
+    def configure_buttons(self, btns, events):
+        try:
+            for btn in btns['lines']:
+                try:
+                    if btn['function'] == 'show_stats':
+                        self.button_lines['show_stats'] = btn['gpio_pin']
+                        self.button_watcher(btn['gpio_pin'], events.btn_status)
+                except Exception as err:
+                    if config.debug:
+                        traceback.print_tb(err.__traceback__)
+                        print(err)
+                    print("Failed to configure 'lines' entry in 'input_buttons':")
+                    print(btn)
+        except Exception as err:
+            if config.debug:
+                traceback.print_tb(err.__traceback__)
+                print(err)
+            print("Failed to configure 'lines' in 'input_buttons'")
+
+    def configure_leds(self, leds, events):
+        ws_evt = events.ws_event
+        try:
+            if 'duration' in leds.keys():
+                self.led_duration = leds['duration']
             else:
                 self.led_duration = 0.3
                 print(f"In configuration 'leds' is enabled but 'duration' is not defined. Defaulting to '{self.led_duration}'")
@@ -491,10 +2552,16 @@ class gpio_controller(object):
                 try:
                     for ev in ws_evt.keys():
                         if led['function'] == ev:
-                            self.led_lines[ev] = { 'pin': pin, 'state': 0 }
-                            ws_evt[ev].append(self.led_change)
+                            # with 'source' set the led only follows events from that kismet source
+                            if not ev in self.led_lines.keys():
+                                self.led_lines[ev] = []
+                                ws_evt[ev].append(self.led_change)
+                            self.led_lines[ev].append({ 'pin': pin,
+                                                        'source': led['source'] if 'source' in led.keys() else None })
                             if not pin in self.leds.keys():
-                                self.leds[pin] = LED(pin)
+                                self.leds[pin] = virtual_led(pin) if self.virtual else LED(pin)
+                            self.anim.add(('led', ev, pin), led_output(self.leds[pin]), self.led_duration,
+                                          states=led['states'] if 'states' in led.keys() else None)
                 except Exception as err:
                     if config.debug:
                         traceback.print_tb(err.__traceback__)
@@ -507,64 +2574,17 @@ class gpio_controller(object):
                 print(err)
             print("Failed to configure 'lines' in 'leds'")
 
-    def led_change(self, event, timed=False, set_on=True):
+    def led_change(self, event, timed=False):
         ev = event['type']
-        pin = self.led_lines[ev]['pin']
-        if config.debug and not timed:
+        if config.debug:
             print("led_change: "+ev+" "+str(self.led_lines[ev]))
-
-        # handled stated events, 0 for off, 1 for flashing, 2, for on
-        if 'state' in event.keys():
-            # off/on being simple
-            if event['state'] == 0:
-                self.leds[pin].off()
-                self.led_lines[ev]['state'] = 0
-            elif event['state'] == 2:
-                self.leds[pin].on()
-                self.led_lines[ev]['state'] = 2
-            # flashing, timed callbacks with args to indicate where we are
-            elif event['state'] == 1:
-                # check for and localize the state, saves on ifs later
-                if 'state' in self.led_lines[ev].keys():
-                    pstate = self.led_lines[ev]['state']
-                else:
-                    pstate = 0
-                # new trigger coming from wsc
-                if not timed and pstate != 1:
-                    if pstate == 0:
-                        self.leds[pin].on()
-                    else:
-                        self.leds[pin].ff()
-                    self.led_lines[ev]['state'] = 1
-                    eventloop.call_later(self.led_duration, self.led_change, event, True, True)
-                # now just the timed callbacks
-                elif timed and pstate == 1:
-                    if set_on:
-                        self.leds[pin].on()
-                        eventloop.call_later(self.led_duration, self.led_change, event, True, False)
-                    if not set_on:
-                        self.leds[pin].off()
-                        eventloop.call_later(self.led_duration, self.led_change, event, True, True)
-                # handle some wtf's
-                elif timed and config.debug: print("led_change: 'timed' call with unexpected state: {}".format(event))
-            elif config.debug: print("led_change: Unexpected 'state' passed: {}".format(event['state']))
-        # now for events with a timestamp
-        elif 'ts' in event.keys():
-            if not timed:
-                if not 'ts' in self.led_lines[ev].keys() or event['ts'] > self.led_lines[ev]['ts']:
-                    self.led_lines[ev]['ts'] = event['ts']
-                    self.leds[pin].on()
-                    eventloop.call_later(self.led_duration, self.led_change, event, True, False)
-            else:
-                if self.led_lines[ev]['ts'] == event['ts']:
-                    self.leds[pin].off()
-        # and error for unhandled
-        elif config.debug: print("led_change: Unexpected 'event' passed: {}".format(event))
+        for line in self.led_lines[ev]:
+            if line['source'] == None or ('source' in event.keys() and line['source'] == event['source']):
+                self.anim.trigger(('led', ev, line['pin']), event)
 
     def configure_neopixel(self, neopixels, events):
         ws_evt = events.ws_event
         try:
-            np_pin = getattr(board, 'D'+str(neopixels['pin']))
             if 'duration' in neopixels.keys():
                 self.np_duration = neopixels['duration']
             else:
@@ -590,19 +2610,34 @@ class gpio_controller(object):
                 else:
                     raise Exception("Unexpected length of 'color' for first element in 'pixels', 3 or 4 bytes expected!")
                 print(f"In configuration 'neopixels' is enabled but 'order' is not defined. Defaulting to '{order}'")
-            self.pixels = neopixel.NeoPixel(np_pin, cnt, brightness=bright, pixel_order=order, auto_write=True)
+            # strip is only written by the frame flush, one transfer per animation tick
+            if self.virtual:
+                self.pixels = virtual_pixels(cnt, order, brightness=bright)
+            else:
+                np_pin = getattr(board, 'D'+str(neopixels['pin']))
+                self.pixels = neopixel.NeoPixel(np_pin, cnt, brightness=bright, pixel_order=order, auto_write=False)
+            self.np_frame = pixel_frame(self.pixels, cnt, len(order), self.anim.wake)
+            self.anim.flush_hooks.append(self.np_frame.flush)
+            # writing to the pixels mainly to ensure permissions, the colour sweep runs later in pixel_test
+            self.pixels.show()
+            self.np_test = []
             try:
                 for i in range(len(neopixels['pixels'])):
                     try:
-                        # writing to the pixels mainly to ensure permissions
-                        self.pixels[i] = neopixels['pixels'][i]['color']
-                        time.sleep(.1)
-                        self.pixels[i] = [0] * len(neopixels['pixels'][i]['color'])
+                        self.np_test.append(neopixels['pixels'][i]['color'])
                         for ev in ws_evt.keys():
                             if "function" in neopixels['pixels'][i].keys() and neopixels['pixels'][i]['function'] == ev:
-                                self.np_pixels[ev] = { 'place': i,
-                                                       'color': neopixels['pixels'][i]['color'] }
-                                ws_evt[ev].append(self.np_change)
+                                # with 'source' set the pixel only follows events from that kismet source
+                                if not ev in self.np_pixels.keys():
+                                    self.np_pixels[ev] = []
+                                    ws_evt[ev].append(self.np_change)
+                                self.np_pixels[ev].append({ 'place': i,
+                                                            'color': neopixels['pixels'][i]['color'],
+                                                            'source': neopixels['pixels'][i]['source'] if 'source' in neopixels['pixels'][i].keys() else None })
+                                self.anim.add(('np', ev, i), pixel_output(self.np_frame, i, len(order)), self.np_duration,
+                                              color=neopixels['pixels'][i]['color'],
+                                              states=neopixels['pixels'][i]['states'] if 'states' in neopixels['pixels'][i].keys() else None,
+                                              crypt_colors=neopixels['pixels'][i]['crypt_colors'] if 'crypt_colors' in neopixels['pixels'][i].keys() else None)
                     except Exception as err:
                         if config.debug:
                             traceback.print_tb(err.__traceback__)
@@ -621,74 +2656,226 @@ class gpio_controller(object):
             print(err)
             print("Failed to configure neopixels!")
 
-    def np_change(self, event, timed=False, set_color=True):
-        # localize some awkwardness for readablity
+    # light each configured pixel in turn, runs on the eventloop alongside the kismet connection
+    async def pixel_test(self):
+        self.np_frame.hold = True
+        try:
+            for i in range(len(self.np_test)):
+                self.pixels[i] = self.np_test[i]
+                self.pixels.show()
+                await asyncio.sleep(.1)
+                self.pixels[i] = [0] * len(self.np_test[i])
+                self.pixels.show()
+        except Exception as err:
+            if config.debug:
+                traceback.print_tb(err.__traceback__)
+            print(err)
+            print("Neopixel self test failed!")
+        # resend the whole frame once the test lets go of the strip
+        self.np_frame.hold = False
+        self.np_frame.sent = [None] * len(self.np_frame)
+        self.np_frame.wake()
+
+    def np_change(self, event, timed=False):
         ev = event['type']
-        place = self.np_pixels[ev]['place']
-        color = self.np_pixels[ev]['color']
-        black = [0]*len(self.np_pixels[ev]['color'])
-        # debug msg
-        if config.debug and not timed:
+        if config.debug:
             print("np_change: "+ev+" "+str(self.np_pixels[ev]))
-
-        # handled stated events, 0 for off, 1 for flashing, 2, for on
-        if 'state' in event.keys():
-            # off/on being simple
-            if event['state'] == 0:
-                self.pixels[place] = black
-                self.np_pixels[ev]['state'] = 0
-            elif event['state'] == 2:
-                self.pixels[place] = color
-                self.np_pixels[ev]['state'] = 2
-            # flashing, timed callbacks with args to indicate where we are
-            elif event['state'] == 1:
-                # check for and localize the state, saves on ifs later
-                if 'state' in self.np_pixels[ev].keys():
-                    pstate = self.np_pixels[ev]['state']
-                else:
-                    pstate = 0
-                # new trigger coming from wsc
-                if not timed and pstate != 1:
-                    if pstate == 0:
-                        self.pixels[place] = color
-                    else:
-                        self.pixels[place] = black
-                    self.np_pixels[ev]['state'] = 1
-                    eventloop.call_later(self.np_duration, self.np_change, event, True, True)
-                # now just the timed callbacks
-                elif timed and pstate == 1:
-                    if set_color:
-                        self.pixels[place] = color
-                        eventloop.call_later(self.np_duration, self.np_change, event, True, False)
-                    if not set_color:
-                        self.pixels[place] = black
-                        eventloop.call_later(self.np_duration, self.np_change, event, True, True)
-                # handle some wtf's
-                elif timed and config.debug: print("np_change: 'timed' call with unexpected state: {}".format(event))
-            elif config.debug: print("np_change: Unexpected 'state' passed: {}".format(event['state']))
-        # now for events with a timestamp
-        elif 'ts' in event.keys():
-            if not timed:
-                if not 'ts' in self.np_pixels[ev].keys() or event['ts'] > self.np_pixels[ev]['ts']:
-                    self.np_pixels[ev]['ts'] = event['ts']
-                    self.pixels[place] = color
-                    eventloop.call_later(self.np_duration, self.np_change, event, True, False)
-            else:
-                if self.np_pixels[ev]['ts'] == event['ts']:
-                    self.pixels[place] = black
-        # and error for unhandled
-        elif config.debug: print("np_change: Unexpected 'event' passed: {}".format(event))
+        for pixel in self.np_pixels[ev]:
+            if pixel['source'] == None or ('source' in event.keys() and pixel['source'] == event['source']):
+                self.anim.trigger(('np', ev, pixel['place']), event)
 
     def button_watcher(self, gpio_line, cb):
-        self.buttons['line_'+str(gpio_line)] = Button(gpio_line)
+        if self.virtual:
+            self.buttons['line_'+str(gpio_line)] = virtual_button(gpio_line)
+        else:
+            self.buttons['line_'+str(gpio_line)] = Button(gpio_line)
         self.buttons['line_'+str(gpio_line)].when_pressed = cb
 
+# bit order reversal table for packing PIL rows into SSD1306 column bytes
+bit_reverse = bytes(int("{:08b}".format(i)[::-1], 2) for i in range(256))
+
+# LRU cache of measured and pre-rendered 1-bit text, keyed by font and string
+class text_cache(object):
+    def __init__(self, size=64):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # entries are [(w, h), bitmap or None, (x, y) offset of the bbox from the text origin],
+    # the bitmap is rendered on first blit
+    def lookup(self, font, text):
+        key = (font, text)
+        entry = self.entries.get(key)
+        if entry != None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        bbox = font.getbbox(text)
+        entry = [(bbox[2] - bbox[0], bbox[3] - bbox[1]), None, (bbox[0], bbox[1])]
+        self.entries[key] = entry
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry
+
+    def measure(self, font, text):
+        return self.lookup(font, text)[0]
+
+    # draw text onto img at xy, same pixels as ImageDraw.text with fill set
+    def blit(self, img, xy, font, text):
+        entry = self.lookup(font, text)
+        (off_x, off_y) = entry[2]
+        if entry[1] == None:
+            entry[1] = Image.new("1", (max(entry[0][0], 1), max(entry[0][1], 1)))
+            ImageDraw.Draw(entry[1]).text((-off_x, -off_y), text, font=font, fill=1)
+        img.paste(1, (xy[0] + off_x, xy[1] + off_y), mask=entry[1])
+
+# packet rate graph from a kismet minute rrd, kept as a ring of samples and a cached bar bitmap.
+# new samples are shifted in, the bitmap scrolls and only bars whose height changed are redrawn.
+# bars are scaled to the peak sample, a new peak rescales every bar.
+class sparkline(object):
+    def __init__(self, length, bar_w, height, use_numpy=False):
+        self.length = length
+        self.bar_w = bar_w
+        self.height = height
+        self.use_numpy = use_numpy and load_numpy() != None
+        self.img = Image.new("1", (length * bar_w, height))
+        self.draw = ImageDraw.Draw(self.img)
+        self.reset()
+
+    def reset(self):
+        # samples are oldest to newest, heights are in drawing order with the newest bar on the left
+        self.samples = deque([0] * self.length, maxlen=self.length)
+        self.heights = [0] * self.length
+        self.peak = 0
+        self.last_time = None
+        self.draw.rectangle((0, 0, self.img.size[0], self.height), outline=0, fill=0)
+
+    # returns True when the bitmap changed
+    def update(self, vec, last_time, serial_time):
+        n = self.length
+        if self.last_time == None or not 0 <= last_time - self.last_time < n:
+            shift = n
+            self.samples.extend(vec[(last_time + i + 1) % n] for i in range(n))
+        else:
+            shift = last_time - self.last_time
+            # the previous newest slot may have been added to since it was read
+            self.samples[-1] = vec[self.last_time % n]
+            for t in range(self.last_time + 1, last_time + 1):
+                self.samples.append(vec[t % n])
+        self.last_time = last_time
+
+        # slots older than serial_time - last_time seconds are shown empty
+        gap = min(max(serial_time - last_time, 0), n)
+        if gap > 0:
+            values = [0] * gap + list(self.samples)[gap:]
+        else:
+            values = self.samples
+        peak = max(values)
+        heights = self.scale(values, peak)
+
+        if peak != self.peak:
+            # rescale, redraw every bar
+            self.peak = peak
+            self.draw.rectangle((0, 0, self.img.size[0], self.height), outline=0, fill=0)
+            self.heights = [0] * n
+        elif 0 < shift < n:
+            # scroll right so the new samples land on the left
+            dx = shift * self.bar_w
+            self.img.paste(self.img.crop((0, 0, self.img.size[0] - dx, self.height)), (dx, 0))
+            self.draw.rectangle((0, 0, dx - 1, self.height), outline=0, fill=0)
+            self.heights = [0] * shift + self.heights[:n - shift]
+
+        changed = False
+        for i in range(n):
+            if heights[i] != self.heights[i]:
+                self.draw_bar(i, heights[i])
+                changed = True
+        self.heights = heights
+        return changed or shift > 0
+
+    # bar heights in drawing order, newest first
+    def scale(self, values, peak):
+        f = peak / self.height
+        if f <= 0:
+            return [0] * self.length
+        if self.use_numpy:
+            return numpy.rint(numpy.fromiter(values, dtype=float, count=self.length)[::-1] / f).astype(int).tolist()
+        return [round(val / f) for val in reversed(values)]
+
+    def draw_bar(self, i, bh):
+        x0 = i * self.bar_w
+        x1 = x0 + self.bar_w - 1
+        self.draw.rectangle((x0, 0, x1, self.height - 1), outline=0, fill=0)
+        if bh > 0:
+            self.draw.rectangle((x0, self.height - bh, x1, self.height), outline=1, fill=1)
+
+# bounded display message queue with priority classes, 'error' before 'discovery' before
+# 'info' (events without a 'class'). each class holds at most limit messages, at least 1,
+# and drops its oldest when full. messages are kept in per-second buckets of their arrival
+# time on the monotonic clock, so buckets stay in age order whatever the timestamps of the
+# kismet sources do and expiring stale ones drops whole buckets from the front.
+class msg_queue(object):
+    classes = ('error', 'discovery', 'info')
+
+    def __init__(self, limit, max_age):
+        self.limit = max(1, limit)
+        self.max_age = max_age
+        self.buckets = {}
+        self.counts = {}
+        self.dropped = {}
+        self.expired = {}
+        for cls in self.classes:
+            self.buckets[cls] = deque()
+            self.counts[cls] = 0
+            self.dropped[cls] = 0
+            self.expired[cls] = 0
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def push(self, event):
+        cls = event['class'] if 'class' in event.keys() and event['class'] in self.buckets else 'info'
+        buckets = self.buckets[cls]
+        if self.counts[cls] >= self.limit:
+            buckets[0][1].popleft()
+            if not buckets[0][1]:
+                buckets.popleft()
+            self.counts[cls] -= 1
+            self.dropped[cls] += 1
+        arrived = int(time.monotonic())
+        if buckets and buckets[-1][0] == arrived:
+            buckets[-1][1].append(event)
+        else:
+            buckets.append((arrived, deque([event])))
+        self.counts[cls] += 1
+
+    # next message of the highest class that arrived no more than max_age seconds ago
+    def pop(self):
+        now = time.monotonic()
+        for cls in self.classes:
+            buckets = self.buckets[cls]
+            while buckets and now - buckets[0][0] > self.max_age:
+                cnt = len(buckets.popleft()[1])
+                self.counts[cls] -= cnt
+                self.expired[cls] += cnt
+            if buckets:
+                event = buckets[0][1].popleft()
+                if not buckets[0][1]:
+                    buckets.popleft()
+                self.counts[cls] -= 1
+                return event
+        return None
+
 # class for display drawing and updating
 class i2c_controller(object):
-    def __init__(self, driver, width, height, events, jsn, wsc):
-        # store connectors
-        self.jc = jsn
-        self.wc = wsc
+    def __init__(self, driver, width, height, events, jcs, wscs):
+        # store connectors, uptime and the packet graph follow the first kismet source
+        self.jcs = jcs
+        self.wcs = wscs
+        self.jc = jcs[0]
+        self.wc = wscs[0]
         self.driver = ""
 
         if driver == "adafruit_ssd1306":
@@ -699,6 +2886,28 @@ class i2c_controller(object):
             # Create the SSD1306 OLED class
             self.disp = adafruit_ssd1306.SSD1306_I2C(width, height, self.i2c)
             self.driver = "adafruit"
+            self.controller = "ssd1306"
+            # adafruit_ssd1306 centres narrow panels in the 128 column ram
+            if width == 64:
+                self.col_offset = 32
+            elif width == 72:
+                self.col_offset = 28
+            else:
+                self.col_offset = 0
+        elif driver == "virtual":
+            # in-memory ssd1306, driven through the same command/data calls as luma
+            if "png_dir" in config.i2c_display.keys() and config.i2c_display["png_dir"]:
+                png_dir = config.i2c_display["png_dir"]
+            else:
+                png_dir = None
+            if "png_every" in config.i2c_display.keys():
+                png_every = config.i2c_display["png_every"]
+            else:
+                png_every = 1
+            self.disp = virtual_oled(width, height, png_dir, png_every)
+            self.driver = "virtual"
+            self.controller = "ssd1306"
+            self.col_offset = 0
         elif driver.startswith("luma"):
             # luma.core driver
             # create I2C
@@ -707,10 +2916,14 @@ class i2c_controller(object):
             if driver[:dlr] == "luma.oled":
                 if driver[dlr+1:] == "ssd1306":
                     # create ssd1306 display
-                    self.disp = ssd1306(self.i2c)
+                    self.disp = ssd1306(self.i2c, width=width, height=height)
+                    self.controller = "ssd1306"
+                    self.col_offset = getattr(self.disp, "_colstart", 0)
                 elif driver[dlr+1:] == "sh1106":
-                    # create sh1106 display
-                    self.disp = sh1106(self.i2c)
+                    # create sh1106 display, its 132 column ram starts 2 columns in
+                    self.disp = sh1106(self.i2c, width=width, height=height)
+                    self.controller = "sh1106"
+                    self.col_offset = 2
             else:
                 print("i2c_controller: __init__ failed to find correct luma.core driver!")
                 sys.exit(1)
@@ -727,33 +2940,79 @@ class i2c_controller(object):
         self.msg_cnt = ((self.height // 2) - 8) // 8
         self.screen = Image.new("1", (self.width, self.height))
 
+        # last transmitted frame in controller page order, only changed pages are sent
+        if "page_diff" in config.i2c_display.keys():
+            self.page_diff = config.i2c_display["page_diff"]
+        else:
+            self.page_diff = True
+        self.pages = self.height // 8
+        self.last_pages = None
+        self.frame_bytes = 0
+        self.bytes_total = 0
+        self.frames_sent = 0
+        # seconds spent drawing bands and pushing frames
+        self.draw_time = 0
+        self.show_time = 0
+
+        # screen is split in horizontal bands that are redrawn only when marked dirty
+        self.bands = { 'status': (0, 8),
+                       'msg': (8, self.height - self.g_height),
+                       'graph': (self.height - self.g_height, self.height) }
+        self.band_img = {}
+        self.band_draw = {}
+        for (band, (y0, y1)) in self.bands.items():
+            self.band_img[band] = Image.new("1", (self.width, y1 - y0))
+            self.band_draw[band] = ImageDraw.Draw(self.band_img[band])
+        self.dirty = set()
+
+        # frame rate cap, at most one coalesced frame per interval
+        if "max_fps" in config.i2c_display.keys() and config.i2c_display["max_fps"] > 0:
+            self.frame_interval = 1 / config.i2c_display["max_fps"]
+        else:
+            self.frame_interval = 1 / 10
+        self.render_handle = None
+        self.last_frame = 0
+
         # Get drawing object to draw on image.
         self.draw = ImageDraw.Draw(self.screen)
 
-        # do a quick test and then clear
-        self.draw.rectangle((0, 0, self.width, self.height), outline=1, fill=1)
-        self.show_screen()
-        time.sleep(.2)
-        self.clear_screen()
+        # frames are held back while self_test has the screen
+        self.testing = False
 
         # Load default font.
         self.font = ImageFont.load_default()
+        if "text_cache_size" in config.i2c_display.keys():
+            self.text = text_cache(config.i2c_display["text_cache_size"])
+        else:
+            self.text = text_cache()
 
-        # init images for status display
-        (ws_w, ws_h) = self.font.getsize("--")
-        self.ws_img = Image.new("1", (ws_w+1, ws_h-1))
-        self.ws_state_change({"state": 0}, True)
+        # init images for status display, one connection indicator per kismet source
+        self.ws_imgs = OrderedDict()
+        for wc in self.wcs:
+            (ws_w, ws_h) = self.text.measure(self.font, "--" if len(self.wcs) == 1 else wc.label)
+            self.ws_imgs[wc.source] = (Image.new("1", (ws_w+1, ws_h-1)), wc.label)
+            self.ws_state_change({"state": 0, "source": wc.source}, True)
 
-        (gps_w, gps_h) = self.font.getsize("--")
+        # gps shows the best fix of all sources
+        self.gps_states = {}
+        (gps_w, gps_h) = self.text.measure(self.font, "--")
         self.gps_img = Image.new("1", (gps_w+1, gps_h-1))
-        self.gps_state_change({"state": 0}, True)
+        self.gps_state_change({"state": 0, "source": self.wc.source}, True)
+
+        # connection errors by source, the first one is shown
+        self.errors = OrderedDict()
 
         # init display info variables
         self.ut_str = "Not Connected"
         self.msg = ["..."]
         while len(self.msg) < self.msg_cnt:
             self.msg.append("")
-        self.min_vec = None
+        if "graph_numpy" in config.i2c_display.keys():
+            graph_numpy = config.i2c_display["graph_numpy"]
+        else:
+            graph_numpy = False
+        self.graph = sparkline(60, self.width // 60, self.g_height, graph_numpy)
+        self.graph_on = False
 
         # init msg timings
         if "msg_disp_time" in config.i2c_display.keys():
@@ -764,7 +3023,12 @@ class i2c_controller(object):
             self.msg_max_age = config.i2c_display["msg_max_age"]
         else:
             self.msg_max_age = 10
-        self.msg_deque = deque([])
+        if "msg_queue_size" in config.i2c_display.keys():
+            msg_queue_size = config.i2c_display["msg_queue_size"]
+        else:
+            msg_queue_size = 16
+        self.msgs = msg_queue(msg_queue_size, self.msg_max_age)
+        self.msg_handle = None
         self.msg_error = False
 
         # add event cb
@@ -775,31 +3039,144 @@ class i2c_controller(object):
         events.ws_event["error_state"].append(self.error_state_change)
 
     def show_screen(self):
+        if self.page_diff:
+            try:
+                self.show_pages()
+                if self.driver == "virtual":
+                    self.disp.end_frame()
+                return
+            except Exception as err:
+                if config.debug:
+                    traceback.print_tb(err.__traceback__)
+                print(err)
+                print("i2c_controller: page updates failed, falling back to full frames.")
+                self.page_diff = False
         if self.driver == "adafruit":
             self.disp.image(self.screen)
             self.disp.show()
-        elif self.driver == "luma":
+            # 6 two byte commands, the 0x40 control byte and the buffer
+            self.frame_bytes = 13 + self.width * self.pages
+        elif self.driver in ("luma", "virtual"):
             self.disp.display(self.screen)
+            if self.controller == "sh1106":
+                self.frame_bytes = self.data_bytes(3, self.width) * self.pages
+            else:
+                self.frame_bytes = self.data_bytes(6, self.width * self.pages)
         else:
             print("i2c_controller: show_screen failed to find correct display driver!")
             sys.exit(1)
+        self.bytes_total += self.frame_bytes
+        self.frames_sent += 1
+        if self.driver == "virtual":
+            self.disp.end_frame()
+
+    # pack the screen in controller page order, one byte per column for each 8 pixel row, top pixel in the LSB
+    def screen_pages(self):
+        raw = self.screen.transpose(Image.TRANSPOSE).tobytes().translate(bit_reverse)
+        return [raw[p::self.pages] for p in range(self.pages)]
+
+    # send only the pages, and the column range within each page, that differ from the last frame
+    def show_pages(self):
+        pages = self.screen_pages()
+        sent = 0
+        for p in range(self.pages):
+            if self.last_pages == None:
+                (x0, x1) = (0, self.width - 1)
+            elif pages[p] == self.last_pages[p]:
+                continue
+            else:
+                diff = int.from_bytes(pages[p], "big") ^ int.from_bytes(self.last_pages[p], "big")
+                x0 = (self.width * 8 - diff.bit_length()) // 8
+                x1 = self.width - 1 - ((diff & -diff).bit_length() - 1) // 8
+            sent += self.write_page(p, x0, x1, pages[p][x0:x1+1])
+        self.last_pages = pages
+        self.frame_bytes = sent
+        self.bytes_total += sent
+        self.frames_sent += 1
+
+    # write one page column range, returns bytes put on the bus (without address bytes)
+    def write_page(self, page, x0, x1, data):
+        col0 = x0 + self.col_offset
+        col1 = x1 + self.col_offset
+        if self.driver == "adafruit":
+            # adafruit_ssd1306 sends each command with its own 0x80 control byte
+            for cmd in (0x21, col0, col1, 0x22, page, page):
+                self.disp.write_cmd(cmd)
+            with self.disp.i2c_device:
+                self.disp.i2c_device.write(b"\x40" + data)
+            return 13 + len(data)
+        elif self.controller == "sh1106":
+            # page addressing, set page and start column then stream the range
+            self.disp.command(0xB0 | page, col0 & 0x0F, 0x10 | (col0 >> 4))
+            self.disp.data(list(data))
+            return self.data_bytes(3, len(data))
+        else:
+            self.disp.command(0x21, col0, col1, 0x22, page, page)
+            self.disp.data(list(data))
+            return self.data_bytes(6, len(data))
+
+    # luma sends commands behind one control byte and data in 32 byte chunks with a control byte each
+    @staticmethod
+    def data_bytes(cmds, data_len):
+        return 1 + cmds + data_len + (data_len + 31) // 32
+
+    # mark a band for redraw and schedule the next frame if one is not pending
+    def mark_dirty(self, band):
+        self.dirty.add(band)
+        if self.render_handle == None and not self.testing:
+            delay = max(0, self.last_frame + self.frame_interval - time.monotonic())
+            self.render_handle = eventloop.call_later(delay, self.render_tick)
+
+    def render_tick(self):
+        self.render_handle = None
+        self.last_frame = time.monotonic()
+        self.draw_screen()
 
+    # redraw dirty bands and push the frame
     def draw_screen(self):
-        # Draw a black filled box to clear the image.
-        self.draw.rectangle((0, 0, self.width, self.height), outline=0, fill=0)
+        start = time.perf_counter()
+        if 'status' in self.dirty:
+            self.draw_status()
+        if 'msg' in self.dirty:
+            self.draw_msgs()
+        if 'graph' in self.dirty:
+            self.draw_graph()
+        self.dirty.clear()
+        drawn = time.perf_counter()
+        self.draw_time += drawn - start
+
+        # Display image.
+        self.show_screen()
+        shown = time.perf_counter()
+        if tracer != None:
+            tracer.record("draw_bands", "display", start, drawn)
+            tracer.record("show_screen", "display", drawn, shown)
+        self.show_time += shown - drawn
+        events.frame_shown()
+        if metrics != None:
+            metrics.observe("display_draw_seconds", drawn - start)
+            metrics.observe("display_push_seconds", shown - drawn)
+
+    def draw_status(self):
+        img = self.band_img['status']
+        draw = self.band_draw['status']
+        draw.rectangle((0, 0, self.width, img.size[1]), outline=0, fill=0)
 
-        # websocket connection indicator
-        (ws_w, ws_h) = self.ws_img.size
-        self.screen.paste(self.ws_img, (0,-1))
+        # websocket connection indicators
+        ws_w = 0
+        for (ws_img, label) in self.ws_imgs.values():
+            img.paste(ws_img, (ws_w,-1))
+            ws_w += ws_img.size[0] + 1
+        ws_w -= 1
 
         # gps indicator
         (gps_w, gps_h) = self.gps_img.size
-        self.screen.paste(self.gps_img, (self.width - gps_w, -1))
+        img.paste(self.gps_img, (self.width - gps_w, -1))
 
         # uptime indicator
         ut_max_w = self.width - (ws_w + gps_w)
         up_str = self.ut_str
-        (ut_w, ut_h) = self.font.getsize(up_str)
+        (ut_w, ut_h) = self.text.measure(self.font, up_str)
         while ut_w > ut_max_w:
             ci = up_str.rfind(":")
             if ci != -1:
@@ -808,49 +3185,68 @@ class i2c_controller(object):
                 ci = up_str.rfind(",")
                 if ci != -1:
                     up_str = up_str[:ci]
-            (ut_w, ut_h) = self.font.getsize(up_str)
-        if up_str != "Not Connected" and ut_max_w > self.font.getsize("Up:"+up_str)[0]:
+            (ut_w, ut_h) = self.text.measure(self.font, up_str)
+        if up_str != "Not Connected" and ut_max_w > self.text.measure(self.font, "Up:"+up_str)[0]:
             up_str = "Up:"+up_str
-            (ut_w, ut_h) = self.font.getsize(up_str)
+            (ut_w, ut_h) = self.text.measure(self.font, up_str)
         ut_x = (self.width // 2) - (ut_w // 2)
-        self.draw.text((ut_x, -2), up_str, font=self.font, fill=255)
+        self.text.blit(img, (ut_x, -2), self.font, up_str)
+        self.screen.paste(img, (0, self.bands['status'][0]))
 
+    def draw_msgs(self):
+        img = self.band_img['msg']
+        draw = self.band_draw['msg']
+        draw.rectangle((0, 0, self.width, img.size[1]), outline=0, fill=0)
         for i in range(self.msg_cnt):
-            self.draw.text((0, 8*(i+1)), self.msg[i], font=self.font, fill=255)
+            self.text.blit(img, (0, 8*i), self.font, self.msg[i])
+        self.screen.paste(img, (0, self.bands['msg'][0]))
 
-        if self.min_vec != None:
-            bar_w = self.width//len(self.min_vec)
-            g_x = (self.width - (bar_w*len(self.min_vec)))//2
-            self.screen.paste(self.graph_vec(self.min_vec, bar_w, self.g_height), (g_x, self.height-self.g_height))
+    def draw_graph(self):
+        img = self.band_img['graph']
+        draw = self.band_draw['graph']
+        draw.rectangle((0, 0, self.width, img.size[1]), outline=0, fill=0)
+        if self.graph_on:
+            g_x = (self.width - self.graph.img.size[0])//2
+            img.paste(self.graph.img, (g_x, 0))
+        self.screen.paste(img, (0, self.bands['graph'][0]))
 
-        # Display image.
-        self.show_screen()
-        #time.sleep(self.DISPLAY_ON)
-        #self.disp.fill(0)
-        #self.disp.show()
-        #time.sleep(self.DISPLAY_OFF)
+    # do a quick test, then draw every band, runs on the eventloop alongside the kismet connection
+    async def self_test(self):
+        self.testing = True
+        try:
+            self.draw.rectangle((0, 0, self.width, self.height), outline=1, fill=1)
+            self.show_screen()
+            await asyncio.sleep(.2)
+        finally:
+            self.testing = False
+            for band in self.bands.keys():
+                self.mark_dirty(band)
 
     def clear_screen(self):
         self.draw.rectangle((0, 0, self.width, self.height), outline=0, fill=0)
         self.show_screen()
 
+    # a connected source shows its label inverted, a lost one shows "--", or its
+    # label not inverted when there are several sources
     def ws_state_change(self, event, init):
         if config.debug: print("ws_state_change: {}".format(str(event)))
         new_state = event["state"]
-        draw = ImageDraw.Draw(self.ws_img)
-        (ws_w, ws_h) = self.ws_img.size
+        (ws_img, label) = self.ws_imgs[event["source"]]
+        draw = ImageDraw.Draw(ws_img)
+        (ws_w, ws_h) = ws_img.size
         if new_state == 2:
             draw.rectangle((0, 0, ws_w, ws_h), outline=1, fill=1)
-            draw.text((1,0), "WS", font=self.font, fill=0)
+            draw.text((1,0), label, font=self.font, fill=0)
         else:
             draw.rectangle((0, 0, ws_w, ws_h), outline=0, fill=0)
-            draw.text((0,0), "--", font=self.font, fill=1)
+            draw.text((0,0), "--" if len(self.ws_imgs) == 1 else label, font=self.font, fill=1)
         if not init:
-            self.draw_screen()
+            self.mark_dirty('status')
 
     def gps_state_change(self, event, init):
         if config.debug: print("gps_state_change: {}".format(str(event)))
-        new_state = event["state"]
+        self.gps_states[event["source"]] = event["state"]
+        new_state = max(self.gps_states.values())
         draw = ImageDraw.Draw(self.gps_img)
         (gps_w, gps_h) = self.gps_img.size
         if new_state == 2:
@@ -863,99 +3259,91 @@ class i2c_controller(object):
             else:
                 draw.text((0,0), "--", font=self.font, fill=1)
         if not init:
-            self.draw_screen()
+            self.mark_dirty('status')
 
     def ts_change(self, event, timed):
+        if event['source'] != self.wc.source:
+            return
         if self.jc.status != None:
             uptime = event['ts'] - self.jc.status["kismet.system.timestamp.start_sec"]
         else:
             uptime = -1
+        ut_str = self.ut_str
         self.set_uptime(uptime)
+        if self.ut_str != ut_str:
+            self.mark_dirty('status')
 
         if self.wc.pc_packets_rrd != None:
-            self.set_minute_vec(self.wc.pc_packets_rrd["kismet.common.rrd.minute_vec"],
-                                self.wc.pc_packets_rrd["kismet.common.rrd.last_time"],
-                                self.wc.pc_packets_rrd["kismet.common.rrd.serial_time"])
-        else:
-            self.clear_minute_vec()
-        self.draw_screen()
-
-    def set_minute_vec(self, vec, last_time, serial_time):
-        result_set = [];
-        start_point = last_time % 60;
-        gap = serial_time - last_time
-        for i in range(60):
-            if i < gap:
-                result_set.append(0)
-            else:
-                result_set.append(vec[(start_point + i + 1) % 60])
-        self.min_vec = result_set
-
-    def clear_minute_vec(self):
-        self.min_vec = None
-
-    def graph_vec(self, vec, bar_w, vg_h):
-        vg_w = len(vec) * bar_w
-        vg = Image.new("1", (vg_w, vg_h))
-        draw = ImageDraw.Draw(vg)
-        draw.rectangle((0, 0, vg_w, vg_h), outline=0, fill=0)
-        f = max(vec) / vg_h
-        if f > 0:
-            for i in range(len(vec)):
-                val = vec[len(vec) - (i + 1)]
-                bh = round(val/f)
-                if bh > 0:
-                    draw.rectangle((i*bar_w, vg_h, (i+1)*bar_w-1, vg_h-bh), outline=1, fill=1)
-        return vg
+            changed = self.graph.update(self.wc.pc_packets_rrd["kismet.common.rrd.minute_vec"],
+                                        self.wc.pc_packets_rrd["kismet.common.rrd.last_time"],
+                                        self.wc.pc_packets_rrd["kismet.common.rrd.serial_time"])
+            if changed or not self.graph_on:
+                self.graph_on = True
+                self.mark_dirty('graph')
+        elif self.graph_on:
+            self.graph_on = False
+            self.graph.reset()
+            self.mark_dirty('graph')
 
+    # new messages are queued, the rotation timer shows one per msg_disp_time
     def disp_msg(self, event, timed):
-        print(str(event), " ", str(timed), " ", self.msg[0])
-        if not timed and self.msg[0] == "...":
-            self.msg[0] = event["text"]
-            eventloop.call_later(self.msg_disp_time, self.disp_msg, event, True)
-        elif not timed:
-            if not self.msg_error:
-                self.msg_deque.appendleft(event)
-                return
-            else:
-                if len(self.msg_deque) == 0:
-                    self.msg.insert(1, event["text"])
-                else:
-                    self.msg_deque.appendleft(event)
+        if config.debug: print("disp_msg: {} {}".format(str(event), self.msg[0]))
+        if len(self.wcs) > 1 and 'source' in event.keys():
+            event = dict(event)
+            event['text'] = self.source_text(event['source'], event['text'])
+        self.msgs.push(event)
+        if self.msg_handle == None:
+            self.next_msg()
+
+    def next_msg(self):
+        nxt = self.msgs.pop()
+        if nxt == None:
+            self.msg_handle = None
+            if not self.msg_error and self.msg[0] != "...":
+                self.show_line("...")
         else:
-            if len(self.msg_deque) == 0:
-                if not self.msg_error:
-                    self.msg.insert(0, "...")
-                while len(self.msg) > self.msg_cnt:
-                    self.msg.pop()
-                return
-            else:
-                next = self.msg_deque.pop()
-                while self.wc.timestamp - next["ts"] > self.msg_max_age:
-                    if config.debug: print("Dropping display message that is over max age!")
-                    next = self.msg_deque.pop()
-                if not self.msg_error:
-                    self.msg.insert(0, next["text"])
-                else:
-                    self.msg.insert(1, next["text"])
-                eventloop.call_later(self.msg_disp_time, self.disp_msg, next, True)
-        self.draw_screen()
+            self.show_line(nxt["text"])
+            self.msg_handle = eventloop.call_later(self.msg_disp_time, self.next_msg)
+
+    # put a line at the top of the message area, below the error while one is shown
+    def show_line(self, text):
+        if self.msg_error:
+            self.msg.insert(1, text)
+        elif self.msg[0] == "...":
+            self.msg[0] = text
+        else:
+            self.msg.insert(0, text)
+        del self.msg[max(self.msg_cnt, 2):]
+        self.mark_dirty('msg')
+
+    # prefix text with the source label when there are several sources
+    def source_text(self, source, text):
+        if len(self.wcs) > 1 and source in self.ws_imgs.keys():
+            return self.ws_imgs[source][1] + ": " + text
+        return text
 
     def error_state_change(self, event, timed):
         if config.debug: print("error_state_change: {}".format(str(event)))
         if event["state"] == 0:
+            self.errors.pop(event["source"], None)
+        else:
+            self.errors[event["source"]] = self.source_text(event["source"], event["text"])
+        if len(self.errors) == 0:
             self.msg_error = False
             self.msg[0] = "..."
+            if self.msg_handle == None:
+                self.next_msg()
         else:
+            text = next(iter(self.errors.values()))
             if self.msg_error:
-                self.msg[0] = event["text"]
+                self.msg[0] = text
             else:
                 if self.msg[0] == "...":
-                    self.msg[0] = event["text"]
+                    self.msg[0] = text
                 else:
-                    self.msg.insert(0, event["text"])
+                    self.msg.insert(0, text)
                 self.msg_error = True
-        self.draw_screen()
+        self.mark_dirty('msg')
 
     def set_uptime(self, uptime):
         if uptime >= 0:
@@ -963,31 +3351,1146 @@ class i2c_controller(object):
         else:
             self.ut_str = "Not Connected"
 
-#Look for kismet, start if not running, etc
-def kismet_control():
-    kismet_PID = NULL
-    kismet_PID = find_process("kismet")
-    if kismet_PID:
-        print("Found kismet with PID {}".format)
-        rgb_control(1)
-
-#Find a process PID.
-def find_process(processName):
-    '''
-    Get a list of all the PIDs of a all the running process whose name contains
-    the given string processName
-    '''
-    listOfProcessObjects = []
-    #Iterate over the all the running process
-    for proc in psutil.process_iter():
-       try:
-           pinfo = proc.as_dict(attrs=['pid', 'name', 'create_time'])
-           # Check if process name contains the given name string.
-           if processName.lower() in pinfo['name'].lower() :
-               listOfProcessObjects.append(pinfo)
-       except (psutil.NoSuchProcess, psutil.AccessDenied , psutil.ZombieProcess) :
-           pass
-    return listOfProcessObjects;
+# json merge patch (rfc 7386) turning old into new, None when nothing changed. a key set to
+# None in new is sent as a removal, clients treat a missing key as null
+def merge_patch(old, new):
+    patch = {}
+    for (key, val) in new.items():
+        if not key in old:
+            patch[key] = val
+        elif isinstance(val, dict) and isinstance(old[key], dict):
+            sub = merge_patch(old[key], val)
+            if sub != None:
+                patch[key] = sub
+        elif val != old[key]:
+            patch[key] = val
+    for key in old.keys():
+        if not key in new:
+            patch[key] = None
+    if len(patch) == 0:
+        return None
+    return patch
+
+# page served on / by status_server, applies the deltas from /events to the first full state
+status_page = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
+<title>MobileMonitor</title>
+<style>
+body { background: #000; color: #eee; font: 15px monospace; margin: 8px; }
+span.on { background: #eee; color: #000; } span.warn { color: #fc0; } span.bad { color: #f44; }
+#graph { display: flex; align-items: flex-end; height: 48px; gap: 1px; }
+#graph div { flex: 1; background: #eee; } td { padding-right: 12px; }
+</style></head>
+<body>
+<div><span id="sources"></span> <span id="uptime"></span> <span id="gps"></span></div>
+<div id="error" class="bad"></div>
+<div id="msgs"></div>
+<div id="graph"></div>
+<table id="counters"></table>
+<table id="devices"></table>
+<div id="health"></div>
+<div id="link" class="bad">connecting...</div>
+<script>
+var state = {};
+function merge(into, patch) {
+  for (var key in patch) {
+    if (patch[key] === null) delete into[key];
+    else if (typeof patch[key] == "object" && typeof into[key] == "object") merge(into[key], patch[key]);
+    else into[key] = patch[key];
+  }
+}
+function el(id) { return document.getElementById(id); }
+function esc(text) { return String(text).replace(/[&<>]/g, function (c) { return "&#" + c.charCodeAt(0) + ";"; }); }
+function render() {
+  var html = "";
+  for (var name in state.sources || {}) {
+    var src = state.sources[name];
+    html += '<span class="' + (src.ws == 2 ? "on" : src.ws == 1 ? "warn" : "bad") + '">' + esc(src.label) + "</span> ";
+  }
+  el("sources").innerHTML = html;
+  el("uptime").textContent = state.uptime || "Not Connected";
+  el("gps").innerHTML = '<span class="' + (state.gps == 2 ? "on" : state.gps == 1 ? "warn" : "bad") + '">' + ["--", "2D", "3D"][state.gps || 0] + "</span>";
+  el("error").textContent = state.error || "";
+  var seqs = Object.keys(state.msgs || {}).map(Number).sort(function (a, b) { return b - a; });
+  el("msgs").innerHTML = seqs.map(function (seq) { return "<div>" + esc(state.msgs[seq]) + "</div>"; }).join("") || "...";
+  var times = Object.keys(state.packets || {}).map(Number).sort(function (a, b) { return b - a; });
+  var peak = Math.max.apply(null, times.map(function (t) { return state.packets[t]; }).concat([1]));
+  el("graph").innerHTML = times.map(function (t) { return '<div style="height:' + (100 * state.packets[t] / peak) + '%"></div>'; }).join("");
+  html = "";
+  for (var name in state.counters || {}) {
+    var c = state.counters[name];
+    html += "<tr><td>" + esc(name) + "</td><td>" + c.frames + " frames</td><td>" + c.devices + " devices</td><td>" + c.reconnects + " reconnects</td></tr>";
+  }
+  for (var type in state.alerts || {}) html += "<tr><td>" + esc(type) + "</td><td>" + state.alerts[type] + "</td></tr>";
+  el("counters").innerHTML = html;
+  html = "";
+  for (var name in state.devices || {}) {
+    var d = state.devices[name];
+    html += "<tr><td>" + esc(name) + "</td><td>" + d.ssids + " ssids</td><td>" + ["phy", "type", "crypt"].map(function (key) {
+      return Object.keys(d[key] || {}).filter(function (k) { return d[key][k] > 0; }).map(function (k) { return esc(k) + " " + d[key][k]; }).join(", ");
+    }).join("</td><td>") + "</td></tr>";
+  }
+  el("devices").innerHTML = html;
+  var h = state.health || {};
+  el("health").textContent = state.health ? "cpu " + h.cpu + "% mem " + h.mem + "% disk " + h.disk + "% " + h.temp + "C" + (h.voltage ? " LOW VOLTAGE" : "") : "";
+}
+var source = new EventSource("events");
+source.addEventListener("state", function (e) { state = JSON.parse(e.data); render(); el("link").textContent = ""; });
+source.addEventListener("delta", function (e) { merge(state, JSON.parse(e.data)); render(); });
+source.onerror = function () { el("link").textContent = "reconnecting..."; };
+</script>
+</body></html>
+"""
+
+# broadcasts the state the display shows, plus counters and health, to browsers over
+# server-sent events. GET /events starts with the full state, then sends json merge patches
+# against the last state sent, at most max_rate per second. state is only built while a
+# client is connected, and a client that stops reading is dropped so the browser reconnects
+# and starts over from a full state. GET /state.json is the full state, GET / a status page.
+class status_server(object):
+    def __init__(self, events, jcs, wscs, health=None, max_rate=2, refresh=1, msg_count=8, keepalive=15, buffer_limit=65536):
+        # uptime and the packet graph follow the first kismet source, like the display
+        self.jcs = jcs
+        self.wcs = wscs
+        self.jc = jcs[0]
+        self.wc = wscs[0]
+        self.health = health
+        self.flush_interval = 1 / max_rate
+        self.refresh = refresh
+        self.keepalive = keepalive
+        self.buffer_limit = buffer_limit
+
+        # state from events, kept whether or not anyone is watching
+        self.ws_states = OrderedDict()
+        for wc in self.wcs:
+            self.ws_states[wc.source] = 0
+        self.errors = OrderedDict()
+        self.msgs = deque(maxlen=msg_count)
+        self.msg_seq = 0
+        self.kismet = None
+        self.device_counts = OrderedDict()
+
+        self.server = None
+        self.clients = set()
+        self.sent = None
+        self.seq = 0
+        self.last_flush = 0
+        self.last_write = 0
+        self.flush_handle = None
+        self.refresh_handle = None
+        self.updates = 0
+        self.bytes = 0
+        self.dropped = 0
+
+        events.ws_event["ws_connected"].append(self.ws_state_change)
+        events.ws_event["gps_status"].append(self.state_change)
+        events.ws_event["new_ts"].append(self.state_change)
+        events.ws_event["new_disp_msg"].append(self.disp_msg)
+        events.ws_event["error_state"].append(self.error_state_change)
+        events.ws_event["kismet_state"].append(self.kismet_state_change)
+        events.ws_event["device_counts"].append(self.device_counts_change)
+        events.ws_event["thermal"].append(self.state_change)
+        events.ws_event["voltage"].append(self.state_change)
+
+    async def serve(self, host, port):
+        self.server = await asyncio.start_server(self.handle, host, int(port))
+        return self.server
+
+    def close(self):
+        if self.server != None:
+            self.server.close()
+        for writer in list(self.clients):
+            self.drop(writer)
+        self.stop_timers()
+
+    def ws_state_change(self, event, timed):
+        self.ws_states[event['source']] = event['state']
+        self.mark_dirty()
+
+    def state_change(self, event, timed):
+        self.mark_dirty()
+
+    # messages are kept newest last, keyed by a sequence number so a delta only adds and removes lines
+    def disp_msg(self, event, timed):
+        self.msg_seq += 1
+        self.msgs.append((self.msg_seq, self.source_text(event, event['text'])))
+        self.mark_dirty()
+
+    def error_state_change(self, event, timed):
+        if event['state'] == 0:
+            self.errors.pop(event['source'], None)
+        else:
+            self.errors[event['source']] = self.source_text(event, event['text'])
+        self.mark_dirty()
+
+    def kismet_state_change(self, event, timed):
+        self.kismet = { 'state': event['state'], 'pid': event['pid'], 'text': event['text'] }
+        self.mark_dirty()
+
+    # device sync breakdown per source, replaced whole on every event
+    def device_counts_change(self, event, timed):
+        self.device_counts[event['source']] = { 'devices': event['devices'], 'ssids': event['ssids'],
+                                                'phy': event['phy'], 'type': event['device_type'], 'crypt': event['crypt'] }
+        self.mark_dirty()
+
+    # prefix text with the source label when there are several sources
+    def source_text(self, event, text):
+        if len(self.wcs) > 1 and 'source' in event.keys():
+            for wc in self.wcs:
+                if wc.source == event['source']:
+                    return wc.label + ": " + text
+        return text
+
+    # per second packet counts of the first source keyed by time, oldest slots past serial_time are empty
+    def packets(self):
+        rrd = self.wc.pc_packets_rrd
+        if rrd == None:
+            return {}
+        vec = rrd["kismet.common.rrd.minute_vec"]
+        last_time = rrd["kismet.common.rrd.last_time"]
+        n = len(vec)
+        gap = min(max(rrd["kismet.common.rrd.serial_time"] - last_time, 0), n)
+        packets = {}
+        for i in range(n):
+            t = last_time - n + 1 + i
+            packets[str(t)] = vec[t % n] if i >= gap else 0
+        return packets
+
+    def snapshot(self):
+        sources = OrderedDict()
+        counters = OrderedDict()
+        for (wc, jc) in zip(self.wcs, self.jcs):
+            sources[wc.source] = { 'label': wc.label, 'ws': self.ws_states[wc.source], 'gps': wc.gps_fix, 'ts': wc.timestamp }
+            counters[wc.source] = { 'frames': wc.frames, 'bytes': wc.bytes, 'reconnects': wc.reconnect_count,
+                                    'devices': len(jc.sync.index) if jc.sync != None else None }
+        if self.jc.status != None and self.wc.timestamp >= 0:
+            uptime = str(datetime.timedelta(seconds=self.wc.timestamp - self.jc.status["kismet.system.timestamp.start_sec"]))
+        else:
+            uptime = None
+        state = { 'sources': sources,
+                  'uptime': uptime,
+                  'gps': max([{ 3: 2, 2: 1 }.get(wc.gps_fix, 0) for wc in self.wcs]),
+                  'error': next(iter(self.errors.values())) if len(self.errors) > 0 else None,
+                  'msgs': { str(seq): text for (seq, text) in self.msgs },
+                  'packets': self.packets(),
+                  'counters': counters,
+                  'alerts': merge_counts([wc.alerts.totals for wc in self.wcs]),
+                  'devices': dict(self.device_counts),
+                  'kismet': self.kismet }
+        if self.health != None:
+            state['health'] = dict(self.health.values)
+            state['health']['thermal'] = self.health.thermal
+            state['health']['voltage'] = self.health.voltage
+        return state
+
+    # changes are coalesced into one delta per flush_interval
+    def mark_dirty(self):
+        if self.flush_handle != None or len(self.clients) == 0:
+            return
+        delay = max(0, self.last_flush + self.flush_interval - eventloop.time())
+        self.flush_handle = eventloop.call_later(delay, self.flush)
+
+    def flush(self):
+        self.flush_handle = None
+        self.last_flush = eventloop.time()
+        if len(self.clients) == 0:
+            return
+        state = self.snapshot()
+        patch = merge_patch(self.sent, state)
+        self.sent = state
+        if patch != None:
+            self.seq += 1
+            self.updates += 1
+            self.broadcast("id: {}\nevent: delta\ndata: {}\n\n".format(self.seq, json.dumps(patch, separators=(",", ":"))).encode())
+
+    # counters and health change without events, refresh them while someone is watching
+    def refresh_tick(self):
+        self.mark_dirty()
+        if eventloop.time() - self.last_write >= self.keepalive:
+            self.broadcast(b": keepalive\n\n")
+        self.refresh_handle = eventloop.call_later(self.refresh, self.refresh_tick)
+
+    def stop_timers(self):
+        for handle in (self.flush_handle, self.refresh_handle):
+            if handle != None:
+                handle.cancel()
+        self.flush_handle = None
+        self.refresh_handle = None
+
+    def broadcast(self, data):
+        self.last_write = eventloop.time()
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > self.buffer_limit:
+                if config.debug: print("status_server: dropping a client that stopped reading")
+                self.dropped += 1
+                self.drop(writer)
+            else:
+                writer.write(data)
+                self.bytes += len(data)
+
+    def drop(self, writer):
+        self.clients.discard(writer)
+        writer.close()
+        if len(self.clients) == 0:
+            self.stop_timers()
+            self.sent = None
+
+    def reply(self, writer, status, content_type, body):
+        writer.write(("HTTP/1.1 {}\r\n"
+                      "Content-Type: {}\r\n"
+                      "Content-Length: {}\r\n"
+                      "Cache-Control: no-cache\r\n"
+                      "Connection: close\r\n\r\n").format(status, content_type, len(body)).encode() + body)
+
+    async def handle(self, reader, writer):
+        try:
+            head = (await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)).decode("latin-1")
+            target = head.split(" ")[1] if " " in head else ""
+            path = target.split("?")[0]
+            if path == "/events":
+                await self.stream(reader, writer)
+                return
+            elif path == "/state.json":
+                self.reply(writer, "200 OK", "application/json", json.dumps(self.snapshot()).encode())
+            elif path == "/":
+                self.reply(writer, "200 OK", "text/html; charset=utf-8", status_page.encode())
+            else:
+                self.reply(writer, "404 Not Found", "text/plain", b"")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    # a new client gets the state the others have, the next delta applies to both
+    async def stream(self, reader, writer):
+        if len(self.clients) == 0:
+            self.sent = self.snapshot()
+            self.refresh_handle = eventloop.call_later(self.refresh, self.refresh_tick)
+        self.clients.add(writer)
+        data = "retry: 3000\nid: {}\nevent: state\ndata: {}\n\n".format(self.seq, json.dumps(self.sent, separators=(",", ":"))).encode()
+        writer.write(("HTTP/1.1 200 OK\r\n"
+                      "Content-Type: text/event-stream\r\n"
+                      "Cache-Control: no-cache\r\n"
+                      "Connection: keep-alive\r\n\r\n").encode() + data)
+        self.bytes += len(data)
+        try:
+            # nothing is expected from the client, this returns when it goes away
+            while await reader.read(1024):
+                pass
+        except ConnectionResetError:
+            pass
+        finally:
+            if writer in self.clients:
+                self.drop(writer)
+
+# writes every raw eventbus frame with its arrival time to a gzip compressed jsonl capture,
+# one {"t": seconds since the first write, "frame": raw frame} object per line. device sync
+# replies are written in between as {"t": ..., "devices": reply}
+class frame_recorder(object):
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.file = gzip.open(self.path, "wt", encoding="utf-8")
+        self.start = None
+        self.frames = 0
+        self.device_replies = 0
+
+    def clock(self):
+        now = time.monotonic()
+        if self.start == None:
+            self.start = now
+        return round(now - self.start, 6)
+
+    def write(self, frame):
+        self.file.write(json.dumps({"t": self.clock(), "frame": frame}) + "\n")
+        self.frames += 1
+
+    # device sync replies go in the same capture as {"t": ..., "devices": [...]}
+    def write_devices(self, reply):
+        self.file.write(json.dumps({"t": self.clock(), "devices": reply}) + "\n")
+        self.device_replies += 1
+
+    def close(self):
+        self.file.close()
+        print("Recorded {} eventbus frames and {} device replies to {}".format(self.frames, self.device_replies, self.path))
+
+# capture file as lists of (t, frame) and (t, device reply), a capture cut short by a crash
+# keeps what was written
+def load_capture(path):
+    capture = []
+    devices = []
+    try:
+        with gzip.open(os.path.expanduser(path), "rt", encoding="utf-8") as capture_file:
+            for line in capture_file:
+                if line.strip():
+                    rec = json_loads(line)
+                    if "devices" in rec:
+                        devices.append((rec["t"], rec["devices"]))
+                    else:
+                        capture.append((rec["t"], rec["frame"]))
+    except (EOFError, ValueError) as err:
+        print("Capture {} is truncated after {} frames: {}".format(path, len(capture), err))
+    return (capture, devices)
+
+# stand-in kismet httpd replaying a capture over /eventbus/events.ws at speed times real
+# time (0 for as fast as possible), with just enough of the rest api for json_connector.
+# stall is an optional (at, seconds, mode) pause of the replay at capture time at, mode
+# "freeze" keeps answering pings like a wedged kismet, "drop" also stops reading like a
+# half-open connection. a reconnecting client continues from where the last one stopped.
+# recorded device sync replies are merged as the replay passes them and served by
+# /devices/last-time/, so a client polling it sees the devices kismet had at that point.
+class fake_kismet(object):
+    def __init__(self, capture, speed=1.0, stall=None, devices=None):
+        self.capture = capture
+        self.speed = speed
+        self.stall = stall
+        self.device_log = devices if devices != None else []
+        self.device_pos = 0
+        self.devices = {}
+        self.device_requests = 0
+        self.server = None
+        self.active = None
+        self.position = 0
+        self.sent = 0
+        self.start_time = None
+        self.end_time = None
+        # resolves when a replay has sent its last frame
+        self.done = eventloop.create_future()
+
+        self.start_sec = 0
+        for (t, frame) in capture:
+            if frame.startswith('{"TIMESTAMP"'):
+                self.start_sec = json_field(frame, 'kismet.system.timestamp.sec')[0]
+                break
+
+    # returns the port listened on, port 0 picks a free one
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self.handle, host, int(port))
+        return self.server.sockets[0].getsockname()[1]
+
+    def close(self):
+        if self.server != None:
+            self.server.close()
+
+    def status(self):
+        return { "kismet.system.timestamp.start_sec": self.start_sec,
+                 "kismet.system.timestamp.sec": int(time.time()),
+                 "kismet.system.devices.count": len(self.seen_devices()) }
+
+    # devices recorded up to the replay position, the newest record of each
+    def seen_devices(self):
+        now = self.capture[self.position - 1][0] if self.position > 0 else 0
+        while self.device_pos < len(self.device_log) and self.device_log[self.device_pos][0] <= now:
+            for dev in self.device_log[self.device_pos][1]:
+                self.devices[dev["kismet.device.base.macaddr"]] = dev
+            self.device_pos += 1
+        return self.devices
+
+    # devices changed after the timestamp in /devices/last-time/<ts>/devices.json. a negative
+    # ts is relative to the newest device time, the capture's stand-in for kismet's clock
+    def devices_since(self, path):
+        self.device_requests += 1
+        since = float(path.split("/")[3])
+        if since < 0:
+            since += max([dev["kismet.device.base.last_time"] for dev in self.seen_devices().values()], default=0)
+        return [dev for dev in self.seen_devices().values() if dev["kismet.device.base.last_time"] > since]
+
+    def reply(self, writer, status, reason, body):
+        body = body.encode()
+        writer.write(("HTTP/1.1 {} {}\r\n"
+                      "Content-Type: application/json\r\n"
+                      "Content-Length: {}\r\n\r\n").format(status, reason, len(body)).encode() + body)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+                (method, target) = head[0].split(" ")[:2]
+                headers = {}
+                for line in head[1:]:
+                    if ":" in line:
+                        (name, value) = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                if "content-length" in headers:
+                    await reader.readexactly(int(headers["content-length"]))
+                path = target.split("?")[0]
+                if path == "/eventbus/events.ws":
+                    await self.serve_eventbus(reader, writer, headers)
+                    return
+                elif path == "/system/status.json":
+                    self.reply(writer, 200, "OK", json.dumps(self.status()))
+                elif path.startswith("/devices/last-time/"):
+                    self.reply(writer, 200, "OK", json.dumps(self.devices_since(path)))
+                else:
+                    self.reply(writer, 404, "Not Found", "")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_eventbus(self, reader, writer, headers):
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                      "Upgrade: websocket\r\n"
+                      "Connection: Upgrade\r\n"
+                      "Sec-WebSocket-Accept: {}\r\n\r\n").format(accept).encode())
+        ws = ws_stream(reader, writer, mask=False)
+        # the capture only holds subscribed topics, replay starts once the client subscribes
+        subscribed = eventloop.create_future()
+        async def read_client():
+            while True:
+                msg = await ws.recv()
+                if msg == None:
+                    break
+                if "SUBSCRIBE" in msg and not subscribed.done():
+                    subscribed.set_result(True)
+        client = eventloop.create_task(read_client())
+        try:
+            await asyncio.wait([client, subscribed], return_when=asyncio.FIRST_COMPLETED)
+            if not subscribed.done():
+                return
+            await self.replay(ws, writer, client)
+            # keep the connection open so the client does not reconnect and replay again
+            await client
+        finally:
+            client.cancel()
+            ws.close()
+
+    async def replay(self, ws, writer, client):
+        # the newest connection takes over the replay
+        self.active = ws
+        transport = writer.transport
+        if self.start_time == None:
+            self.start_time = time.monotonic()
+        start = None
+        while self.position < len(self.capture) and self.active is ws and not client.done():
+            (t, frame) = self.capture[self.position]
+            if self.stall != None and t >= self.stall[0]:
+                await self.stall_replay(transport)
+                start = None
+                continue
+            if self.speed > 0:
+                if start == None:
+                    start = eventloop.time() - t / self.speed
+                delay = start + t / self.speed - eventloop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+            ws.send(frame)
+            self.position += 1
+            self.sent += 1
+            if transport.get_write_buffer_size() > 65536:
+                await writer.drain()
+            elif self.speed <= 0 and self.sent % 64 == 0:
+                # the client shares this eventloop, let it read
+                await asyncio.sleep(0)
+        if self.position < len(self.capture):
+            return
+        await writer.drain()
+        self.end_time = time.monotonic()
+        if not self.done.done():
+            self.done.set_result(self.sent)
+
+    async def stall_replay(self, transport):
+        (at, seconds, mode) = self.stall
+        self.stall = None
+        print("Fake kismet stalling for {}s ({})".format(seconds, mode))
+        if mode == "drop":
+            transport.pause_reading()
+        await asyncio.sleep(seconds)
+        if mode == "drop":
+            transport.resume_reading()
+
+# waits for the replays to finish and the clients to catch up, prints throughput and latency.
+# fakes[i] is served to wscs[i] and jcs[i]
+async def replay_report(fakes, wscs, jcs):
+    emitted = events.emitted
+    await asyncio.gather(*[fake.done for fake in fakes])
+    deadline = time.monotonic() + 10
+    while sum([wsc.frames for wsc in wscs]) < sum([fake.sent for fake in fakes]) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    end = time.monotonic()
+    elapsed = max(end - min([fake.start_time for fake in fakes]), 1e-9)
+    emitted = events.emitted - emitted
+    frames = sum([wsc.frames for wsc in wscs])
+    print("Replayed {} of {} frames in {:.2f}s at speed {}".format(frames, sum([fake.sent for fake in fakes]), elapsed, fakes[0].speed if fakes[0].speed > 0 else "max"))
+    if len(fakes) > 1:
+        for (fake, wsc) in zip(fakes, wscs):
+            print("{:<24} {:>12}".format("frames from " + wsc.source, "{} of {}".format(wsc.frames, fake.sent)))
+    print("{:<24} {:>12.0f}".format("frames/sec", frames / elapsed))
+    print("{:<24} {:>12.0f}".format("events/sec", emitted / elapsed))
+    for (fake, jc) in zip(fakes, jcs):
+        if jc.sync != None and len(fake.device_log) > 0:
+            label = "" if len(fakes) == 1 else " " + jc.source
+            print("{:<24} {:>12}".format("devices" + label, "{} of {}".format(len(jc.sync.index), len(fake.seen_devices()))))
+            print("{:<24} {:>12}".format("device polls" + label, "{} of {}".format(jc.sync.polls, fake.device_requests)))
+            print("{:<24} {:>12}".format("devices merged" + label, jc.sync.changed_total))
+            print("{:<24} {:>12}".format("devices evicted" + label, jc.sync.index.evicted))
+            print("{:<24} {:>10.1f} s".format("device poll interval" + label, jc.sync.interval))
+    latency = sorted(events.frame_latency)
+    if len(latency) > 0:
+        def pct(p):
+            return latency[min(len(latency) - 1, int(len(latency) * p / 100))] * 1000
+        print("{:<24} {:>12}".format("display frames", len(latency)))
+        print("{:<24} {:>9.1f} ms".format("event to frame p50", pct(50)))
+        print("{:<24} {:>9.1f} ms".format("event to frame p95", pct(95)))
+        print("{:<24} {:>9.1f} ms".format("event to frame max", latency[-1] * 1000))
+    else:
+        print("No display frames, event to frame latency needs an i2c display.")
+    eventloop.stop()
+
+# benchmarks, run with --benchmark NAME. config, eventloop and events are set up, nothing else is.
+
+# call fn on each item in turn for about duration seconds, returns calls per second
+def bench_rate(fn, items, duration=1.0):
+    cnt = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < duration:
+        for item in items:
+            fn(item)
+        cnt += len(items)
+        elapsed = time.perf_counter() - start
+    return cnt / elapsed
+
+# eventbus frames shaped like a kismet capture, used when no --bench-frames file is given
+def sample_eventbus_frames():
+    def rrd(seed):
+        return { "kismet.common.rrd.last_time": 1690000000,
+                 "kismet.common.rrd.serial_time": 1690000000,
+                 "kismet.common.rrd.minute_vec": [(seed * 31 + i * 17) % 400 for i in range(60)],
+                 "kismet.common.rrd.hour_vec": [(seed * 131 + i * 977) % 24000 for i in range(60)],
+                 "kismet.common.rrd.day_vec": [(seed * 1031 + i * 52711) % 576000 for i in range(24)],
+                 "kismet.common.rrd.blank_val": 0,
+                 "kismet.common.rrd.aggregator": "accumulator" }
+    frames = {}
+    frames["TIMESTAMP"] = [json.dumps({"TIMESTAMP": { "kismet.system.timestamp.sec": 1690000000 + i,
+                                                      "kismet.system.timestamp.usec": (i * 7919) % 1000000 }}) for i in range(10)]
+    frames["GPS_LOCATION"] = [json.dumps({"GPS_LOCATION": { "kismet.common.location.lat": 45.52 + i / 10000,
+                                                            "kismet.common.location.lon": -122.67 - i / 10000,
+                                                            "kismet.common.location.alt": 15.2,
+                                                            "kismet.common.location.speed": 18.5,
+                                                            "kismet.common.location.heading": 271.3,
+                                                            "kismet.common.location.fix": 3,
+                                                            "kismet.common.location.valid": 1,
+                                                            "kismet.common.location.time_sec": 1690000000 + i,
+                                                            "kismet.common.location.time_usec": 0 }}) for i in range(10)]
+    msgs = [ "Detected new 802.11 Wi-Fi access point 0A:1B:2C:3D:4E:{:02X}",
+             "Detected new 802.11 Wi-Fi device 6C:1B:2C:3D:4E:{:02X}",
+             "802.11 Wi-Fi device 0A:1B:2C:3D:4E:{:02X} advertised SSID 'CoffeeShop Guest'",
+             "Detected new Bluetooth device 44:55:66:77:88:{:02X}",
+             "Saved Kismet log file" ]
+    frames["MESSAGE"] = [json.dumps({"MESSAGE": { "kismet.messagebus.message_string": msgs[i % len(msgs)].format(i),
+                                                  "kismet.messagebus.message_flags": 2,
+                                                  "kismet.messagebus.message_time": 1690000000 + i }}) for i in range(10)]
+    pc_names = ("packets", "peak_packets", "dropped_packets", "processed_packets", "dupe_packets", "error_packets", "queued_packets")
+    frames["PACKETCHAIN_STATS"] = [json.dumps({"PACKETCHAIN_STATS": dict(("kismet.packetchain.{}_rrd".format(n), rrd(i + j)) for (j, n) in enumerate(pc_names))}) for i in range(10)]
+    return frames
+
+# recorded frames grouped by topic, from a --record capture or a file of one raw frame per line
+def load_bench_frames(path):
+    frames = {}
+    with open(os.path.expanduser(path), "rb") as frame_file:
+        is_capture = frame_file.read(2) == b"\x1f\x8b"
+    if is_capture:
+        lines = [frame for (t, frame) in load_capture(path)[0]]
+    else:
+        with open(os.path.expanduser(path), "r") as frame_file:
+            lines = [line.strip() for line in frame_file]
+    for line in lines:
+        if line.startswith('{"'):
+            frames.setdefault(line[2:line.find('"', 2)], []).append(line)
+    return frames
+
+# per topic cost of getting the fields its handler reads, json_field on the raw frame against
+# a full decode of the same frame. handlers themselves are not run
+def bench_parse():
+    if config.bench_frames != None:
+        frames = load_bench_frames(config.bench_frames)
+    else:
+        frames = sample_eventbus_frames()
+    wsc = ws_connector("localhost", 2501, "", "", reconnect=False)
+    fields = { 'TIMESTAMP': wsc.ts_fields,
+               'MESSAGE': wsc.msg_fields,
+               'GPS_LOCATION': wsc.gps_fields,
+               'PACKETCHAIN_STATS': wsc.pc_fields }
+    print("json backend for full decodes: {}".format(getattr(json_loads, "__module__", None) or json_loads.__name__))
+    print("{:<20} {:>8} {:>8} {:>16} {:>16} {:>8} {:>6}".format("topic", "frames", "bytes", "full decode/s", "json_field/s", "speedup", "used"))
+    for topic in sorted(frames.keys()):
+        topic_frames = frames[topic]
+        avg_len = sum(len(f) for f in topic_frames) // len(topic_frames)
+        if topic in fields:
+            full = bench_rate(lambda frame: full_fields(topic, frame), topic_frames)
+            fast = bench_rate(fields[topic], topic_frames)
+            used = "full" if topic in full_decode_topics else "field"
+            print("{:<20} {:>8} {:>8} {:>16.0f} {:>16.0f} {:>7.1f}x {:>6}".format(topic, len(topic_frames), avg_len, full, fast, fast / full, used))
+        else:
+            full = bench_rate(json_loads, topic_frames)
+            print("{:<20} {:>8} {:>8} {:>16.0f} {:>16} {:>8} {:>6}".format(topic, len(topic_frames), avg_len, full, "-", "-", "full"))
+
+# parse_msg before the rule table, substring checks where later matches overwrite earlier ones
+def legacy_classify(msg_str):
+    io_ev = None
+    if "SSID" in msg_str:
+        io_ev = "new_ssid"
+    if "new 802.11 Wi-Fi access point" in msg_str:
+        io_ev = "new_ap"
+    if "new 802.11 Wi-Fi device" in msg_str:
+        io_ev = "new_device"
+    return io_ev
+
+# the whole rule table the straightforward way, one regex search per rule in table order
+def search_classifier(rules):
+    patterns = [(re.compile(rule['pattern']), rule) for rule in rules]
+    def classify(msg_str):
+        io_ev = None
+        crypt = None
+        for (pattern, rule) in patterns:
+            if pattern.search(msg_str):
+                if io_ev == None and 'event' in rule.keys():
+                    io_ev = rule['event']
+                if crypt == None and 'crypt' in rule.keys():
+                    crypt = rule['crypt']
+        return (io_ev, crypt)
+    return classify
+
+# message strings from recorded frames, or the built-in samples plus alert and crypt variants
+def sample_message_strings():
+    if config.bench_frames != None:
+        frames = load_bench_frames(config.bench_frames).get("MESSAGE", [])
+    else:
+        frames = sample_eventbus_frames()["MESSAGE"]
+    msgs = [json_loads(frame)["MESSAGE"]["kismet.messagebus.message_string"] for frame in frames]
+    if config.bench_frames == None:
+        msgs += [ "ALERT: APSPOOF Unauthorized device advertising SSID 'CorpNet'",
+                  "Detected new 802.11 Wi-Fi access point 0A:1B:2C:3D:4E:77 SSID 'Airport' WPA3-SAE",
+                  "802.11 Wi-Fi device 0A:1B:2C:3D:4E:78 advertised SSID 'Lobby' (Open)",
+                  "802.11 Wi-Fi device 0A:1B:2C:3D:4E:79 advertised SSID 'Printer' WEP",
+                  "Detected new BTLE device 44:55:66:77:88:AA" ]
+    return msgs
+
+def bench_classify():
+    msgs = sample_message_strings()
+    if len(msgs) == 0:
+        print("No MESSAGE frames to classify.")
+        return
+    classifier = message_classifier(config.message_rules)
+    print("{:<24} {:>12} {:>8}".format("classifier", "msg/s", "speedup"))
+    base = bench_rate(legacy_classify, msgs)
+    print("{:<24} {:>12.0f} {:>8}".format("substring checks", base, "1.0x"))
+    rate = bench_rate(search_classifier(config.message_rules), msgs)
+    print("{:<24} {:>12.0f} {:>7.2f}x".format("search per rule", rate, rate / base))
+    rate = bench_rate(classifier.classify, msgs)
+    print("{:<24} {:>12.0f} {:>7.2f}x".format("combined regex", rate, rate / base))
+    print()
+    for msg in msgs[:16]:
+        hit = classifier.classify(msg)
+        label = "-" if hit == None else hit[0]['event'] + "".join(" {}={}".format(k, v) for (k, v) in hit[1].items())
+        print("{:<28} {:<16} {}".format(label, str(legacy_classify(msg)), msg[:60]))
+
+# the graph path before sparkline, rebuilt the vector and the bitmap on every tick
+def legacy_minute_vec(vec, last_time, serial_time):
+    result_set = [];
+    start_point = last_time % 60;
+    gap = serial_time - last_time
+    for i in range(60):
+        if i < gap:
+            result_set.append(0)
+        else:
+            result_set.append(vec[(start_point + i + 1) % 60])
+    return result_set
+
+def legacy_graph_vec(vec, bar_w, vg_h):
+    vg_w = len(vec) * bar_w
+    vg = Image.new("1", (vg_w, vg_h))
+    draw = ImageDraw.Draw(vg)
+    draw.rectangle((0, 0, vg_w, vg_h), outline=0, fill=0)
+    f = max(vec) / vg_h
+    if f > 0:
+        for i in range(len(vec)):
+            val = vec[len(vec) - (i + 1)]
+            bh = round(val/f)
+            if bh > 0:
+                draw.rectangle((i*bar_w, vg_h-bh, (i+1)*bar_w-1, vg_h), outline=1, fill=1)
+    return vg
+
+# a minute rrd as kismet updates it, one new slot per second with an occasional idle gap
+def sample_rrd_ticks(count):
+    rng = random.Random(2501)
+    vec = [rng.randint(0, 400) for i in range(60)]
+    ticks = []
+    last_time = 1690000000
+    for i in range(count):
+        serial_time = last_time + 1
+        if rng.random() > 0.1:
+            last_time += 1
+            vec[last_time % 60] = rng.randint(0, 400) if rng.random() > 0.02 else rng.randint(400, 900)
+        ticks.append((list(vec), last_time, serial_time))
+    return ticks
+
+# per tick cost of the packet rate graph, rebuild versus incremental sparkline
+def bench_sparkline():
+    global Image, ImageDraw
+    from PIL import Image, ImageDraw
+    ticks = sample_rrd_ticks(600)
+    modes = [("sparkline", False)]
+    if load_numpy() != None:
+        modes.append(("sparkline+numpy", True))
+    print("{:<8} {:<16} {:>12} {:>8}".format("width", "path", "us/tick", "speedup"))
+    for (width, height) in ((128, 32), (256, 64)):
+        bar_w = width // 60
+        g_height = round((height // 2)*.8)
+        band = Image.new("1", (width, g_height))
+        g_x = (width - bar_w * 60) // 2
+
+        def rebuild(tick):
+            band.paste(legacy_graph_vec(legacy_minute_vec(*tick), bar_w, g_height), (g_x, 0))
+        start = time.perf_counter()
+        for tick in ticks:
+            rebuild(tick)
+        base = (time.perf_counter() - start) / len(ticks)
+        print("{:<8} {:<16} {:>12.1f} {:>8}".format(width, "rebuild", base * 1e6, "1.0x"))
+
+        for (name, use_numpy) in modes:
+            graph = sparkline(60, bar_w, g_height, use_numpy)
+            # check against the rebuild path before timing
+            for tick in ticks[:120]:
+                graph.update(*tick)
+                if graph.img.tobytes() != legacy_graph_vec(legacy_minute_vec(*tick), bar_w, g_height).tobytes():
+                    print("{}: bitmap mismatch with rebuild path at last_time {}".format(name, tick[1]))
+                    break
+            graph.reset()
+            start = time.perf_counter()
+            for tick in ticks:
+                if graph.update(*tick):
+                    band.paste(graph.img, (g_x, 0))
+            cost = (time.perf_counter() - start) / len(ticks)
+            print("{:<8} {:<16} {:>12.1f} {:>7.1f}x".format(width, name, cost * 1e6, base / cost))
+
+# resident set size of this process in bytes
+def bench_rss():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# simplified device records like the ones device_sync receives
+def sample_devices(count, seed=0):
+    phys = ("IEEE802.11", "IEEE802.11", "IEEE802.11", "Bluetooth", "BTLE", "RTL433")
+    kinds = ("Wi-Fi AP", "Wi-Fi Client", "Wi-Fi Device", "BR/EDR", "BTLE", "Sensor")
+    crypts = ("Open", "WEP", "WPA2-PSK", "WPA2-PSK AES-CCMP", "WPA3-SAE", "WPA2-EAP")
+    rnd = random.Random(seed)
+    devs = []
+    for i in range(count):
+        kind = rnd.randrange(len(kinds))
+        mac = rnd.getrandbits(48)
+        devs.append({ "kismet.device.base.macaddr": ":".join("{:02X}".format((mac >> s) & 0xff) for s in range(40, -8, -8)),
+                      "kismet.device.base.phyname": phys[kind],
+                      "kismet.device.base.type": kinds[kind],
+                      "kismet.device.base.crypt": crypts[rnd.randrange(len(crypts))] if kind == 0 else "",
+                      "kismet.device.base.last_time": 1690000000 + i // 50,
+                      "dot11.ssid": "net-{}".format(rnd.randrange(count // 4)) if kind == 0 else 0 })
+    return devs
+
+def bench_devices():
+    count = 120000
+    devs = sample_devices(count)
+    args = [(dev["kismet.device.base.macaddr"], dev["kismet.device.base.phyname"], dev["kismet.device.base.type"],
+             dev["kismet.device.base.crypt"], dev["dot11.ssid"] or None, dev["kismet.device.base.last_time"])
+            for dev in devs]
+    touched = [arg[:5] + (arg[5] + 60,) for arg in args[::7]]
+    print("{:<24} {:>10} {:>12} {:>12}".format("store", "devices", "MB rss", "bytes/dev"))
+
+    # keeping the decoded json of every device, what a naive sync would hold on to
+    base = bench_rss()
+    legacy = {}
+    for dev in json_loads(json.dumps(devs)):
+        legacy[dev["kismet.device.base.macaddr"]] = dev
+    used = bench_rss() - base
+    print("{:<24} {:>10} {:>12.1f} {:>12.0f}".format("dict of device json", len(legacy), used / 2**20, used / len(legacy)))
+    del legacy
+
+    base = bench_rss()
+    index = device_index(count)
+    start = time.perf_counter()
+    for arg in args:
+        index.update(*arg)
+    insert_cost = time.perf_counter() - start
+    used = bench_rss() - base
+    print("{:<24} {:>10} {:>12.1f} {:>12.0f}".format("device_index", len(index), used / 2**20, used / len(index)))
+
+    start = time.perf_counter()
+    for arg in touched:
+        index.update(*arg)
+    update_cost = time.perf_counter() - start
+
+    capped = device_index(count // 4)
+    start = time.perf_counter()
+    for arg in args:
+        capped.update(*arg)
+    evict_cost = time.perf_counter() - start
+
+    # counters must match a full recount
+    crypts = {}
+    for mac in index.slots:
+        record = index.get(mac)
+        crypts[record[3]] = crypts.get(record[3], 0) + 1
+    if crypts != { name: cnt for (name, cnt) in index.crypt_counts().items() if cnt > 0 }:
+        print("device_index: crypt counters do not match a recount")
+
+    print()
+    print("{:<24} {:>12}".format("operation", "devices/s"))
+    print("{:<24} {:>12.0f}".format("insert", len(args) / insert_cost))
+    print("{:<24} {:>12.0f}".format("update", len(touched) / update_cost))
+    print("{:<24} {:>12.0f}".format("insert, evicting", len(args) / evict_cost))
+    print()
+    print("phy:   ", index.phy_counts())
+    print("type:  ", index.type_counts())
+    print("crypt: ", index.crypt_counts())
+    print("ssids: ", index.ssid_count(), " evicted at cap {}: {}".format(capped.limit, capped.evicted))
+
+benchmarks = { 'parse': bench_parse,
+               'sparkline': bench_sparkline,
+               'devices': bench_devices,
+               'classify': bench_classify }
+
+# keeps kismet running. the pid is looked up once from a pidfile or the comm names in /proc,
+# then its exit is noticed through a pidfd, or the child wait for a kismet started here.
+# with manage set a missing kismet is started and restarted with backoff, otherwise it is
+# only watched. kismet_state events:
+#   0 - not running
+#   1 - starting
+#   2 - running
+#   3 - failed to start or exited within stable seconds
+class kismet_supervisor(object):
+    def __init__(self, command, name="kismet", pidfile=None, manage=True, backoff=(1, 60), stop_timeout=10, stable=60):
+        self.command = command
+        # comm names are truncated to 15 characters
+        self.name = name[:15]
+        self.pidfile = pidfile
+        self.manage = manage
+        self.backoff = backoff
+        self.delay = backoff[0]
+        self.stop_timeout = stop_timeout
+        self.stable = stable
+
+        self.pid = None
+        self.proc = None
+        self.state = None
+        self.task = None
+        self.supervise = False
+        self.starts = 0
+        self.exits = 0
+
+    # comm name of pid, None once it has exited
+    @staticmethod
+    def comm(pid):
+        try:
+            with open("/proc/{}/comm".format(pid), "rb") as comm_file:
+                return comm_file.read().rstrip(b"\n").decode(errors="replace")
+        except OSError:
+            return None
+
+    def find_pid(self):
+        if self.pidfile:
+            try:
+                with open(self.pidfile) as pid_file:
+                    pid = int(pid_file.read().strip())
+                if self.comm(pid) == self.name:
+                    return pid
+            except (OSError, ValueError):
+                pass
+        own = os.getpid()
+        for entry in os.scandir("/proc"):
+            if entry.name.isdigit() and int(entry.name) != own and self.comm(entry.name) == self.name:
+                return int(entry.name)
+        return None
+
+    def set_state(self, state, text):
+        print(text)
+        if state != self.state:
+            self.state = state
+            events.wsc_new({'type': "kismet_state", 'state': state, 'pid': self.pid, 'text': text})
+
+    # wait for a kismet not started here to exit
+    async def wait_pid(self, pid):
+        try:
+            fd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            fd = None
+        if fd == None:
+            # without pidfd support the pid is checked once a second
+            while self.comm(pid) == self.name:
+                await asyncio.sleep(1)
+            return
+        exited = eventloop.create_future()
+        def readable():
+            eventloop.remove_reader(fd)
+            if not exited.done():
+                exited.set_result(None)
+        eventloop.add_reader(fd, readable)
+        try:
+            await exited
+        finally:
+            eventloop.remove_reader(fd)
+            os.close(fd)
+
+    async def run(self):
+        while self.supervise:
+            started = eventloop.time()
+            ran = False
+            code = None
+            pid = self.find_pid()
+            if pid != None:
+                self.pid = pid
+                self.set_state(2, "Found kismet with PID {}".format(pid))
+                await self.wait_pid(pid)
+                ran = True
+            elif self.manage:
+                self.set_state(1, "Starting kismet: {}".format(" ".join(self.command)))
+                try:
+                    self.proc = await asyncio.create_subprocess_exec(*self.command, stdin=asyncio.subprocess.DEVNULL,
+                                                                     stdout=asyncio.subprocess.DEVNULL,
+                                                                     stderr=asyncio.subprocess.DEVNULL,
+                                                                     start_new_session=True)
+                except OSError as err:
+                    self.set_state(3, "Failed to start kismet: {}".format(err))
+                else:
+                    self.pid = self.proc.pid
+                    self.starts += 1
+                    self.set_state(2, "Started kismet with PID {}".format(self.pid))
+                    code = await self.proc.wait()
+                    self.proc = None
+                    ran = True
+            else:
+                self.set_state(0, "Kismet is not running")
+            if ran:
+                self.exits += 1
+                self.pid = None
+                if eventloop.time() - started >= self.stable:
+                    # a kismet that stayed up restarts quickly again
+                    self.delay = self.backoff[0]
+                    self.set_state(0, "Kismet exited" + (" with code {}".format(code) if code != None else ""))
+                else:
+                    self.set_state(3, "Kismet exited after {:.0f}s".format(eventloop.time() - started)
+                                   + (" with code {}".format(code) if code != None else ""))
+            if not self.supervise:
+                break
+            if self.manage:
+                print("Looking for kismet again in {}s".format(self.delay))
+            await asyncio.sleep(self.delay)
+            self.delay = min(self.delay * 2, self.backoff[1])
+
+    def start(self):
+        self.supervise = True
+        if self.task == None or self.task.done():
+            self.task = eventloop.create_task(self.run())
+
+    # stop supervising, leaving kismet running
+    def close(self):
+        self.supervise = False
+        if self.task != None:
+            self.task.cancel()
+            self.task = None
+
+    # stop supervising and stop kismet, SIGTERM then SIGKILL after timeout, stop_timeout by default
+    async def stop(self, timeout=None):
+        self.close()
+        if timeout == None:
+            timeout = self.stop_timeout
+        pid = self.pid
+        if pid == None:
+            return
+        try:
+            if self.proc != None:
+                # a kismet started here leads its own session, its capture helpers go with it
+                os.killpg(pid, signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(self.proc.wait(), timeout)
+                except asyncio.TimeoutError:
+                    os.killpg(pid, signal.SIGKILL)
+                    await self.proc.wait()
+            else:
+                os.kill(pid, signal.SIGTERM)
+                waited = 0
+                while self.comm(pid) == self.name and waited < timeout:
+                    await asyncio.sleep(.1)
+                    waited += .1
+                if self.comm(pid) == self.name:
+                    os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        except PermissionError as err:
+            print(err)
+            print("Not allowed to stop kismet with PID {}".format(pid))
+            return
+        self.pid = None
+        self.proc = None
+        self.set_state(0, "Stopped kismet")
+
+    # stop kismet and supervise again without the backoff. a kismet that was only watched
+    # is not started again
+    async def restart(self, timeout=None):
+        await self.stop(timeout)
+        self.delay = self.backoff[0]
+        self.start()
+
+# runs kismet_supervisor against dummy children instead of kismet: a child that exits is
+# started again after the backoff, restart() replaces a running child, and a child that
+# ignores SIGTERM is killed once the stop timeout runs out. True when all pass
+async def supervisor_self_test():
+    name = "mm-dummy-kismet"
+    states = []
+    events.ws_event['kismet_state'].append(lambda event, timed: states.append(event['state']))
+    results = []
+
+    async def wait_until(check, timeout=5):
+        waited = 0
+        while not check() and waited < timeout:
+            await asyncio.sleep(.05)
+            waited += .05
+        return check()
+
+    def result(test, ok, text):
+        results.append(ok)
+        print("{:<24} {:<6} {}".format(test, "ok" if ok else "FAILED", text))
+
+    # exits within stable seconds, reported as failed and started again
+    sup = kismet_supervisor(["sh", "-c", "sleep .2; exit 3"], name=name, backoff=(.2, .4), stable=60)
+    sup.start()
+    ok = await wait_until(lambda: sup.starts >= 2)
+    await sup.stop()
+    result("exit", ok and sup.exits >= 1 and 3 in states,
+           "{} starts, {} exits".format(sup.starts, sup.exits))
+
+    # restart() stops the running child and starts a new one
+    sup = kismet_supervisor(["sleep", "30"], name=name, backoff=(.2, .4), stop_timeout=2)
+    sup.start()
+    await wait_until(lambda: sup.pid != None)
+    old = sup.pid
+    await sup.restart()
+    ok = await wait_until(lambda: sup.pid != None and sup.pid != old)
+    result("restart", ok and old != None and kismet_supervisor.comm(old) == None and sup.starts == 2,
+           "PID {} replaced by {}".format(old, sup.pid))
+    await sup.stop()
+
+    # ignores SIGTERM, killed after the timeout
+    sup = kismet_supervisor(["sh", "-c", "trap '' TERM; while :; do sleep .1; done"], name=name, stop_timeout=.5)
+    sup.start()
+    await wait_until(lambda: sup.proc != None)
+    # give the shell time to set its trap
+    await asyncio.sleep(.3)
+    proc = sup.proc
+    began = eventloop.time()
+    await sup.stop()
+    took = eventloop.time() - began
+    result("kill on timeout", proc != None and proc.returncode == -signal.SIGKILL and took >= .5,
+           "exit status {} after {:.1f}s".format(proc.returncode if proc != None else None, took))
+
+    return all(results)
 
 if __name__ == "__main__":
     # load config
@@ -996,33 +4499,118 @@ if __name__ == "__main__":
     # set event loop for main thread and event controller to handler listeners
     eventloop = asyncio.get_event_loop()
     events = event_control()
+
+    # trace callbacks from here on, dump on SIGUSR1 and at exit
+    if config.trace['file'] != None:
+        tracer = callback_tracer(config.trace['file'],
+                                 config.trace['buffer_size'] if 'buffer_size' in config.trace.keys() else 100000,
+                                 (config.trace['slow_ms'] if 'slow_ms' in config.trace.keys() else 20) / 1000)
+        tracer.install(eventloop)
+        try:
+            eventloop.add_signal_handler(signal.SIGUSR1, tracer.dump)
+        except (NotImplementedError, AttributeError):
+            print("tracer: SIGUSR1 is not available, the trace is only written at exit")
+
+    # micro-benchmarks run without hardware or network
+    if config.benchmark != None:
+        benchmarks[config.benchmark]()
+        sys.exit(0)
+
+    # supervisor self test with dummy children in place of kismet
+    if config.supervisor_test:
+        sys.exit(0 if eventloop.run_until_complete(supervisor_self_test()) else 1)
+
+    # fake kismets replaying captures stand in for the kismet sources, alone or in this process.
+    # only the first replay stalls so the other sources keep going
+    fakes = []
+    if config.fake_kismet != None:
+        for capture in config.fake_kismet:
+            (frames, devices) = load_capture(capture)
+            fakes.append(fake_kismet(frames, config.replay_speed,
+                                     config.replay_stall if len(fakes) == 0 else None, devices))
+        if config.fake_kismet_serve:
+            # the first capture on the configured port, the others on the ports after it
+            for (i, fake) in enumerate(fakes):
+                port = eventloop.run_until_complete(fake.start(config.address, int(config.port) + i))
+                print("Fake kismet replaying {} on {}:{}".format(config.fake_kismet[i], config.address, port))
+            try:
+                eventloop.run_forever()
+            except KeyboardInterrupt:
+                for fake in fakes:
+                    fake.close()
+            sys.exit(0)
+        sources = []
+        for (i, fake) in enumerate(fakes):
+            source = dict(config.sources[0])
+            if len(fakes) > 1:
+                source['name'] = "fake{}".format(i + 1)
+                source['label'] = "F{}".format(i + 1)
+            source['address'] = "127.0.0.1"
+            source['port'] = eventloop.run_until_complete(fake.start("127.0.0.1", 0))
+            sources.append(source)
+        config.sources = sources
+        config.local_process_management = { "enabled": False }
+
+    if config.record != None:
+        recorder = frame_recorder(config.record)
+    else:
+        recorder = None
+
     events.ws_event["new_disp_msg"].append(events.print_msg)
     events.ws_event["error_state"].append(events.print_msg)
 
-    # networking with ws client and json using requests
-    if config.debug_ws:
-        print("Enabling trace on websocket-client")
-        websocket.enableTrace(True)
-    wsc = ws_connector(config.address, config.port, config.username, config.password,
-                       reconnect=config.reconnect, reconnect_delay=config.reconnect_delay, debug=config.debug_ws)
-    jc = json_connector(config.address, config.port, config.username, config.password)
+    # networking with an asyncio ws client and asyncio rest client per kismet source, all on
+    # this eventloop. only the first source is recorded
+    wscs = []
+    jcs = []
+    for source in config.sources:
+        wscs.append(ws_connector(source['address'], source['port'], source['username'], source['password'],
+                                 source=source['name'], label=source['label'],
+                                 reconnect=config.reconnect, reconnect_delay=config.reconnect_delay,
+                                 fast_reconnect=config.fast_reconnect, reconnect_backoff=config.reconnect_backoff,
+                                 watchdog=config.watchdog, ping_interval=config.ping_interval,
+                                 alert_window=config.alert_window, message_rules=config.message_rules,
+                                 recorder=recorder if len(wscs) == 0 else None, debug=config.debug_ws))
+        jcs.append(json_connector(source['address'], source['port'], source['username'], source['password'],
+                                  source=source['name'],
+                                  timeout=config.rest_timeout, status_ttl=config.status_ttl,
+                                  device_sync=config.device_sync, device_poll=config.device_poll,
+                                  device_limit=config.device_limit, device_window=config.device_window,
+                                  recorder=recorder if len(jcs) == 0 else None))
+
+    # start connecting before the hardware is set up. events are held while the consumers
+    # register and dispatched in order once they all have, one pass of the eventloop starts
+    # the connections and the setup below runs while the name lookups are in flight
+    events.hold()
+    if config.debug: print("About to start ws tasks")
+    ws_tasks = [eventloop.create_task(wsc.ws_run()) for wsc in wscs]
+    eventloop.run_until_complete(asyncio.sleep(0))
 
     # local process manager
     if config.local_process_management['enabled']:
-        try:
-            import psutil
-        except:
-            print("Failed to load psutil python3 module, required for local process management")
-            sys.exit(1)
-        # handle process management
+        lpm = config.local_process_management
+        supervisor = kismet_supervisor(lpm['command'] if 'command' in lpm.keys() else ["kismet"],
+                                       name=lpm['process_name'] if 'process_name' in lpm.keys() else "kismet",
+                                       pidfile=lpm['pidfile'] if 'pidfile' in lpm.keys() else None,
+                                       manage=lpm['kismet_server'] if 'kismet_server' in lpm.keys() else True,
+                                       backoff=lpm['restart_backoff'] if 'restart_backoff' in lpm.keys() else (1, 60),
+                                       stop_timeout=lpm['stop_timeout'] if 'stop_timeout' in lpm.keys() else 10)
+    else:
+        supervisor = None
 
     # setup gpio
     if config.local_gpio['enabled']:
-        gpio = gpio_controller()
+        if 'fps' in config.local_gpio.keys() and config.local_gpio['fps'] > 0:
+            fps = config.local_gpio['fps']
+        else:
+            fps = 50
+        gpio = gpio_controller(fps, 'virtual' in config.local_gpio.keys() and config.local_gpio['virtual'])
 
         if 'input_buttons' in config.local_gpio.keys():
             if 'enabled' in config.local_gpio['input_buttons'].keys() and config.local_gpio['input_buttons']['enabled']:
-                if 'use_gpiozero' in config.local_gpio['input_buttons'].keys() and config.local_gpio['input_buttons']['use_gpiozero']:
+                if gpio.virtual:
+                    gpio.configure_buttons(config.local_gpio['input_buttons'], events)
+                elif 'use_gpiozero' in config.local_gpio['input_buttons'].keys() and config.local_gpio['input_buttons']['use_gpiozero']:
                     try:
                         from gpiozero import Button
                     except:
@@ -1038,7 +4626,9 @@ if __name__ == "__main__":
 
         if 'leds' in config.local_gpio.keys():
             if 'enabled' in config.local_gpio['leds'].keys() and config.local_gpio['leds']['enabled']:
-                if 'use_gpiozero' in config.local_gpio['leds'].keys() and config.local_gpio['leds']['use_gpiozero']:
+                if gpio.virtual:
+                    gpio.configure_leds(config.local_gpio['leds'], events)
+                elif 'use_gpiozero' in config.local_gpio['leds'].keys() and config.local_gpio['leds']['use_gpiozero']:
                     try:
                         from gpiozero import LED
                     except:
@@ -1059,16 +4649,17 @@ if __name__ == "__main__":
                 elif not 'pixels' in config.local_gpio['neopixels'].keys():
                     print("ERROR: In configuration 'neopixels' is enabled but 'pixels' is not defined. Skipping")
                 else:
-                    try:
-                        import board
-                    except:
-                        print("Failed to load board python3 module. Please install Adafruit-Blinka from pip.")
-                        sys.exit(1)
-                    try:
-                        import neopixel
-                    except:
-                        print("Failed to load neopixel python3 module. Please install adafruit-circuitpython-neopixel from pip")
-                        sys.exit(1)
+                    if not gpio.virtual:
+                        try:
+                            import board
+                        except:
+                            print("Failed to load board python3 module. Please install Adafruit-Blinka from pip.")
+                            sys.exit(1)
+                        try:
+                            import neopixel
+                        except:
+                            print("Failed to load neopixel python3 module. Please install adafruit-circuitpython-neopixel from pip")
+                            sys.exit(1)
                     gpio.configure_neopixel(config.local_gpio['neopixels'], events)
             else: print("'neopixels' disabled in config.")
         else:
@@ -1096,7 +4687,9 @@ if __name__ == "__main__":
             sys.exit(1)
 
         # check display driver and load modules accordingly
-        if config.i2c_display['driver'] == 'adafruit_ssd1306':
+        if config.i2c_display['driver'] == 'virtual':
+            i2c_driver_loaded = True
+        elif config.i2c_display['driver'] == 'adafruit_ssd1306':
             # setup for adafruit's ssd1306 driver
             try:
                 import busio, smbus
@@ -1137,46 +4730,136 @@ if __name__ == "__main__":
         # create display
         if i2c_driver_loaded:
             try:
-                display = i2c_controller(config.i2c_display['driver'], config.i2c_display['width'], config.i2c_display['height'], events, jc, wsc)
-            except:
+                display = i2c_controller(config.i2c_display['driver'], config.i2c_display['width'], config.i2c_display['height'], events, jcs, wscs)
+            except Exception as err:
                 traceback.print_tb(err.__traceback__)
                 print(err)
                 print("ERROR: Failed creating display for i2c_display!")
                 sys.exit(1)
         else:
             print("Incorrect setting for i2c_display 'driver': '{}'".format(config.i2c_display['driver']))
-            print("Supported drivers are: 'adafruit_ssd1306', 'luma.oled:ssd1306', 'luma.oled:sh1106'")
+            print("Supported drivers are: 'adafruit_ssd1306', 'luma.oled:ssd1306', 'luma.oled:sh1106', 'virtual'")
             sys.exit(1)
     else:
         display = None
 
-    # create thread for websocket
-    if config.debug: print("About to make ws thread")
-    ws_thread = threading.Thread(target=wsc.ws_run)
-    if config.debug: print("About to START ws thread")
-    ws_thread.start()
+    # system health sampled on the eventloop
+    if config.health['enabled']:
+        health_opts = {}
+        for key in ("disk_path", "thermal_zone", "temp_warn", "temp_crit", "margin", "hysteresis"):
+            if key in config.health.keys():
+                health_opts[key] = config.health[key]
+        if "interval" in config.health.keys():
+            health_opts["interval"] = tuple(config.health["interval"])
+        health = health_sampler(**health_opts)
+    else:
+        health = None
+
+    # status page and event stream for phones on the hotspot
+    if config.status_server['enabled']:
+        ss = config.status_server
+        status = status_server(events, jcs, wscs, health,
+                               max_rate=ss['max_rate'] if 'max_rate' in ss.keys() else 2,
+                               refresh=ss['refresh'] if 'refresh' in ss.keys() else 1,
+                               msg_count=ss['messages'] if 'messages' in ss.keys() else 8,
+                               keepalive=ss['keepalive'] if 'keepalive' in ss.keys() else 15)
+        if 'address' in ss.keys():
+            status_addr = ss['address']
+        else:
+            status_addr = "0.0.0.0"
+        if 'port' in ss.keys():
+            status_port = ss['port']
+        else:
+            status_port = 8080
+        try:
+            eventloop.run_until_complete(status.serve(status_addr, status_port))
+            print("Serving status on http://{}:{}/".format(status_addr, status_port))
+        except OSError as err:
+            print(err)
+            print("Failed to start status http server.")
+    else:
+        status = None
+
+    # metrics over http and/or a stats file
+    if config.metrics['enabled']:
+        metrics = metrics_registry(config.metrics['loop_lag_interval'] if 'loop_lag_interval' in config.metrics.keys() else 0.5)
+        register_metrics(wscs, jcs, display, gpio, health, status)
+        metrics.start()
+        if 'port' in config.metrics.keys() and config.metrics['port']:
+            if 'address' in config.metrics.keys():
+                metrics_addr = config.metrics['address']
+            else:
+                metrics_addr = "127.0.0.1"
+            try:
+                eventloop.run_until_complete(metrics.serve(metrics_addr, config.metrics['port']))
+                print("Serving metrics on http://{}:{}/metrics".format(metrics_addr, config.metrics['port']))
+            except OSError as err:
+                print(err)
+                print("Failed to start metrics http server.")
+        if 'stats_file' in config.metrics.keys() and config.metrics['stats_file']:
+            if 'stats_interval' in config.metrics.keys():
+                stats_interval = config.metrics['stats_interval']
+            else:
+                stats_interval = 10
+            eventloop.call_later(stats_interval, metrics.write_stats_file, config.metrics['stats_file'], stats_interval)
+
+    # every event consumer is registered now
+    events.release()
+
+    # self tests run on the eventloop while the websocket connects
+    if display != None:
+        eventloop.create_task(display.self_test())
+    if gpio != None and gpio.np_running:
+        eventloop.create_task(gpio.pixel_test())
+    if health != None:
+        health.start()
+    if supervisor != None:
+        supervisor.start()
+    # a replay stops the eventloop once the capture has been processed
+    if len(fakes) > 0:
+        eventloop.create_task(replay_report(fakes, wscs, jcs))
     try:
-        # run io in main thread
+        # run io and websocket in main thread
         if config.debug:
             print("eventloop run_forever in main thread")
         eventloop.run_forever()
     except KeyboardInterrupt:
-        # deinit pixels
-        if gpio.np_running:
-            try:
-                gpio.pixels.deinit()
-            except Exception as err:
-                if config.debug:
-                    traceback.print_tb(err.__traceback__)
-                print(err)
-                print("Error trying to deinit neopixels.")
-        # clear i2c display
-        if display != None:
-            display.clear_screen()
-        # shutdown thread
+        pass
+    print_virtual_stats(display, gpio)
+    # deinit pixels
+    if gpio != None and gpio.np_running:
+        try:
+            gpio.pixels.deinit()
+        except Exception as err:
+            if config.debug:
+                traceback.print_tb(err.__traceback__)
+            print(err)
+            print("Error trying to deinit neopixels.")
+    # clear i2c display
+    if display != None:
+        display.clear_screen()
+    # shutdown websocket tasks
+    for wsc in wscs:
         wsc.reconnect = False
-        wsc.ws.close()
-        # wait for thread
-        ws_thread.join()
-    # both threads finished
+    for ws_task in ws_tasks:
+        ws_task.cancel()
+    eventloop.run_until_complete(asyncio.gather(*ws_tasks, return_exceptions=True))
+    for jc in jcs:
+        jc.stop_sync()
+        jc.rest.close()
+    if recorder != None:
+        recorder.close()
+    for fake in fakes:
+        fake.close()
+    if status != None:
+        status.close()
+    if health != None:
+        health.close()
+    if supervisor != None:
+        if 'stop_on_exit' in config.local_process_management.keys() and config.local_process_management['stop_on_exit']:
+            eventloop.run_until_complete(supervisor.stop())
+        else:
+            supervisor.close()
+    if tracer != None:
+        tracer.dump()
     print("Program finished.")